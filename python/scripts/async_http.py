@@ -0,0 +1,170 @@
+"""
+Минимальный HTTP/1.1 поверх asyncio streams для нагрузочного теста и локальной заглушки.
+
+Только стандартная библиотека: keep-alive соединения, тела по Content-Length и chunked,
+multipart/form-data. Не заменяет полноценный HTTP-клиент — ровно то, что нужно для
+обращения к API парсинга и эмуляции Document Intelligence.
+"""
+import asyncio
+import ssl
+import uuid
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Ограничение размера строки заголовка
+_MAX_LINE = 64 * 1024
+
+
+class HttpMessage(NamedTuple):
+    """Запрос или ответ: стартовая строка, заголовки (имена в нижнем регистре) и тело."""
+    start_line: str
+    headers: Dict[str, str]
+    body: bytes
+
+
+class Response(NamedTuple):
+    """Ответ сервера."""
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+async def read_message(reader: asyncio.StreamReader, has_body: bool = True) -> Optional[HttpMessage]:
+    """Чтение сообщения HTTP/1.1; None, если соединение закрыто до начала сообщения."""
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if len(line) > _MAX_LINE:
+            raise ValueError("Слишком длинная строка заголовка")
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    body = b""
+    if not has_body:
+        return HttpMessage(start_line.decode("latin-1").rstrip("\r\n"), headers, body)
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    elif start_line.startswith(b"HTTP/"):
+        # Ответ без длины: тело до закрытия соединения
+        body = await reader.read()
+    return HttpMessage(start_line.decode("latin-1").rstrip("\r\n"), headers, body)
+
+
+def format_message(start_line: str, headers: Dict[str, str], body: bytes = b"") -> bytes:
+    """Сообщение HTTP/1.1 с Content-Length."""
+    lines = [start_line] + [f"{name}: {value}" for name, value in headers.items()]
+    lines.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def multipart_body(files: List[Tuple[str, str, str, bytes]]) -> Tuple[str, bytes]:
+    """Тело multipart/form-data из (имя поля, имя файла, content-type, байты); возвращает content-type и тело."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, file_name, content_type, data in files:
+        parts.append(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; "
+                     f"filename=\"{file_name}\"\r\nContent-Type: {content_type}\r\n\r\n".encode("utf-8"))
+        parts.append(data)
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode("ascii"))
+    return f"multipart/form-data; boundary={boundary}", b"".join(parts)
+
+
+class HttpConnection:
+    """
+    Одно keep-alive соединение с сервером; запросы по нему идут последовательно.
+
+    Разорванное сервером соединение переоткрывается при следующем запросе.
+    """
+
+    def __init__(self, url: str, verify_tls: bool = True):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.secure = parts.scheme == "https"
+        self.port = parts.port or (443 if self.secure else 80)
+        self.ssl_context = None
+        if self.secure:
+            self.ssl_context = ssl.create_default_context()
+            if not verify_tls:
+                self.ssl_context.check_hostname = False
+                self.ssl_context.verify_mode = ssl.CERT_NONE
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl_context)
+
+    async def request(self, method: str, path: str, headers: Optional[Dict[str, str]] = None,
+                      body: bytes = b"") -> Response:
+        if self._writer is None:
+            await self._connect()
+        all_headers = {"Host": f"{self.host}:{self.port}", **(headers or {})}
+        self._writer.write(format_message(f"{method} {path} HTTP/1.1", all_headers, body))
+        try:
+            await self._writer.drain()
+            message = await read_message(self._reader, has_body=method != "HEAD")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            await self.close()
+            raise
+        if message is None:
+            await self.close()
+            raise ConnectionResetError("Соединение закрыто сервером")
+        if message.headers.get("connection", "").lower() == "close":
+            await self.close()
+        status = int(message.start_line.split(" ", 2)[1])
+        return Response(status, message.headers, message.body)
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, ssl.SSLError):
+                pass
+        self._reader = self._writer = None
+
+
+Handler = Callable[[str, str, Dict[str, str], bytes], Awaitable[Tuple[int, Dict[str, str], bytes]]]
+
+_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+            500: "Internal Server Error"}
+
+
+async def serve(handler: Handler, host: str, port: int) -> asyncio.AbstractServer:
+    """
+    HTTP/1.1 сервер с keep-alive: handler(метод, путь, заголовки, тело) -> (статус, заголовки, тело).
+    """
+    async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                method, path, _ = message.start_line.split(" ", 2)
+                status, headers, body = await handler(method, path, message.headers, message.body)
+                writer.write(format_message(f"HTTP/1.1 {status} {_REASONS.get(status, 'Status')}", headers, body))
+                await writer.drain()
+                if message.headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_connection, host, port)
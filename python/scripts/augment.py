@@ -0,0 +1,333 @@
+"""
+Пакетная аугментация объединенного датасета с пересчетом боксов.
+
+Для каждого изображения создается copies вариантов: геометрия (поворот, масштаб, сдвиг,
+перспективное искажение — как при съемке телефоном) и фотометрия (размытие, смаз, яркость
+и контраст, шум, качество JPEG). Параметры каждого варианта определяются seed, ID изображения
+и номером варианта, поэтому результат не зависит от числа воркеров и размера пакета.
+
+Изображения обрабатываются пакетами: родительский процесс выбирает параметры и пересчитывает
+боксы всего пакета одним векторным вызовом (углы боксов через матрицы преобразования, обрезка
+по кадру, отбрасывание боксов с малой видимой долей), пул процессов деформирует пиксели и
+сохраняет изображения, а аннотации пишутся потоково (CocoStreamWriter) по мере готовности.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from coco_stream import CocoStreamWriter, iter_coco
+
+# Базовый путь к проекту (переопределяется переменной окружения OCR_POC_BASE)
+BASE_PATH = Path(os.environ.get("OCR_POC_BASE", r"C:\Miral\OCR_PoC"))
+DATASET_PATH = BASE_PATH / "data" / "eid-field-boxes"
+OUTPUT_PATH = BASE_PATH / "data" / "eid-field-boxes-aug"
+
+SPLITS = ["train", "valid", "test"]
+
+DEFAULT_BATCH_SIZE = 64
+
+# Параметры воркера, передаются один раз через initializer пула
+_worker_state: Dict = {}
+
+
+@dataclass
+class AugmentConfig:
+    """Диапазоны случайных преобразований."""
+    max_rotation: float = 8.0            # градусы
+    scale: Tuple[float, float] = (0.9, 1.1)
+    max_translate: float = 0.05          # доля размера изображения
+    perspective: float = 0.06            # смещение углов, доля размера изображения
+    blur_prob: float = 0.3
+    max_blur_sigma: float = 1.5
+    motion_blur_prob: float = 0.2
+    max_motion_length: int = 9           # пикселей
+    brightness: float = 0.2              # сдвиг яркости, доля диапазона
+    contrast: float = 0.2                # отклонение множителя контраста
+    max_noise_sigma: float = 6.0
+    jpeg_quality: Tuple[int, int] = (55, 95)
+    min_visibility: float = 0.6          # минимальная доля площади бокса, оставшаяся в кадре
+    min_size: float = 2.0                # минимальная ширина и высота бокса после обрезки, пикселей
+
+
+@dataclass
+class AugmentStats:
+    """Статистика аугментации."""
+    images: int = 0
+    annotations: int = 0
+    dropped_boxes: int = 0
+    clipped_boxes: int = 0
+    seconds: float = 0.0
+    errors: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def images_per_second(self) -> float:
+        return self.images / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.images} изображений, {self.annotations} аннотаций за {self.seconds:.2f} с "
+                f"({self.images_per_second:.1f} изображений/с), боксов обрезано: {self.clipped_boxes}, "
+                f"отброшено: {self.dropped_boxes}, ошибок: {len(self.errors)}")
+
+
+def variant_rng(seed: int, image_id: int, copy: int) -> np.random.Generator:
+    """Генератор варианта: зависит только от seed, ID изображения и номера варианта."""
+    return np.random.default_rng([seed, image_id, copy])
+
+
+def sample_variant(rng: np.random.Generator, config: AugmentConfig, width: int, height: int) -> Dict:
+    """Случайные параметры одного варианта: матрица 3x3 и фотометрия."""
+    angle = rng.uniform(-config.max_rotation, config.max_rotation)
+    scale = rng.uniform(*config.scale)
+    shift = rng.uniform(-config.max_translate, config.max_translate, 2) * (width, height)
+    affine = np.eye(3)
+    affine[:2] = cv2.getRotationMatrix2D((width / 2, height / 2), angle, scale)
+    affine[:2, 2] += shift
+
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    jitter = rng.uniform(-config.perspective, config.perspective, (4, 2)) * (width, height)
+    perspective = cv2.getPerspectiveTransform(corners, (corners + jitter).astype(np.float32))
+
+    return {
+        "matrix": perspective @ affine,
+        "blur_sigma": rng.uniform(0.3, config.max_blur_sigma) if rng.random() < config.blur_prob else 0.0,
+        "motion": ((int(rng.integers(3, config.max_motion_length + 1)), float(rng.uniform(0, 180)))
+                   if rng.random() < config.motion_blur_prob else None),
+        "alpha": 1 + rng.uniform(-config.contrast, config.contrast),
+        "beta": 255 * rng.uniform(-config.brightness, config.brightness),
+        "noise_sigma": rng.uniform(0, config.max_noise_sigma),
+        "noise_seed": int(rng.integers(2 ** 31)),
+        "quality": int(rng.integers(config.jpeg_quality[0], config.jpeg_quality[1] + 1)),
+    }
+
+
+def transform_points(points: np.ndarray, matrices: np.ndarray) -> np.ndarray:
+    """Точки (N, K, 2) через матрицы (N, 3, 3) — у каждой строки своя матрица."""
+    homogeneous = np.concatenate([points, np.ones(points.shape[:2] + (1,))], axis=2)
+    projected = np.einsum("nij,nkj->nki", matrices, homogeneous)
+    return projected[..., :2] / projected[..., 2:3]
+
+
+def transform_boxes(boxes: np.ndarray, matrices: np.ndarray) -> np.ndarray:
+    """
+    Боксы [x, y, w, h] через матрицы (N, 3, 3): описанные прямоугольники [x1, y1, x2, y2]
+    преобразованных углов.
+    """
+    x, y, w, h = boxes.T
+    corners = np.stack([np.stack([x, y], 1), np.stack([x + w, y], 1),
+                        np.stack([x + w, y + h], 1), np.stack([x, y + h], 1)], axis=1)
+    points = transform_points(corners, matrices)
+    return np.concatenate([points.min(axis=1), points.max(axis=1)], axis=1)
+
+
+def clip_boxes(corners: np.ndarray, widths: np.ndarray, heights: np.ndarray, min_visibility: float,
+               min_size: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Обрезка боксов [x1, y1, x2, y2] по кадру (размеры кадра — на каждый бокс).
+
+    Возвращает боксы [x, y, w, h], маску сохраняемых (видимая доля площади не меньше
+    min_visibility и стороны не меньше min_size) и маску обрезанных.
+    """
+    clipped = np.clip(corners, 0, np.stack([widths, heights, widths, heights], axis=1))
+    area = (corners[:, 2] - corners[:, 0]) * (corners[:, 3] - corners[:, 1])
+    sizes = clipped[:, 2:] - clipped[:, :2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        visibility = np.where(area > 0, sizes.prod(axis=1) / area, 0.0)
+    keep = (visibility >= min_visibility) & (sizes >= min_size).all(axis=1)
+    changed = (clipped != corners).any(axis=1)
+    return np.concatenate([clipped[:, :2], sizes], axis=1), keep, changed & keep
+
+
+def _transform_segmentation(segmentation, matrix: np.ndarray, width: int, height: int):
+    """Полигоны сегментации через матрицу с обрезкой по кадру; RLE и пустые — без изменений."""
+    if not isinstance(segmentation, list) or not segmentation:
+        return segmentation
+    result = []
+    for polygon in segmentation:
+        points = transform_points(np.asarray(polygon, dtype=np.float64).reshape(1, -1, 2), matrix[None])[0]
+        np.clip(points, 0, (width, height), out=points)
+        result.append(np.round(points, 2).ravel().tolist())
+    return result
+
+
+def apply_photometric(img: np.ndarray, variant: Dict) -> np.ndarray:
+    """Размытие, смаз, яркость/контраст и шум."""
+    if variant["blur_sigma"] > 0:
+        img = cv2.GaussianBlur(img, (0, 0), variant["blur_sigma"])
+    if variant["motion"]:
+        length, angle = variant["motion"]
+        kernel = np.zeros((length, length), dtype=np.float32)
+        kernel[length // 2] = 1.0 / length
+        rotation = cv2.getRotationMatrix2D(((length - 1) / 2, (length - 1) / 2), angle, 1.0)
+        kernel = cv2.warpAffine(kernel, rotation, (length, length))
+        img = cv2.filter2D(img, -1, kernel / max(kernel.sum(), 1e-6))
+    img = cv2.convertScaleAbs(img, alpha=variant["alpha"], beta=variant["beta"])
+    if variant["noise_sigma"] > 0:
+        noise = np.random.default_rng(variant["noise_seed"]).normal(0, variant["noise_sigma"], img.shape)
+        img = np.clip(img + noise, 0, 255).astype(np.uint8)
+    return img
+
+
+def _init_worker(output_dir: str) -> None:
+    _worker_state["output_dir"] = output_dir
+
+
+def _augment_task(task: Tuple[str, List[Tuple[str, Dict]]]) -> Tuple[str, Optional[str]]:
+    """Все варианты одного изображения в воркере: одно чтение, деформация и фотометрия каждого."""
+    image_path, variants = task
+    img = cv2.imread(image_path)
+    if img is None:
+        return image_path, "не удалось прочитать изображение"
+    height, width = img.shape[:2]
+    for file_name, variant in variants:
+        warped = cv2.warpPerspective(img, variant["matrix"], (width, height), flags=cv2.INTER_LINEAR,
+                                     borderMode=cv2.BORDER_REPLICATE)
+        out = apply_photometric(warped, variant)
+        if not cv2.imwrite(os.path.join(_worker_state["output_dir"], file_name), out,
+                           [cv2.IMWRITE_JPEG_QUALITY, variant["quality"]]):
+            return image_path, "не удалось сохранить результат"
+    return image_path, None
+
+
+def _batches(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def augment_split(ann_file: Path, image_dir: Path, output_dir: Path, copies: int = 2, seed: int = 0,
+                  config: Optional[AugmentConfig] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                  workers: Optional[int] = None) -> AugmentStats:
+    """
+    Аугментация разбиения в output_dir: изображения {имя}_aug{k}.jpg и _annotations.coco.json
+    с теми же категориями. Изображения без сохранившихся боксов тоже пишутся (как негативы).
+    """
+    if copies < 1:
+        raise ValueError("copies должно быть не меньше 1")
+    config = config or AugmentConfig()
+    header: Dict = {}
+    images: List[Dict] = []
+    annotations_by_image: Dict[int, List[Dict]] = {}
+    for key, item in iter_coco(ann_file):
+        if key == "images":
+            images.append(item)
+        elif key == "annotations":
+            annotations_by_image.setdefault(item["image_id"], []).append(item)
+        else:
+            header[key] = item
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stats = AugmentStats()
+    next_image_id = next_annotation_id = 0
+    start = time.perf_counter()
+    with CocoStreamWriter(output_dir / "_annotations.coco.json", header) as writer, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(str(output_dir),)) as executor:
+        for batch in _batches(images, batch_size):
+            # Параметры вариантов пакета и пересчет всех его боксов одним вызовом
+            records, variants, box_rows = [], [], []
+            for img in batch:
+                width, height = img["width"], img["height"]
+                anns = annotations_by_image.get(img["id"], [])
+                for copy in range(copies):
+                    variant = sample_variant(variant_rng(seed, img["id"], copy), config, width, height)
+                    stem = Path(img["file_name"]).stem
+                    records.append((img, f"{stem}_aug{copy}.jpg", variant))
+                    box_rows.extend((len(records) - 1, ann) for ann in anns)
+                variants.append((str(image_dir / img["file_name"]),
+                                 [(file_name, variant) for _, file_name, variant in records[-copies:]]))
+
+            if box_rows:
+                boxes = np.array([ann["bbox"][:4] for _, ann in box_rows], dtype=np.float64).reshape(-1, 4)
+                rows = np.array([row for row, _ in box_rows])
+                matrices = np.stack([variant["matrix"] for _, _, variant in records])[rows]
+                dims = np.array([(img["width"], img["height"]) for img, _, _ in records], dtype=np.float64)[rows]
+                new_boxes, keep, clipped = clip_boxes(transform_boxes(boxes, matrices), dims[:, 0], dims[:, 1],
+                                                      config.min_visibility, config.min_size)
+            else:
+                new_boxes, keep, clipped = np.zeros((0, 4)), np.zeros(0, bool), np.zeros(0, bool)
+            stats.dropped_boxes += int((~keep).sum())
+            stats.clipped_boxes += int(clipped.sum())
+            boxes_by_record: Dict[int, List[Tuple[Dict, List[float]]]] = {}
+            for (row, ann), box, kept in zip(box_rows, np.round(new_boxes, 2).tolist(), keep.tolist()):
+                if kept:
+                    boxes_by_record.setdefault(row, []).append((ann, box))
+
+            chunksize = max(1, len(variants) // ((workers or os.cpu_count() or 1) * 8))
+            results = executor.map(_augment_task, variants, chunksize=chunksize)
+            for index, (image_path, error) in enumerate(results):
+                if error is not None:
+                    stats.errors.append((image_path, error))
+                    continue
+                for row in range(index * copies, (index + 1) * copies):
+                    img, file_name, variant = records[row]
+                    writer.write("images", {**img, "id": next_image_id, "file_name": file_name,
+                                            "source_image": img["file_name"]})
+                    for ann, box in boxes_by_record.get(row, []):
+                        writer.write("annotations", {
+                            **ann, "id": next_annotation_id, "image_id": next_image_id, "bbox": box,
+                            "area": round(box[2] * box[3], 2),
+                            "segmentation": _transform_segmentation(ann.get("segmentation"), variant["matrix"],
+                                                                    img["width"], img["height"]),
+                        })
+                        next_annotation_id += 1
+                        stats.annotations += 1
+                    next_image_id += 1
+                    stats.images += 1
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    defaults = AugmentConfig()
+    parser = argparse.ArgumentParser(description="Аугментация объединенного датасета Emirates ID с пересчетом боксов")
+    parser.add_argument("--splits", nargs="+", default=["train"])
+    parser.add_argument("--copies", type=int, default=2, help="Вариантов на изображение")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-rotation", type=float, default=defaults.max_rotation, help="Градусы")
+    parser.add_argument("--scale", type=float, nargs=2, default=defaults.scale, metavar=("MIN", "MAX"))
+    parser.add_argument("--max-translate", type=float, default=defaults.max_translate)
+    parser.add_argument("--perspective", type=float, default=defaults.perspective,
+                        help="Смещение углов (доля размера изображения)")
+    parser.add_argument("--blur-prob", type=float, default=defaults.blur_prob)
+    parser.add_argument("--motion-blur-prob", type=float, default=defaults.motion_blur_prob)
+    parser.add_argument("--brightness", type=float, default=defaults.brightness)
+    parser.add_argument("--contrast", type=float, default=defaults.contrast)
+    parser.add_argument("--max-noise", type=float, default=defaults.max_noise_sigma)
+    parser.add_argument("--jpeg-quality", type=int, nargs=2, default=defaults.jpeg_quality, metavar=("MIN", "MAX"))
+    parser.add_argument("--min-visibility", type=float, default=defaults.min_visibility,
+                        help="Бокс отбрасывается, если в кадре осталась меньшая доля его площади")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--output", type=Path, default=OUTPUT_PATH)
+    parser.add_argument("--workers", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    config = AugmentConfig(max_rotation=args.max_rotation, scale=tuple(args.scale), max_translate=args.max_translate,
+                           perspective=args.perspective, blur_prob=args.blur_prob,
+                           motion_blur_prob=args.motion_blur_prob, brightness=args.brightness,
+                           contrast=args.contrast, max_noise_sigma=args.max_noise,
+                           jpeg_quality=tuple(args.jpeg_quality), min_visibility=args.min_visibility)
+    for split in args.splits:
+        ann_file = DATASET_PATH / split / "_annotations.coco.json"
+        if not ann_file.exists():
+            print(f"Файл аннотаций не найден: {ann_file}")
+            continue
+        print(f"Аугментация разбиения {split} ({args.copies} вариантов на изображение, seed {args.seed})...")
+        stats = augment_split(ann_file, ann_file.parent, args.output / split, args.copies, args.seed, config,
+                              args.batch_size, args.workers)
+        print(f"  {stats.summary()}")
+        for image_path, error in stats.errors[:10]:
+            print(f"  Ошибка: {image_path}: {error}")
+    print(f"Аугментированный датасет сохранен в: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Пакетная отрисовка боксов на изображениях датасета через пул процессов.
+
+Вместо фигуры matplotlib на каждое изображение боксы рисуются средствами OpenCV прямо
+на загруженном изображении и сразу сохраняются.
+"""
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from box_index import place_labels
+from coco_index import CocoIndex
+from image_cache import CacheStats, ImageCache
+
+# Режимы выбора изображений
+RENDER_MODES = ("all", "per-source", "anomalies")
+
+# Параметры воркера, передаются один раз через initializer пула
+_worker_state: Dict = {}
+
+
+@dataclass
+class RenderStats:
+    """Статистика пакетной отрисовки."""
+    rendered: int = 0
+    seconds: float = 0.0
+    errors: List[Tuple[str, str]] = field(default_factory=list)
+    image_cache: Optional[CacheStats] = None
+
+    @property
+    def images_per_second(self) -> float:
+        return self.rendered / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        text = (f"{self.rendered} изображений за {self.seconds:.2f} с "
+                f"({self.images_per_second:.1f} изображений/с), ошибок: {len(self.errors)}")
+        if self.image_cache is not None:
+            text += f"; кэш изображений: {self.image_cache.summary()}"
+        return text
+
+
+def to_bgr(color: Tuple[float, float, float]) -> Tuple[int, int, int]:
+    """Нормализованный RGB (как в CATEGORY_COLORS) -> BGR 0..255 для OpenCV."""
+    r, g, b = color
+    return int(b * 255), int(g * 255), int(r * 255)
+
+
+def draw_boxes(img: np.ndarray, boxes: Sequence[Tuple[int, Sequence[float]]], category_names: Dict[int, str],
+               colors: Dict[int, Tuple[float, float, float]], labels: bool = True) -> np.ndarray:
+    """
+    Отрисовка боксов и подписей категорий на BGR изображении (изменяет img на месте).
+
+    Подписи размещаются через пространственный индекс боксов (box_index.place_labels) так,
+    чтобы не перекрывать друг друга и соседние боксы на плотной лицевой стороне.
+    labels=False рисует только рамки — для миниатюр, где подписи нечитаемы.
+    """
+    height, width = img.shape[:2]
+    scale = max(min(height, width) / 800.0, 0.4)
+    thickness = max(int(round(2 * scale)), 1)
+    font_scale = 0.5 * scale
+    for cat_id, (x, y, w, h) in boxes:
+        color = to_bgr(colors.get(cat_id, (0, 0, 0)))
+        x1, y1, x2, y2 = int(round(x)), int(round(y)), int(round(x + w)), int(round(y + h))
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, thickness)
+    if not labels or not boxes:
+        return img
+
+    # Подписи на белой подложке: размеры текста, затем размещение без наложений
+    texts = [category_names.get(cat_id, str(cat_id)) for cat_id, _ in boxes]
+    metrics = [cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness) for text in texts]
+    label_sizes = [(text_w, text_h + 2 * baseline) for (text_w, text_h), baseline in metrics]
+    positions = place_labels(np.array([bbox[:4] for _, bbox in boxes], dtype=np.float64), label_sizes,
+                             (width, height))
+    for (cat_id, _), text, ((_, text_h), baseline), (lx, ly, lw, lh) in zip(boxes, texts, metrics, positions):
+        lx, ly = int(round(lx)), int(round(ly))
+        cv2.rectangle(img, (lx, ly), (lx + int(lw), ly + int(lh)), (255, 255, 255), cv2.FILLED)
+        cv2.putText(img, text, (lx, ly + baseline + text_h), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                    to_bgr(colors.get(cat_id, (0, 0, 0))), thickness, cv2.LINE_AA)
+    return img
+
+
+def _init_worker(category_names: Dict[int, str], colors: Dict[int, Tuple[float, float, float]],
+                 image_cache_dir: Optional[str] = None) -> None:
+    _worker_state["category_names"] = category_names
+    _worker_state["colors"] = colors
+    if image_cache_dir:
+        cache = ImageCache(Path(image_cache_dir), store_decoded=True)
+        # Карта путей кэша сохраняется при завершении воркера
+        Finalize(cache, cache.close, exitpriority=10)
+        _worker_state["image_cache"] = cache
+
+
+def _render_task(task: Tuple[str, str, List[Tuple[int, List[float]]]]) -> Tuple[str, Optional[str],
+                                                                                 Optional[CacheStats]]:
+    """Отрисовка одного изображения в воркере: загрузка (из кэша изображений, если он задан), боксы, сохранение."""
+    image_path, save_path, boxes = task
+    cache: Optional[ImageCache] = _worker_state.get("image_cache")
+    cache_stats = None
+    if cache is not None:
+        cache.stats = cache_stats = CacheStats()
+        rgb = cache.decoded(Path(image_path))
+        img = cv2.cvtColor(np.asarray(rgb), cv2.COLOR_RGB2BGR) if rgb is not None else None
+    else:
+        img = cv2.imread(image_path)
+    if img is None:
+        return image_path, "не удалось прочитать изображение", cache_stats
+    draw_boxes(img, boxes, _worker_state["category_names"], _worker_state["colors"])
+    if not cv2.imwrite(save_path, img):
+        return image_path, "не удалось сохранить результат", cache_stats
+    return image_path, None, cache_stats
+
+
+def valid_bbox(bbox) -> bool:
+    """Бокс COCO из четырех чисел [x, y, w, h]."""
+    return isinstance(bbox, (list, tuple)) and len(bbox) == 4 and all(isinstance(v, (int, float)) for v in bbox)
+
+
+def find_anomalies(index: CocoIndex) -> Dict[int, List[str]]:
+    """
+    Поиск изображений с подозрительной разметкой: без аннотаций, с некорректными боксами
+    (не четыре числа), боксами нулевой площади или выходящими за границы изображения.
+    """
+    anomalies: Dict[int, List[str]] = {}
+    for img_id, img in index.images.items():
+        issues = []
+        anns = index.annotations_by_image.get(img_id, [])
+        if not anns:
+            issues.append("no_annotations")
+        width, height = img.width, img.height
+        for ann in anns:
+            if not valid_bbox(ann.bbox):
+                issues.append(f"malformed_bbox:{ann.id}")
+                continue
+            x, y, w, h = ann.bbox
+            if w <= 0 or h <= 0:
+                issues.append(f"zero_area:{ann.id}")
+            elif width and height and (x < 0 or y < 0 or x + w > width or y + h > height):
+                issues.append(f"out_of_bounds:{ann.id}")
+        if issues:
+            anomalies[img_id] = issues
+    return anomalies
+
+
+def select_images(index: CocoIndex, mode: str, per_source: int = 5, seed: Optional[int] = None,
+                  anomalies: Optional[Dict[int, List[str]]] = None) -> List[int]:
+    """
+    Выбор изображений для отрисовки: все, N на источник или только с аномалиями
+    (anomalies — уже найденные find_anomalies, чтобы не искать повторно).
+    """
+    if mode == "all":
+        return list(index.images)
+    if mode == "per-source":
+        rng = random.Random(seed)
+        selected = []
+        for source in sorted(index.images_by_source):
+            ids = index.images_by_source[source]
+            selected.extend(rng.sample(ids, min(per_source, len(ids))))
+        return selected
+    if mode == "anomalies":
+        return list(anomalies if anomalies is not None else find_anomalies(index))
+    raise ValueError(f"Неизвестный режим отрисовки: {mode}")
+
+
+def render_images(index: CocoIndex, image_ids: Sequence[int], image_dir: Path, output_dir: Path,
+                  colors: Dict[int, Tuple[float, float, float]], workers: Optional[int] = None,
+                  image_cache_dir: Optional[Path] = None) -> RenderStats:
+    """
+    Отрисовка выбранных изображений разбиения через пул процессов; image_cache_dir — каталог
+    общего кэша изображений (None — декодирование исходников).
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tasks = []
+    for img_id in image_ids:
+        img = index.images[img_id]
+        # Некорректные боксы не рисуются (в режиме anomalies они попадают в отчет)
+        boxes = [(ann.category_id, list(ann.bbox)) for ann in index.annotations_by_image.get(img_id, [])
+                 if valid_bbox(ann.bbox)]
+        tasks.append((str(image_dir / img.file_name), str(output_dir / img.file_name), boxes))
+
+    stats = RenderStats()
+    if not tasks:
+        return stats
+
+    if image_cache_dir is not None:
+        stats.image_cache = CacheStats()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(dict(index.category_names), dict(colors),
+                                       str(image_cache_dir) if image_cache_dir else None)) as executor:
+        chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 8))
+        for image_path, error, cache_stats in executor.map(_render_task, tasks, chunksize=chunksize):
+            if cache_stats is not None:
+                stats.image_cache.merge(cache_stats)
+            if error is None:
+                stats.rendered += 1
+            else:
+                stats.errors.append((image_path, error))
+    stats.seconds = time.perf_counter() - start
+    return stats
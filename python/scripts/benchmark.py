@@ -0,0 +1,186 @@
+"""
+Бенчмарк скриптов датасета на синтетических данных (synthetic_coco).
+
+Каждый этап запускается в отдельном процессе с OCR_POC_BASE, указывающим на рабочий каталог:
+так пиковая память процесса относится только к этапу, а модульные пути скриптов — к
+синтетическим данным. Результат (время и пиковая память по этапам) сохраняется в JSON,
+который можно сравнить с предыдущим запуском через --compare.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from synthetic_coco import generate_dataset
+
+BENCHMARK_VERSION = 1
+
+STAGES = ("merge", "statistics", "coverage", "visualization", "pdf")
+
+
+def _peak_rss_mb() -> Dict[str, Optional[float]]:
+    """Пиковая память процесса этапа и его дочерних процессов (пулов), MB; None без модуля resource."""
+    try:
+        import resource
+    except ImportError:
+        return {"peak_rss_mb": None, "children_peak_rss_mb": None}
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor, 1),
+        "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor, 1),
+    }
+
+
+def _run_stage(stage: str, params: Dict) -> None:
+    """Тело этапа; выполняется в дочернем процессе после установки OCR_POC_BASE."""
+    if stage == "merge":
+        import merge_coco_datasets
+        merge_coco_datasets.merge_datasets(workers=params["workers"], full_rebuild=True)
+        merge_coco_datasets.create_dataset_info()
+    elif stage == "statistics":
+        import visualize_unified_dataset_simple
+        for split in visualize_unified_dataset_simple.SPLITS:
+            visualize_unified_dataset_simple.analyze_dataset_statistics(split)
+    elif stage == "coverage":
+        import visualize_unified_dataset_simple
+        visualize_unified_dataset_simple.analyze_category_coverage()
+    elif stage == "visualization":
+        import visualize_unified_dataset
+        visualize_unified_dataset.render_split("train", "per-source", per_source=params["render_per_source"],
+                                               workers=params["workers"], seed=0)
+    elif stage == "pdf":
+        import create_pdf_dataset
+        create_pdf_dataset.generate_pdf_dataset(count=params["pdf_count"], seed=0, workers=params["workers"])
+    else:
+        raise ValueError(f"Неизвестный этап: {stage}")
+
+
+def _stage_child(stage: str, params_json: str, result_path: str) -> None:
+    """Точка входа дочернего процесса: вывод этапа подавляется, результат пишется в файл."""
+    params = json.loads(params_json)
+    logging.disable(logging.INFO)
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        _run_stage(stage, params)
+        seconds = time.perf_counter() - start
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump({"seconds": round(seconds, 3), **_peak_rss_mb()}, f)
+
+
+def run_stage(stage: str, workdir: Path, params: Dict) -> Dict:
+    """Запуск этапа в отдельном процессе."""
+    env = dict(os.environ, OCR_POC_BASE=str(workdir))
+    result_path = workdir / f".benchmark_{stage}.json"
+    subprocess.run([sys.executable, str(Path(__file__).resolve()), "--child", stage, json.dumps(params),
+                    str(result_path)], env=env, cwd=str(Path(__file__).resolve().parent), check=True)
+    with open(result_path, "r", encoding="utf-8") as f:
+        result = json.load(f)
+    result_path.unlink()
+    return result
+
+
+def run_benchmark(annotations: int, stages: List[str], workdir: Optional[Path] = None,
+                  workers: Optional[int] = None, render_per_source: int = 50, pdf_count: int = 200,
+                  seed: int = 0, keep: bool = False) -> Dict:
+    """Генерация синтетического датасета и замер выбранных этапов."""
+    own_workdir = workdir is None
+    workdir = Path(tempfile.mkdtemp(prefix="ocr_poc_bench_")) if own_workdir else workdir
+    params = {"workers": workers, "render_per_source": render_per_source, "pdf_count": pdf_count}
+    try:
+        data_path = workdir / "data"
+        shutil.rmtree(data_path, ignore_errors=True)
+        print(f"Генерация синтетического датасета ({annotations} аннотаций) в {data_path}...")
+        dataset = generate_dataset(data_path, annotations, seed=seed)
+        print(f"  {dataset.summary()}")
+
+        results = {}
+        for stage in stages:
+            print(f"Этап {stage}...")
+            results[stage] = run_stage(stage, workdir, params)
+            print(f"  {results[stage]['seconds']:.2f} с, пиковая память: {results[stage]['peak_rss_mb']} MB")
+    finally:
+        if own_workdir and not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "version": BENCHMARK_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {"annotations": annotations, "seed": seed, **params},
+        "dataset": {"images": dataset.images, "annotations": dataset.annotations,
+                    "image_bytes": dataset.image_bytes, "generate_seconds": round(dataset.seconds, 3)},
+        "stages": results,
+    }
+
+
+def compare(current: Dict, baseline: Dict) -> None:
+    """Сравнение с базовой линией: отношение времени и памяти по этапам (< 1 — лучше)."""
+    if current["config"] != baseline.get("config"):
+        print("Внимание: конфигурация базовой линии отличается от текущей")
+    print(f"\n{'Этап':<15} {'время, с':>10} {'база, с':>10} {'x':>6} {'память, MB':>12} {'база, MB':>10} {'x':>6}")
+    for stage, result in current["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base is None:
+            print(f"{stage:<15} {result['seconds']:>10.2f} {'-':>10}")
+            continue
+        time_ratio = result["seconds"] / base["seconds"] if base["seconds"] else float("nan")
+        mem, base_mem = result.get("peak_rss_mb"), base.get("peak_rss_mb")
+        mem_ratio = f"{mem / base_mem:>6.2f}" if mem and base_mem else f"{'-':>6}"
+        print(f"{stage:<15} {result['seconds']:>10.2f} {base['seconds']:>10.2f} {time_ratio:>6.2f} "
+              f"{mem if mem is not None else '-':>12} {base_mem if base_mem is not None else '-':>10} {mem_ratio}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк скриптов датасета Emirates ID на синтетических данных")
+    parser.add_argument("--annotations", type=int, default=10000,
+                        help="Общее число аннотаций синтетического датасета (1e3 .. 1e6)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--workdir", type=Path, default=None,
+                        help="Рабочий каталог (по умолчанию временный, удаляется после запуска)")
+    parser.add_argument("--keep", action="store_true", help="Не удалять временный рабочий каталог")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--render-per-source", type=int, default=50)
+    parser.add_argument("--pdf-count", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=Path("benchmark_results.json"),
+                        help="Файл результата")
+    parser.add_argument("--compare", type=Path, default=None, help="Базовая линия для сравнения")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["--child"]:
+        _stage_child(*argv[1:4])
+        return
+
+    args = parse_args(argv)
+    result = run_benchmark(args.annotations, args.stages, workdir=args.workdir, workers=args.workers,
+                           render_per_source=args.render_per_source, pdf_count=args.pdf_count,
+                           seed=args.seed, keep=args.keep)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"\nРезультаты сохранены в: {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
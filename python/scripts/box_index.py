@@ -0,0 +1,268 @@
+"""
+Пространственный индекс боксов одного изображения: статическое R-дерево с упаковкой STR
+(Sort-Tile-Recursive), построенное на NumPy.
+
+Боксы сортируются по центру x, режутся на вертикальные полосы, внутри полос сортируются
+по центру y и группируются в узлы по node_size; уровни выше строятся так же из границ узлов.
+Запросы спускаются по дереву уровень за уровнем сразу для всех запросов пакета: на каждом
+уровне проверяются только потомки узлов, прошедших проверку, поэтому число проверок растет
+с числом найденных боксов, а не с общим числом боксов.
+
+Запросы: пересечение с прямоугольником, боксы внутри прямоугольника, боксы, содержащие
+прямоугольник или точку, ближайшие боксы к точке; для пакетов — пары (номер запроса, номер бокса).
+Поверх индекса — размещение подписей боксов без наложений (place_labels) и сопоставление
+мелких боксов (например, слов OCR) с полями (assign_boxes).
+"""
+import heapq
+import math
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Число потомков узла дерева
+DEFAULT_NODE_SIZE = 8
+
+# Предикаты пакетного запроса
+PREDICATES = ("intersects", "within", "contains")
+
+
+def to_corners(boxes: np.ndarray) -> np.ndarray:
+    """Боксы [x, y, w, h] -> [x1, y1, x2, y2]."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    return np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1)
+
+
+def _str_order(bounds: np.ndarray, node_size: int) -> np.ndarray:
+    """Порядок элементов уровня по STR: полосы по x, внутри полосы по y."""
+    count = len(bounds)
+    nodes = math.ceil(count / node_size)
+    slice_capacity = node_size * math.ceil(nodes / math.ceil(math.sqrt(nodes)))
+    cx = bounds[:, 0] + bounds[:, 2]
+    cy = bounds[:, 1] + bounds[:, 3]
+    order = np.argsort(cx, kind="stable")
+    slices = np.arange(count) // slice_capacity
+    return order[np.lexsort((cy[order], slices))]
+
+
+class _Level:
+    """Узлы одного уровня: границы и диапазон потомков на уровне ниже (или в self.order для листьев)."""
+
+    def __init__(self, bounds: np.ndarray, child_start: np.ndarray, child_count: np.ndarray):
+        self.bounds = bounds
+        self.child_start = child_start
+        self.child_count = child_count
+
+
+def _expand(queries: np.ndarray, nodes: np.ndarray, level: _Level) -> Tuple[np.ndarray, np.ndarray]:
+    """Пары (запрос, узел) -> пары (запрос, потомок узла)."""
+    counts = level.child_count[nodes]
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(queries, counts), np.repeat(level.child_start[nodes], counts) + offsets
+
+
+class BoxIndex:
+    """
+    R-дерево боксов [x, y, w, h]; номера в результатах — позиции боксов во входном массиве.
+
+    Индекс неизменяемый: строится один раз по всем боксам изображения.
+    """
+
+    def __init__(self, boxes: np.ndarray, node_size: int = DEFAULT_NODE_SIZE):
+        self.bounds = to_corners(boxes)
+        self.node_size = max(2, node_size)
+        self.levels: List[_Level] = []
+        if len(self.bounds) == 0:
+            self.order = np.zeros(0, dtype=np.int64)
+            return
+
+        # Листья: группы боксов в порядке STR
+        self.order = _str_order(self.bounds, self.node_size)
+        level_bounds = self.bounds[self.order]
+        child_start = np.arange(0, len(level_bounds), self.node_size)
+        child_count = np.diff(np.r_[child_start, len(level_bounds)])
+        while True:
+            node_bounds = np.concatenate([np.minimum.reduceat(level_bounds[:, :2], child_start),
+                                          np.maximum.reduceat(level_bounds[:, 2:], child_start)], axis=1)
+            level = _Level(node_bounds, child_start, child_count)
+            if len(node_bounds) == 1:
+                self.levels.insert(0, level)
+                break
+            # Узлы уровня переупорядочиваются по STR и группируются в родителей
+            order = _str_order(node_bounds, self.node_size)
+            self.levels.insert(0, _Level(node_bounds[order], child_start[order], child_count[order]))
+            level_bounds = node_bounds[order]
+            child_start = np.arange(0, len(level_bounds), self.node_size)
+            child_count = np.diff(np.r_[child_start, len(level_bounds)])
+
+    def __len__(self) -> int:
+        return len(self.bounds)
+
+    def query_batch(self, rects: np.ndarray, predicate: str = "intersects") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Пакетный запрос прямоугольниками [x, y, w, h]; возвращает пары (номер запроса, номер бокса).
+
+        intersects — пересечение ненулевой площади, within — бокс внутри прямоугольника,
+        contains — бокс содержит прямоугольник (для точки — прямоугольник нулевого размера).
+        """
+        if predicate not in PREDICATES:
+            raise ValueError(f"Неизвестный предикат: {predicate}")
+        query_bounds = to_corners(rects)
+        if not self.levels or len(query_bounds) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+
+        queries = np.arange(len(query_bounds))
+        nodes = np.zeros(len(queries), dtype=np.int64)
+        for level in self.levels:
+            node_bounds, q = level.bounds[nodes], query_bounds[queries]
+            if predicate == "contains":
+                keep = ((node_bounds[:, 0] <= q[:, 0]) & (node_bounds[:, 1] <= q[:, 1])
+                        & (node_bounds[:, 2] >= q[:, 2]) & (node_bounds[:, 3] >= q[:, 3]))
+            else:
+                keep = ((node_bounds[:, 0] <= q[:, 2]) & (q[:, 0] <= node_bounds[:, 2])
+                        & (node_bounds[:, 1] <= q[:, 3]) & (q[:, 1] <= node_bounds[:, 3]))
+            queries, nodes = _expand(queries[keep], nodes[keep], level)
+
+        boxes = self.order[nodes]
+        b, q = self.bounds[boxes], query_bounds[queries]
+        if predicate == "intersects":
+            keep = (b[:, 0] < q[:, 2]) & (q[:, 0] < b[:, 2]) & (b[:, 1] < q[:, 3]) & (q[:, 1] < b[:, 3])
+        elif predicate == "within":
+            keep = (b[:, 0] >= q[:, 0]) & (b[:, 1] >= q[:, 1]) & (b[:, 2] <= q[:, 2]) & (b[:, 3] <= q[:, 3])
+        else:
+            keep = (b[:, 0] <= q[:, 0]) & (b[:, 1] <= q[:, 1]) & (b[:, 2] >= q[:, 2]) & (b[:, 3] >= q[:, 3])
+        queries, boxes = queries[keep], boxes[keep]
+        order = np.lexsort((boxes, queries))
+        return queries[order], boxes[order]
+
+    def intersecting(self, rect: Sequence[float]) -> np.ndarray:
+        """Боксы, пересекающиеся с прямоугольником [x, y, w, h]."""
+        return self.query_batch(np.asarray([rect]), "intersects")[1]
+
+    def within(self, rect: Sequence[float]) -> np.ndarray:
+        """Боксы, целиком лежащие внутри прямоугольника."""
+        return self.query_batch(np.asarray([rect]), "within")[1]
+
+    def containing(self, rect: Sequence[float]) -> np.ndarray:
+        """Боксы, целиком содержащие прямоугольник."""
+        return self.query_batch(np.asarray([rect]), "contains")[1]
+
+    def containing_point(self, x: float, y: float) -> np.ndarray:
+        """Боксы, содержащие точку (границы включаются)."""
+        return self.query_batch(np.asarray([[x, y, 0.0, 0.0]]), "contains")[1]
+
+    def nearest(self, x: float, y: float, k: int = 1) -> List[Tuple[int, float]]:
+        """
+        k ближайших боксов к точке: (номер бокса, расстояние до бокса; 0 — точка внутри).
+
+        Обход по возрастанию расстояния до узлов (best-first) с кучей: узлы дальше k-го
+        найденного бокса не раскрываются.
+        """
+        if not self.levels:
+            return []
+
+        def distances(bounds: np.ndarray) -> np.ndarray:
+            dx = np.maximum(np.maximum(bounds[:, 0] - x, x - bounds[:, 2]), 0)
+            dy = np.maximum(np.maximum(bounds[:, 1] - y, y - bounds[:, 3]), 0)
+            return np.hypot(dx, dy)
+
+        heap: List[Tuple[float, int, int]] = [(float(distances(self.levels[0].bounds[:1])[0]), 0, 0)]
+        result: List[Tuple[int, float]] = []
+        while heap and len(result) < k:
+            distance, depth, item = heapq.heappop(heap)
+            if depth == len(self.levels):
+                result.append((int(item), distance))
+                continue
+            level = self.levels[depth]
+            children = np.arange(level.child_start[item], level.child_start[item] + level.child_count[item])
+            if depth + 1 == len(self.levels):
+                children = self.order[children]
+                child_distances = distances(self.bounds[children])
+            else:
+                child_distances = distances(self.levels[depth + 1].bounds[children])
+            for child, child_distance in zip(children.tolist(), child_distances.tolist()):
+                heapq.heappush(heap, (child_distance, depth + 1, child))
+        return result
+
+    def nearest_batch(self, points: np.ndarray, k: int = 1) -> List[List[Tuple[int, float]]]:
+        """Ближайшие боксы для каждой точки [x, y]."""
+        return [self.nearest(x, y, k) for x, y in np.asarray(points, dtype=np.float64).reshape(-1, 2).tolist()]
+
+
+def assign_boxes(index: BoxIndex, boxes: np.ndarray, min_overlap: float = 0.5) -> np.ndarray:
+    """
+    Сопоставление мелких боксов (слов OCR) с боксами индекса (полями): для каждого — поле,
+    покрывающее наибольшую долю его площади (не меньше min_overlap); -1, если такого нет.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    assigned = np.full(len(boxes), -1, dtype=np.int64)
+    queries, fields = index.query_batch(boxes, "intersects")
+    if len(queries) == 0:
+        return assigned
+    q, f = to_corners(boxes)[queries], index.bounds[fields]
+    inter = ((np.minimum(q[:, 2], f[:, 2]) - np.maximum(q[:, 0], f[:, 0]))
+             * (np.minimum(q[:, 3], f[:, 3]) - np.maximum(q[:, 1], f[:, 1])))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        overlap = np.where(boxes[queries, 2] * boxes[queries, 3] > 0,
+                           inter / (boxes[queries, 2] * boxes[queries, 3]), 0.0)
+    order = np.lexsort((-overlap, queries))
+    first = order[np.r_[True, queries[order][1:] != queries[order][:-1]]]
+    good = first[overlap[first] >= min_overlap]
+    assigned[queries[good]] = fields[good]
+    return assigned
+
+
+def place_labels(boxes: np.ndarray, label_sizes: np.ndarray, image_size: Optional[Tuple[float, float]] = None,
+                 index: Optional[BoxIndex] = None) -> np.ndarray:
+    """
+    Положения подписей боксов [x, y, w, h] (по одной на бокс) с минимумом наложений.
+
+    Кандидаты для каждой подписи: над боксом, под ним и внутри у верхнего края, у левого
+    и правого края; выбирается кандидат, перекрывающий меньше всего уже размещенных подписей
+    и чужих боксов (боксы проверяются через индекс одним пакетным запросом). Подписи
+    размещаются сверху вниз; при заданном image_size сдвигаются внутрь изображения.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    sizes = np.asarray(label_sizes, dtype=np.float64).reshape(-1, 2)
+    count = len(boxes)
+    if count == 0:
+        return np.zeros((0, 4))
+    index = index or BoxIndex(boxes)
+
+    x, y, w, h = boxes.T
+    lw, lh = sizes.T
+    right = x + w - lw
+    # Кандидаты (бокс, вариант): над слева, под слева, внутри слева, над справа, под справа
+    cand_x = np.stack([x, x, x, right, right], axis=1)
+    cand_y = np.stack([y - lh, y + h, y, y - lh, y + h], axis=1)
+    if image_size is not None:
+        width, height = image_size
+        cand_x = np.clip(cand_x, 0, np.maximum(width - lw, 0)[:, None])
+        cand_y = np.clip(cand_y, 0, np.maximum(height - lh, 0)[:, None])
+    variants = cand_x.shape[1]
+    candidates = np.stack([cand_x, cand_y, np.repeat(lw[:, None], variants, axis=1),
+                           np.repeat(lh[:, None], variants, axis=1)], axis=2).reshape(-1, 4)
+
+    # Число чужих боксов под каждым кандидатом
+    queries, hits = index.query_batch(candidates, "intersects")
+    foreign = hits != queries // variants
+    box_overlaps = np.bincount(queries[foreign], minlength=len(candidates)).reshape(count, variants)
+
+    placed = np.zeros((count, 4))
+    placed_corners = np.zeros((0, 4))
+    candidate_corners = to_corners(candidates).reshape(count, variants, 4)
+    # Небольшой штраф за порядок вариантов: при равенстве предпочтителен вариант над боксом
+    preference = np.arange(variants) * 0.01
+    for i in np.lexsort((x, y)).tolist():
+        corners = candidate_corners[i]
+        if len(placed_corners):
+            label_overlaps = ((corners[:, None, 0] < placed_corners[None, :, 2])
+                              & (placed_corners[None, :, 0] < corners[:, None, 2])
+                              & (corners[:, None, 1] < placed_corners[None, :, 3])
+                              & (placed_corners[None, :, 1] < corners[:, None, 3])).sum(axis=1)
+        else:
+            label_overlaps = np.zeros(variants)
+        best = int(np.argmin(3 * label_overlaps + box_overlaps[i] + preference))
+        placed[i] = candidates[i * variants + best]
+        placed_corners = np.vstack([placed_corners, corners[best:best + 1]])
+    return placed
@@ -0,0 +1,226 @@
+"""
+Колоночное представление COCO аннотаций на NumPy с кэшем .npy, загружаемым через mmap.
+
+Для статистики и QA нужны только image_id, category_id, bbox и area, поэтому аннотации
+хранятся структурированным массивом, а имена файлов — таблицей строк (байты + смещения).
+Кэш лежит рядом с _annotations.coco.json и инвалидируется по mtime/размеру/хэшу исходника.
+"""
+import json
+import shutil
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+from coco_index import SOURCE_PREFIXES, UNKNOWN_SOURCE, image_source
+from coco_stream import iter_coco
+from merge_manifest import file_fingerprint, same_content
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+ANNOTATION_DTYPE = np.dtype([
+    ("id", np.int64),
+    ("image_id", np.int64),
+    ("category_id", np.int32),
+    ("bbox", np.float32, (4,)),
+    ("area", np.float32),
+])
+
+IMAGE_DTYPE = np.dtype([
+    ("id", np.int64),
+    ("width", np.int32),
+    ("height", np.int32),
+    ("source", np.int8),
+])
+
+# Коды источников: индекс в SOURCES
+SOURCES = list(SOURCE_PREFIXES.values()) + [UNKNOWN_SOURCE]
+_SOURCE_CODES = {source: code for code, source in enumerate(SOURCES)}
+
+_COLUMN_FILES = ("annotations", "images", "names", "name_offsets")
+
+
+def cache_dir(ann_file: Path) -> Path:
+    """Каталог кэша рядом с файлом аннотаций."""
+    return ann_file.with_name(ann_file.name.replace(".json", "") + ".columns")
+
+
+class ColumnarCoco:
+    """Колоночные данные одного COCO файла."""
+
+    def __init__(self, images: np.ndarray, annotations: np.ndarray, names: np.ndarray,
+                 name_offsets: np.ndarray, categories: List[Dict]):
+        self.images = images
+        self.annotations = annotations
+        self.names = names
+        self.name_offsets = name_offsets
+        self.categories = categories
+        self.category_names = {cat["id"]: cat["name"] for cat in categories}
+
+    @property
+    def num_images(self) -> int:
+        return len(self.images)
+
+    @property
+    def num_annotations(self) -> int:
+        return len(self.annotations)
+
+    def file_name(self, row: int) -> str:
+        """Имя файла изображения по номеру строки в images."""
+        start, end = self.name_offsets[row], self.name_offsets[row + 1]
+        return bytes(self.names[start:end]).decode("utf-8")
+
+    def category_counts(self) -> Dict[int, int]:
+        """Количество аннотаций по category_id."""
+        cat_ids, counts = np.unique(self.annotations["category_id"], return_counts=True)
+        return dict(zip(cat_ids.tolist(), counts.tolist()))
+
+    def boxes_per_image(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ID изображений с аннотациями и число боксов на каждом."""
+        return np.unique(self.annotations["image_id"], return_counts=True)
+
+    def boxes_per_image_stats(self) -> Optional[Tuple[float, int, int]]:
+        """Среднее, минимум и максимум боксов на изображение (по изображениям с аннотациями)."""
+        _, counts = self.boxes_per_image()
+        if len(counts) == 0:
+            return None
+        return float(counts.mean()), int(counts.min()), int(counts.max())
+
+    def source_counts(self, include_unknown: bool = False) -> Dict[str, int]:
+        """Количество изображений по источникам."""
+        counts = np.bincount(self.images["source"], minlength=len(SOURCES))
+        return {SOURCES[code]: int(count) for code, count in enumerate(counts)
+                if count and (include_unknown or SOURCES[code] != UNKNOWN_SOURCE)}
+
+    def annotation_sources(self) -> np.ndarray:
+        """Код источника для каждой аннотации; -1 для ссылок на отсутствующие изображения."""
+        ann_image_ids = self.annotations["image_id"]
+        if self.num_images == 0:
+            return np.full(len(ann_image_ids), -1, dtype=np.int8)
+        image_ids = self.images["id"]
+        order = np.argsort(image_ids, kind="stable")
+        sorted_ids = image_ids[order]
+        pos_clipped = np.minimum(np.searchsorted(sorted_ids, ann_image_ids), len(sorted_ids) - 1)
+        found = sorted_ids[pos_clipped] == ann_image_ids
+        sources = self.images["source"][order][pos_clipped].astype(np.int8)
+        sources[~found] = -1
+        return sources
+
+    def source_category_counts(self) -> Dict[str, Dict[str, int]]:
+        """Количество аннотаций по источнику и имени категории (только для существующих изображений)."""
+        sources = self.annotation_sources()
+        valid = sources >= 0
+        pairs = np.stack([sources[valid].astype(np.int64),
+                          self.annotations["category_id"][valid].astype(np.int64)], axis=1)
+        result: Dict[str, Dict[str, int]] = {}
+        if len(pairs) == 0:
+            return result
+        unique_pairs, counts = np.unique(pairs, axis=0, return_counts=True)
+        for (code, cat_id), count in zip(unique_pairs.tolist(), counts.tolist()):
+            by_category = result.setdefault(SOURCES[code], {})
+            cat_name = self.category_names.get(cat_id, "unknown")
+            by_category[cat_name] = by_category.get(cat_name, 0) + count
+        return result
+
+
+def build_columns(ann_file: Path) -> ColumnarCoco:
+    """Построение колоночных массивов потоковым чтением COCO JSON."""
+    ann_ids, ann_image_ids, ann_cat_ids = array("q"), array("q"), array("i")
+    bboxes, areas = array("f"), array("f")
+    img_ids, widths, heights, sources = array("q"), array("i"), array("i"), array("b")
+    names = bytearray()
+    name_offsets = array("q", [0])
+    categories: List[Dict] = []
+
+    for key, item in iter_coco(ann_file):
+        if key == "annotations":
+            ann_ids.append(item["id"])
+            ann_image_ids.append(item["image_id"])
+            ann_cat_ids.append(item["category_id"])
+            bbox = [float(v) for v in (item.get("bbox") or [])[:4]]
+            bbox += [0.0] * (4 - len(bbox))
+            bboxes.extend(bbox)
+            areas.append(float(item.get("area", bbox[2] * bbox[3])))
+        elif key == "images":
+            img_ids.append(item["id"])
+            widths.append(int(item.get("width") or 0))
+            heights.append(int(item.get("height") or 0))
+            sources.append(_SOURCE_CODES[image_source(item["file_name"])])
+            names.extend(item["file_name"].encode("utf-8"))
+            name_offsets.append(len(names))
+        elif key == "categories":
+            categories = [{k: cat[k] for k in ("id", "name", "supercategory") if k in cat} for cat in item]
+
+    annotations = np.empty(len(ann_ids), dtype=ANNOTATION_DTYPE)
+    annotations["id"] = np.frombuffer(ann_ids, dtype=np.int64)
+    annotations["image_id"] = np.frombuffer(ann_image_ids, dtype=np.int64)
+    annotations["category_id"] = np.frombuffer(ann_cat_ids, dtype=np.int32)
+    annotations["bbox"] = np.frombuffer(bboxes, dtype=np.float32).reshape(-1, 4)
+    annotations["area"] = np.frombuffer(areas, dtype=np.float32)
+
+    images = np.empty(len(img_ids), dtype=IMAGE_DTYPE)
+    images["id"] = np.frombuffer(img_ids, dtype=np.int64)
+    images["width"] = np.frombuffer(widths, dtype=np.int32)
+    images["height"] = np.frombuffer(heights, dtype=np.int32)
+    images["source"] = np.frombuffer(sources, dtype=np.int8)
+
+    return ColumnarCoco(images, annotations, np.frombuffer(bytes(names), dtype=np.uint8),
+                        np.frombuffer(name_offsets, dtype=np.int64), categories)
+
+
+def _save_cache(columns: ColumnarCoco, directory: Path, fingerprint: Dict) -> None:
+    """Атомарная запись кэша: сначала во временный каталог, затем переименование."""
+    tmp_dir = directory.with_name(directory.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    for name in _COLUMN_FILES:
+        with open(tmp_dir / f"{name}.npy", "wb") as f:
+            np.save(f, getattr(columns, name), allow_pickle=False)
+    meta = {"version": CACHE_VERSION, "source": fingerprint, "categories": columns.categories}
+    with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    shutil.rmtree(directory, ignore_errors=True)
+    tmp_dir.rename(directory)
+
+
+def _write_meta(directory: Path, meta: Dict) -> None:
+    with open(directory / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+
+def load_columns(ann_file: Path, use_cache: bool = True) -> ColumnarCoco:
+    """
+    Колоночные данные COCO файла: из кэша через mmap, если он актуален, иначе построение
+    потоковым чтением и запись кэша.
+
+    Кэш актуален, если совпадают mtime и размер исходника; при их изменении сверяется SHA-256,
+    так что простое касание файла не приводит к пересборке.
+    """
+    directory = cache_dir(ann_file)
+    if use_cache and (directory / "meta.json").exists():
+        try:
+            with open(directory / "meta.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") == CACHE_VERSION:
+                fingerprint = file_fingerprint(ann_file, meta.get("source"))
+                if same_content(meta.get("source"), fingerprint):
+                    if fingerprint is not meta.get("source"):
+                        meta["source"] = fingerprint
+                        _write_meta(directory, meta)
+                    arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r", allow_pickle=False)
+                              for name in _COLUMN_FILES}
+                    return ColumnarCoco(categories=meta["categories"], **arrays)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Кэш {directory} поврежден, выполняется пересборка: {e}")
+
+    columns = build_columns(ann_file)
+    if use_cache:
+        try:
+            _save_cache(columns, directory, file_fingerprint(ann_file))
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кэш {directory}: {e}")
+    return columns
@@ -0,0 +1,332 @@
+"""
+Оценка детектора полей по объединенной разметке: AP/AR по категориям при заданных порогах IoU
+с разбивкой по источникам (префиксам имен файлов).
+
+Предсказания — в формате COCO results: [{"image_id", "category_id", "bbox": [x, y, w, h], "score"}].
+Вычисления векторные на NumPy. Пары (предсказание, разметка) одного изображения и категории
+строятся сразу для всего разбиения, и их IoU считается одним вызовом. Жадное сопоставление
+(по убыванию score, с лучшим свободным боксом разметки) идет шагами по рангу предсказания
+внутри группы: на каждом шаге обрабатываются все группы разбиения сразу. Число шагов равно
+наибольшему числу предсказаний одной категории на изображении.
+
+Сопоставление выполняется один раз; AP/AR по источникам считаются по подмножествам уже
+сопоставленных предсказаний. AP — площадь под огибающей precision/recall в 101 точке
+(как в COCO), AR — полнота при ограничении max_dets предсказаний; как в pycocotools, лимит
+действует на каждую пару (изображение, категория).
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import logging
+
+import numpy as np
+
+from coco_columnar import SOURCES, ColumnarCoco, load_columns
+from coco_validate import box_iou
+from id_allocator import ID_MAP_FILENAME, IdRemapper
+
+logger = logging.getLogger(__name__)
+
+# Базовый путь к проекту (переопределяется переменной окружения OCR_POC_BASE)
+BASE_PATH = Path(os.environ.get("OCR_POC_BASE", r"C:\Miral\OCR_PoC"))
+DATASET_PATH = BASE_PATH / "data" / "eid-field-boxes"
+
+# Пороги IoU по умолчанию: 0.50:0.05:0.95
+DEFAULT_IOU_THRESHOLDS = tuple(np.round(np.linspace(0.5, 0.95, 10), 2).tolist())
+DEFAULT_MAX_DETS = 100
+# Точки recall для интерполяции precision
+RECALL_POINTS = np.linspace(0.0, 1.0, 101)
+
+
+class Predictions:
+    """Предсказания в колоночном виде: image_id, category_id, bbox (N, 4), score."""
+
+    def __init__(self, image_ids: np.ndarray, category_ids: np.ndarray, boxes: np.ndarray, scores: np.ndarray):
+        self.image_ids = image_ids
+        self.category_ids = category_ids
+        self.boxes = boxes
+        self.scores = scores
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    @classmethod
+    def from_results(cls, results: Sequence[Dict]) -> "Predictions":
+        """Из списка записей COCO results."""
+        return cls(np.array([r["image_id"] for r in results], dtype=np.int64),
+                   np.array([r["category_id"] for r in results], dtype=np.int64),
+                   np.array([r["bbox"][:4] for r in results], dtype=np.float64).reshape(-1, 4),
+                   np.array([r.get("score", 1.0) for r in results], dtype=np.float64))
+
+    def subset(self, mask: np.ndarray) -> "Predictions":
+        return Predictions(self.image_ids[mask], self.category_ids[mask], self.boxes[mask], self.scores[mask])
+
+
+def load_predictions(path: Path, id_map: Optional[Path] = None, dataset: Optional[str] = None) -> Predictions:
+    """
+    Чтение COCO results; при заданных id_map и dataset ID изображений исходного датасета
+    переводятся на ID объединенного (IdRemapper.rekey), неизвестные отбрасываются.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        results = json.load(f)
+    if id_map is not None and dataset:
+        remapper = IdRemapper.load(id_map)
+        if remapper is None:
+            raise ValueError(f"Карты ID не найдены: {id_map}")
+        total = len(results)
+        results = remapper.rekey(results, dataset)
+        if len(results) < total:
+            logger.warning(f"Отброшено предсказаний с неизвестными ID изображений {dataset}: {total - len(results)}")
+    return Predictions.from_results(results)
+
+
+def _group_keys(image_ids: np.ndarray, category_ids: np.ndarray) -> np.ndarray:
+    """Ключ группы (изображение, категория) одним целым для сортировки и поиска."""
+    return image_ids.astype(np.int64) * (1 << 20) + category_ids.astype(np.int64)
+
+
+def match_predictions(gt_image_ids: np.ndarray, gt_category_ids: np.ndarray, gt_boxes: np.ndarray,
+                      predictions: Predictions, iou_thresholds: Sequence[float]) -> np.ndarray:
+    """
+    Жадное сопоставление предсказаний с разметкой при каждом пороге IoU.
+
+    Возвращает матрицу (пороги, предсказания): True — предсказание сопоставлено (TP).
+    """
+    thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+    n_pred = len(predictions)
+    matched = np.zeros((len(thresholds), n_pred), dtype=bool)
+    if n_pred == 0 or len(gt_boxes) == 0:
+        return matched
+
+    # Разметка, сгруппированная по ключу (изображение, категория)
+    gt_keys = _group_keys(gt_image_ids, gt_category_ids)
+    gt_order = np.argsort(gt_keys, kind="stable")
+    gt_sorted = gt_keys[gt_order]
+    pred_keys = _group_keys(predictions.image_ids, predictions.category_ids)
+    gt_start = np.searchsorted(gt_sorted, pred_keys, side="left")
+    gt_count = np.searchsorted(gt_sorted, pred_keys, side="right") - gt_start
+
+    # Ранг предсказания в своей группе по убыванию score
+    pred_order = np.lexsort((-predictions.scores, pred_keys))
+    sorted_keys = pred_keys[pred_order]
+    group_first = np.r_[0, np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1]
+    group_sizes = np.diff(np.r_[group_first, n_pred])
+    ranks = np.empty(n_pred, dtype=np.int64)
+    ranks[pred_order] = np.arange(n_pred) - np.repeat(group_first, group_sizes)
+
+    # Все пары (предсказание, бокс разметки его группы) и их IoU одним вызовом
+    pair_pred = np.repeat(np.arange(n_pred), gt_count)
+    offsets = np.arange(len(pair_pred)) - np.repeat(np.cumsum(gt_count) - gt_count, gt_count)
+    pair_gt = gt_order[np.repeat(gt_start, gt_count) + offsets]
+    pair_iou = box_iou(predictions.boxes[pair_pred], gt_boxes[pair_gt])
+    pair_rank = ranks[pair_pred]
+
+    taken = np.zeros((len(thresholds), len(gt_boxes)), dtype=bool)
+    for rank in range(int(ranks.max()) + 1 if len(pair_pred) else 0):
+        step = np.flatnonzero(pair_rank == rank)
+        if len(step) == 0:
+            continue
+        for t, threshold in enumerate(thresholds):
+            candidates = step[(pair_iou[step] >= threshold) & ~taken[t, pair_gt[step]]]
+            if len(candidates) == 0:
+                continue
+            # Для каждого предсказания — свободный бокс с наибольшим IoU
+            best = candidates[np.lexsort((-pair_iou[candidates], pair_pred[candidates]))]
+            first = np.r_[True, pair_pred[best][1:] != pair_pred[best][:-1]]
+            best = best[first]
+            matched[t, pair_pred[best]] = True
+            taken[t, pair_gt[best]] = True
+    return matched
+
+
+def _limit_per_group(predictions: Predictions, max_dets: int) -> np.ndarray:
+    """Маска max_dets предсказаний с наибольшим score в каждой паре (изображение, категория), как в COCO."""
+    keys = _group_keys(predictions.image_ids, predictions.category_ids)
+    order = np.lexsort((-predictions.scores, keys))
+    sorted_ids = keys[order]
+    first = np.r_[0, np.flatnonzero(sorted_ids[1:] != sorted_ids[:-1]) + 1]
+    sizes = np.diff(np.r_[first, len(order)])
+    keep = np.zeros(len(order), dtype=bool)
+    keep[order] = (np.arange(len(order)) - np.repeat(first, sizes)) < max_dets
+    return keep
+
+
+def average_precision(scores: np.ndarray, matched: np.ndarray, num_gt: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    AP и итоговая полнота по каждому порогу для предсказаний одной категории.
+
+    matched — матрица (пороги, предсказания); при num_gt == 0 возвращается NaN.
+    """
+    n_thresholds = matched.shape[0]
+    if num_gt == 0:
+        return np.full(n_thresholds, np.nan), np.full(n_thresholds, np.nan)
+    if len(scores) == 0:
+        return np.zeros(n_thresholds), np.zeros(n_thresholds)
+    order = np.argsort(-scores, kind="mergesort")
+    tp = np.cumsum(matched[:, order], axis=1)
+    fp = np.cumsum(~matched[:, order], axis=1)
+    recall = tp / num_gt
+    precision = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
+    # Огибающая: максимум precision при recall не меньше текущего
+    envelope = np.maximum.accumulate(precision[:, ::-1], axis=1)[:, ::-1]
+    ap = np.empty(n_thresholds)
+    for t in range(n_thresholds):
+        idx = np.searchsorted(recall[t], RECALL_POINTS, side="left")
+        valid = idx < recall.shape[1]
+        ap[t] = envelope[t, idx[valid]].sum() / len(RECALL_POINTS)
+    return ap, recall[:, -1]
+
+
+def _category_metrics(predictions: Predictions, matched: np.ndarray, gt_category_ids: np.ndarray,
+                      categories: List[Dict], thresholds: np.ndarray) -> Dict[str, Dict]:
+    """AP/AR каждой категории и средние по категориям с разметкой."""
+    result: Dict[str, Dict] = {}
+    ap_rows, ar_rows = [], []
+    for cat in categories:
+        pred_mask = predictions.category_ids == cat["id"]
+        num_gt = int((gt_category_ids == cat["id"]).sum())
+        ap, ar = average_precision(predictions.scores[pred_mask], matched[:, pred_mask], num_gt)
+        ap_rows.append(ap)
+        ar_rows.append(ar)
+        result[cat["name"]] = {"gt": num_gt, "predictions": int(pred_mask.sum()),
+                               **_threshold_metrics(ap[None], ar[None], thresholds)}
+    if categories:
+        result["all"] = {"gt": len(gt_category_ids), "predictions": len(predictions),
+                         **_threshold_metrics(np.array(ap_rows), np.array(ar_rows), thresholds)}
+    return result
+
+
+def _threshold_metrics(ap: np.ndarray, ar: np.ndarray, thresholds: np.ndarray) -> Dict:
+    """Сводка по матрицам (категории, пороги): среднее по порогам и AP при каждом пороге (NaN -> None)."""
+    def mean(values: np.ndarray) -> Optional[float]:
+        values = values[~np.isnan(values)]
+        return round(float(values.mean()), 4) if len(values) else None
+
+    metrics = {"ap": mean(ap), "ar": mean(ar)}
+    for t, threshold in enumerate(thresholds):
+        metrics[f"ap{int(round(threshold * 100))}"] = mean(ap[:, t])
+    return metrics
+
+
+def evaluate_columns(columns: ColumnarCoco, predictions: Predictions,
+                     iou_thresholds: Sequence[float] = DEFAULT_IOU_THRESHOLDS,
+                     max_dets: int = DEFAULT_MAX_DETS) -> Dict:
+    """
+    Оценка предсказаний по колоночной разметке; отчет с метриками по категориям ("all" — среднее
+    по категориям с разметкой) и по источникам.
+    """
+    start = time.perf_counter()
+    thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+    anns, images = columns.annotations, columns.images
+    gt_image_ids = np.asarray(anns["image_id"])
+    gt_category_ids = np.asarray(anns["category_id"]).astype(np.int64)
+    gt_boxes = np.asarray(anns["bbox"]).astype(np.float64)
+
+    known_images = np.isin(predictions.image_ids, images["id"])
+    known_categories = np.isin(predictions.category_ids, list(columns.category_names))
+    dropped = {"unknown_image": int((~known_images).sum()),
+               "unknown_category": int((known_images & ~known_categories).sum())}
+    predictions = predictions.subset(known_images & known_categories)
+    limited = _limit_per_group(predictions, max_dets)
+    dropped["over_max_dets"] = int((~limited).sum())
+    predictions = predictions.subset(limited)
+
+    matched = match_predictions(gt_image_ids, gt_category_ids, gt_boxes, predictions, thresholds)
+
+    # Источник предсказаний и разметки по изображению
+    image_order = np.argsort(images["id"], kind="stable")
+    sorted_image_ids = np.asarray(images["id"])[image_order]
+    image_sources = np.asarray(images["source"])[image_order]
+    pred_sources = image_sources[np.searchsorted(sorted_image_ids, predictions.image_ids)]
+    # Разметка изображений, отсутствующих в images, не относится ни к одному источнику (-1)
+    gt_sources = np.full(len(gt_image_ids), -1, dtype=np.int64)
+    if len(sorted_image_ids):
+        gt_pos = np.minimum(np.searchsorted(sorted_image_ids, gt_image_ids), len(sorted_image_ids) - 1)
+        found = sorted_image_ids[gt_pos] == gt_image_ids
+        gt_sources[found] = image_sources[gt_pos[found]]
+
+    categories = sorted(columns.categories, key=lambda cat: cat["id"])
+    report = {
+        "iou_thresholds": thresholds.tolist(),
+        "max_dets": max_dets,
+        "images": columns.num_images,
+        "predictions": len(predictions),
+        "dropped": dropped,
+        "gt_without_image": int((gt_sources < 0).sum()),
+        "categories": _category_metrics(predictions, matched, gt_category_ids, categories, thresholds),
+        "sources": {},
+    }
+    for code in np.unique(np.r_[gt_sources[gt_sources >= 0], pred_sources]).tolist():
+        pred_mask, gt_mask = pred_sources == code, gt_sources == code
+        report["sources"][SOURCES[code]] = _category_metrics(
+            predictions.subset(pred_mask), matched[:, pred_mask], gt_category_ids[gt_mask], categories, thresholds)
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def evaluate_file(ann_file: Path, predictions: Predictions, iou_thresholds: Sequence[float] = DEFAULT_IOU_THRESHOLDS,
+                  max_dets: int = DEFAULT_MAX_DETS, use_cache: bool = True) -> Dict:
+    report = evaluate_columns(load_columns(ann_file, use_cache), predictions, iou_thresholds, max_dets)
+    report["file"] = str(ann_file)
+    return report
+
+
+def _format(value: Optional[float]) -> str:
+    return f"{value:.3f}" if value is not None else "  -  "
+
+
+def summarize(report: Dict) -> str:
+    overall = report["categories"].get("all", {})
+    ap_keys = [key for key in overall if key.startswith("ap") and key != "ap"]
+    lines = [f"{report['predictions']} предсказаний, {report['images']} изображений, {report['seconds']:.2f} с: "
+             f"AP {_format(overall.get('ap'))}, AR {_format(overall.get('ar'))}"]
+    header = f"  {'категория':<20} {'gt':>6} {'pred':>6} {'AP':>6} " + " ".join(f"{key.upper():>6}" for key in ap_keys[:3])
+    lines.append(header + f" {'AR':>6}")
+    for name, metrics in report["categories"].items():
+        lines.append(f"  {name:<20} {metrics['gt']:>6} {metrics['predictions']:>6} {_format(metrics['ap']):>6} "
+                     + " ".join(f"{_format(metrics.get(key)):>6}" for key in ap_keys[:3])
+                     + f" {_format(metrics['ar']):>6}")
+    for source, by_category in report["sources"].items():
+        metrics = by_category.get("all", {})
+        lines.append(f"  источник {source}: AP {_format(metrics.get('ap'))}, AR {_format(metrics.get('ar'))}")
+    return "\n".join(lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Оценка детектора полей Emirates ID (AP/AR по категориям и источникам)")
+    parser.add_argument("predictions", type=Path, help="Предсказания в формате COCO results")
+    parser.add_argument("--split", default="test", help="Разбиение объединенного датасета")
+    parser.add_argument("--annotations", type=Path, default=None,
+                        help="Файл разметки (по умолчанию _annotations.coco.json разбиения)")
+    parser.add_argument("--iou-thresholds", type=float, nargs="+", default=list(DEFAULT_IOU_THRESHOLDS))
+    parser.add_argument("--max-dets", type=int, default=DEFAULT_MAX_DETS,
+                        help="Максимум предсказаний на пару (изображение, категория), как в pycocotools")
+    parser.add_argument("--source-dataset", default=None,
+                        help="Предсказания сделаны по ID исходного датасета (например, eid_back_detection): "
+                             f"перевести через {ID_MAP_FILENAME}")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать колоночный кэш")
+    parser.add_argument("--output", type=Path, default=None, help="JSON файл отчета")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    ann_file = args.annotations or DATASET_PATH / args.split / "_annotations.coco.json"
+    if not ann_file.exists():
+        logger.error(f"Файл аннотаций не найден: {ann_file}")
+        return
+    predictions = load_predictions(args.predictions, ann_file.parent / ID_MAP_FILENAME, args.source_dataset)
+    report = evaluate_file(ann_file, predictions, args.iou_thresholds, args.max_dets, not args.no_cache)
+    logger.info(f"{ann_file.parent.name}:\n{summarize(report)}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f"Отчет сохранен в: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
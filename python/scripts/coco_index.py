@@ -0,0 +1,138 @@
+"""
+Индекс COCO разбиения с O(1) доступом к изображениям, аннотациям, категориям и источникам.
+"""
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from box_index import BoxIndex
+from coco_records import AnnotationRecord, CategoryRecord, ImageRecord
+from coco_stream import iter_coco
+
+# Префиксы имен файлов объединенного датасета -> короткое имя источника
+SOURCE_PREFIXES = {
+    "eid_back_detection_": "back_detection",
+    "eid_front_detection_": "front_detection",
+    "eid_front_segmentation_": "front_segmentation",
+}
+UNKNOWN_SOURCE = "unknown"
+
+
+def image_source(filename: str) -> str:
+    """Определение источника изображения по префиксу имени файла."""
+    for prefix, source in SOURCE_PREFIXES.items():
+        if filename.startswith(prefix):
+            return source
+    return UNKNOWN_SOURCE
+
+
+class CocoIndex:
+    """
+    Индекс одного COCO разбиения, строится за один проход по данным.
+
+    Содержит готовые отображения image_id -> изображение, image_id -> аннотации,
+    category_id -> аннотации, источник -> image_id и category_id -> имя категории.
+    Изображения, аннотации и категории хранятся записями coco_records (ImageRecord и т.д.).
+    Пространственные индексы боксов строятся по запросу (box_index) и кэшируются.
+    """
+
+    def __init__(self):
+        self.info: Dict = {}
+        self.categories: List[CategoryRecord] = []
+        self.category_names: Dict[int, str] = {}
+        self.images: Dict[int, ImageRecord] = {}
+        self.image_sources: Dict[int, str] = {}
+        self.images_by_source: Dict[str, List[int]] = defaultdict(list)
+        self.annotations_by_image: Dict[int, List[AnnotationRecord]] = defaultdict(list)
+        self.annotations_by_category: Dict[int, List[AnnotationRecord]] = defaultdict(list)
+        self.num_annotations = 0
+        self._box_indexes: Dict[int, BoxIndex] = {}
+
+    @classmethod
+    def from_items(cls, items: Iterable[Tuple[str, Any]]) -> "CocoIndex":
+        """Построение индекса из последовательности (ключ, значение) в формате coco_stream.iter_coco."""
+        index = cls()
+        for key, item in items:
+            if key == "images":
+                index._add_image(ImageRecord.from_json(item))
+            elif key == "annotations":
+                index._add_annotation(AnnotationRecord.from_json(item))
+            elif key == "categories":
+                index.categories = [CategoryRecord.from_json(cat) for cat in item]
+                index.category_names = {cat.id: cat.name for cat in index.categories}
+            elif key == "info":
+                index.info = item
+        return index
+
+    @classmethod
+    def from_file(cls, file_path: Path) -> "CocoIndex":
+        """Построение индекса потоковым чтением COCO JSON."""
+        return cls.from_items(iter_coco(file_path))
+
+    @classmethod
+    def from_coco(cls, data: Dict) -> "CocoIndex":
+        """Построение индекса из уже загруженного COCO словаря."""
+        items = [(key, value) for key, value in data.items() if key not in ("images", "annotations")]
+        items += [("images", img) for img in data.get("images", [])]
+        items += [("annotations", ann) for ann in data.get("annotations", [])]
+        return cls.from_items(items)
+
+    def _add_image(self, img: ImageRecord) -> None:
+        img_id = img.id
+        source = image_source(img.file_name)
+        self.images[img_id] = img
+        self.image_sources[img_id] = source
+        self.images_by_source[source].append(img_id)
+
+    def _add_annotation(self, ann: AnnotationRecord) -> None:
+        self.annotations_by_image[ann.image_id].append(ann)
+        self.annotations_by_category[ann.category_id].append(ann)
+        self.num_annotations += 1
+        self._box_indexes.pop(ann.image_id, None)
+
+    def box_index(self, img_id: int) -> BoxIndex:
+        """
+        Пространственный индекс боксов изображения; номера боксов в результатах запросов —
+        позиции в annotations_by_image[img_id]. Строится при первом обращении.
+        """
+        index = self._box_indexes.get(img_id)
+        if index is None:
+            anns = self.annotations_by_image.get(img_id, [])
+            index = BoxIndex([ann.bbox[:4] for ann in anns])
+            self._box_indexes[img_id] = index
+        return index
+
+    def category_name(self, cat_id: int, default: str = "unknown") -> str:
+        return self.category_names.get(cat_id, default)
+
+    def source_of(self, img_id: int) -> Optional[str]:
+        """Источник изображения или None для аннотаций, ссылающихся на отсутствующее изображение."""
+        return self.image_sources.get(img_id)
+
+    def category_counts(self) -> Dict[int, int]:
+        """Количество аннотаций по category_id."""
+        return {cat_id: len(anns) for cat_id, anns in self.annotations_by_category.items()}
+
+    def boxes_per_image(self) -> Dict[int, int]:
+        """Количество боксов на каждое изображение, имеющее хотя бы одну аннотацию."""
+        return {img_id: len(anns) for img_id, anns in self.annotations_by_image.items()}
+
+    def source_counts(self, include_unknown: bool = False) -> Dict[str, int]:
+        """Количество изображений по источникам."""
+        return {source: len(ids) for source, ids in self.images_by_source.items()
+                if include_unknown or source != UNKNOWN_SOURCE}
+
+    def source_category_counts(self) -> Dict[str, Dict[str, int]]:
+        """Количество аннотаций по источнику и имени категории (только для существующих изображений)."""
+        counts: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        for img_id, anns in self.annotations_by_image.items():
+            source = self.image_sources.get(img_id)
+            if source is None:
+                continue
+            for ann in anns:
+                counts[source][self.category_name(ann.category_id)] += 1
+        return counts
+
+    def annotated_image_ids(self) -> List[int]:
+        """ID существующих изображений, у которых есть аннотации."""
+        return [img_id for img_id in self.annotations_by_image if img_id in self.images]
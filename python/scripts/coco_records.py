@@ -0,0 +1,166 @@
+"""
+Компактные типизированные записи COCO: изображения, аннотации и категории на __slots__.
+
+Запись хранит известные поля в слотах, а прочие ключи исходного элемента — в _extra (None,
+если их нет). Порядок ключей исходного JSON сохраняется кортежем-раскладкой, общим для всех
+записей с одинаковым набором ключей, поэтому to_json() воспроизводит элемент побайтно.
+Преобразование в обе стороны не копирует вложенные значения: bbox, segmentation и значения
+_extra — те же объекты, что и в словаре (изменение списка на месте видно в обоих).
+
+По сравнению со словарем запись не хранит таблицу ключей и сами строки ключей (при потоковом
+чтении каждый элемент декодируется отдельно, и ключи не разделяются между словарями).
+Замер на реальном файле: python coco_records.py путь/_annotations.coco.json
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from coco_stream import iter_coco
+
+# (класс, ключи элемента) -> (общий кортеж ключей, ключи вне слотов)
+_LAYOUTS: Dict[Tuple[type, Tuple[str, ...]], Tuple[Tuple[str, ...], Tuple[str, ...]]] = {}
+
+
+class CocoRecord:
+    """Базовый класс записи; FIELDS — поля в слотах, отсутствующие в элементе поля равны None."""
+    __slots__ = ("_layout", "_extra")
+    FIELDS: Tuple[str, ...] = ()
+    _FIELD_SET: FrozenSet[str] = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELDS = cls.__slots__
+        cls._FIELD_SET = frozenset(cls.__slots__)
+
+    def __init__(self, **fields: Any):
+        self._assign(fields)
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "CocoRecord":
+        """Запись из элемента COCO JSON (вложенные значения не копируются)."""
+        record = cls.__new__(cls)
+        record._assign(data)
+        return record
+
+    def _assign(self, data: Dict[str, Any]) -> None:
+        keys = tuple(data)
+        layout = _LAYOUTS.get((type(self), keys))
+        if layout is None:
+            layout = _LAYOUTS.setdefault((type(self), keys),
+                                         (keys, tuple(key for key in keys if key not in self._FIELD_SET)))
+        self._layout = layout[0]
+        get = data.get
+        for name in self.FIELDS:
+            setattr(self, name, get(name))
+        self._extra = {key: data[key] for key in layout[1]} if layout[1] else None
+
+    def to_json(self) -> Dict[str, Any]:
+        """Элемент COCO JSON с исходным порядком ключей (вложенные значения не копируются)."""
+        fields, extra = self._FIELD_SET, self._extra
+        return {key: getattr(self, key) if key in fields else extra[key] for key in self._layout}
+
+    @property
+    def extra(self) -> Dict[str, Any]:
+        """Ключи элемента, не вошедшие в слоты (только для чтения)."""
+        return dict(self._extra) if self._extra else {}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{key}={value!r}' for key, value in self.to_json().items())})"
+
+
+class ImageRecord(CocoRecord):
+    """Изображение COCO."""
+    __slots__ = ("id", "file_name", "width", "height", "license", "date_captured")
+    id: int
+    file_name: str
+    width: Optional[int]
+    height: Optional[int]
+    license: Optional[int]
+    date_captured: Optional[str]
+
+
+class AnnotationRecord(CocoRecord):
+    """Аннотация COCO; bbox — [x, y, w, h]."""
+    __slots__ = ("id", "image_id", "category_id", "bbox", "area", "segmentation", "iscrowd")
+    id: int
+    image_id: int
+    category_id: int
+    bbox: List[float]
+    area: Optional[float]
+    segmentation: Optional[Any]
+    iscrowd: Optional[int]
+
+
+class CategoryRecord(CocoRecord):
+    """Категория COCO."""
+    __slots__ = ("id", "name", "supercategory")
+    id: int
+    name: str
+    supercategory: Optional[str]
+
+
+def _load(ann_file: Path, as_records: bool) -> Tuple[List[Any], List[Any]]:
+    images, annotations = [], []
+    for key, item in iter_coco(ann_file):
+        if key == "images":
+            images.append(ImageRecord.from_json(item) if as_records else item)
+        elif key == "annotations":
+            annotations.append(AnnotationRecord.from_json(item) if as_records else item)
+    return images, annotations
+
+
+def measure(ann_file: Path) -> Dict[str, Dict[str, float]]:
+    """
+    Память (tracemalloc, MB) и время загрузки файла словарями и записями, а также время
+    обратного преобразования записей в элементы JSON.
+    """
+    report = {}
+    for name, as_records in (("dicts", False), ("records", True)):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        images, annotations = _load(ann_file, as_records)
+        seconds = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report[name] = {"images": len(images), "annotations": len(annotations),
+                        "memory_mb": round(current / 1e6, 1), "peak_mb": round(peak / 1e6, 1),
+                        "load_seconds": round(seconds, 3)}
+        if as_records:
+            start = time.perf_counter()
+            items = [ann.to_json() for ann in annotations]
+            report[name]["to_json_seconds"] = round(time.perf_counter() - start, 3)
+            del items
+        del images, annotations
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Сравнение памяти и времени загрузки COCO: словари и записи")
+    parser.add_argument("ann_file", type=Path, help="Файл _annotations.coco.json")
+    parser.add_argument("--output", type=Path, default=None, help="JSON файл отчета")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    report = measure(args.ann_file)
+    for name, result in report.items():
+        print(f"{name}: {result['images']} изображений, {result['annotations']} аннотаций, "
+              f"память {result['memory_mb']} MB (пик {result['peak_mb']} MB), загрузка {result['load_seconds']:.2f} с")
+    dicts, records = report["dicts"], report["records"]
+    if records["memory_mb"]:
+        print(f"Память словарей / записей: {dicts['memory_mb'] / records['memory_mb']:.2f}x, "
+              f"to_json: {records['to_json_seconds']:.2f} с")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Отчет сохранен в: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
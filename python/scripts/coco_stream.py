@@ -0,0 +1,229 @@
+"""
+Потоковое чтение и запись COCO JSON без загрузки всего документа в память.
+
+Массивы images и annotations читаются и пишутся поэлементно, остальные ключи верхнего
+уровня (info, licenses, categories) небольшие и обрабатываются целиком.
+"""
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Массивы, которые читаются и пишутся поэлементно
+STREAMED_SECTIONS = ("images", "annotations")
+
+_CHUNK_SIZE = 1024 * 1024
+_WHITESPACE = " \t\n\r"
+
+
+class _Tokenizer:
+    """Буферизованный разбор JSON поверх файла с догрузкой блоков по мере необходимости."""
+
+    def __init__(self, f, chunk_size: int = _CHUNK_SIZE):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, min_size: Optional[int] = None) -> bool:
+        """Догрузка следующего блока; False, если файл закончился."""
+        if self._eof:
+            return False
+        chunk = self._f.read(max(self._chunk_size, min_size or 0))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Следующий значимый символ (пробелы пропускаются)."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("Неожиданный конец COCO JSON")
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Ожидался символ {char!r}, получен {self._buf[self._pos]!r}")
+        self._pos += 1
+
+    def value(self) -> Any:
+        """Разбор одного JSON значения целиком, с догрузкой буфера для длинных значений."""
+        self.peek()
+        need = 0
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # Число на границе буфера могло быть обрезано — убеждаемся, что за ним есть символ
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # Значение не поместилось: догружаем с удвоением, чтобы не разбирать его квадратично
+            need = max(need * 2, len(self._buf) - self._pos + self._chunk_size)
+            self._fill(need)
+
+
+def iter_coco(file_path: Path, sections: Sequence[str] = STREAMED_SECTIONS) -> Iterator[Tuple[str, Any]]:
+    """
+    Однопроходное чтение COCO JSON в порядке следования ключей в файле.
+
+    Для массивов из sections выдаются пары (ключ, элемент) по одной на элемент,
+    для остальных ключей верхнего уровня — одна пара (ключ, значение).
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        tok = _Tokenizer(f)
+        tok.expect('{')
+        if tok.peek() == '}':
+            return
+        while True:
+            key = tok.value()
+            tok.expect(':')
+            if key in sections and tok.peek() == '[':
+                tok.expect('[')
+                if tok.peek() == ']':
+                    tok.expect(']')
+                else:
+                    while True:
+                        yield key, tok.value()
+                        if tok.peek() == ',':
+                            tok.expect(',')
+                            continue
+                        tok.expect(']')
+                        break
+            else:
+                yield key, tok.value()
+            if tok.peek() == ',':
+                tok.expect(',')
+                continue
+            tok.expect('}')
+            break
+
+
+def iter_section(file_path: Path, section: str) -> Iterator[Dict]:
+    """Поэлементное чтение одного массива (images или annotations)."""
+    for key, item in iter_coco(file_path, sections=(section,)):
+        if key == section:
+            yield item
+
+
+def load_coco(file_path: Path) -> Dict:
+    """Сборка полного COCO словаря потоковым чтением (для небольших файлов и совместимости)."""
+    data: Dict[str, Any] = {}
+    for key, item in iter_coco(file_path):
+        if key in STREAMED_SECTIONS:
+            data.setdefault(key, []).append(item)
+        else:
+            data[key] = item
+    for section in STREAMED_SECTIONS:
+        data.setdefault(section, [])
+    return data
+
+
+def _dump_nested(value: Any, compact: bool, level: int) -> str:
+    """Сериализация значения так, как его вывел бы json.dump(indent=2) на глубине level."""
+    if compact:
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    text = json.dumps(value, ensure_ascii=False, indent=2)
+    return text.replace('\n', '\n' + '  ' * level)
+
+
+class CocoStreamWriter:
+    """
+    Потоковая запись COCO JSON.
+
+    Элементы разных массивов можно писать вперемешку: каждый массив буферизуется во
+    временном файле рядом с результатом, и при закрытии документ собирается одним проходом.
+    В режиме по умолчанию результат побайтно совпадает с json.dump(indent=2, ensure_ascii=False),
+    в компактном режиме пишется без отступов.
+    """
+
+    def __init__(self, file_path: Path, header: Dict[str, Any],
+                 sections: Sequence[str] = STREAMED_SECTIONS, compact: bool = False):
+        self.file_path = Path(file_path)
+        self.header = header
+        self.sections = tuple(sections)
+        self.compact = compact
+        self.counts = {section: 0 for section in self.sections}
+        self._spools = {}
+        for section in self.sections:
+            fd, spool_path = tempfile.mkstemp(prefix=f".{self.file_path.name}.{section}.",
+                                              dir=self.file_path.parent)
+            self._spools[section] = (open(fd, 'w', encoding='utf-8'), Path(spool_path))
+
+    def write(self, section: str, item: Dict) -> None:
+        """Добавление элемента в массив section."""
+        spool, _ = self._spools[section]
+        if self.counts[section]:
+            spool.write(',' if self.compact else ',\n')
+        if not self.compact:
+            spool.write('    ')
+        spool.write(_dump_nested(item, self.compact, 2))
+        self.counts[section] += 1
+
+    def write_many(self, section: str, items: Iterable[Dict]) -> None:
+        for item in items:
+            self.write(section, item)
+
+    def close(self) -> None:
+        """Сборка итогового файла: заголовок, затем массивы в порядке sections."""
+        for spool, _ in self._spools.values():
+            spool.close()
+
+        tmp_path = self.file_path.with_name(self.file_path.name + ".tmp")
+        nl = '' if self.compact else '\n'
+        indent = '' if self.compact else '  '
+        colon = ':' if self.compact else ': '
+        with open(tmp_path, 'w', encoding='utf-8') as out:
+            out.write('{' + nl)
+            entries: List[Tuple[str, Optional[Any]]] = [(k, v) for k, v in self.header.items()
+                                                          if k not in self.sections]
+            entries += [(section, None) for section in self.sections]
+            for idx, (key, value) in enumerate(entries):
+                out.write(f"{indent}{json.dumps(key, ensure_ascii=False)}{colon}")
+                if key in self._spools:
+                    if self.counts[key]:
+                        out.write('[' + nl)
+                        with open(self._spools[key][1], 'r', encoding='utf-8') as spool:
+                            shutil.copyfileobj(spool, out, _CHUNK_SIZE)
+                        out.write(nl + indent + ']')
+                    else:
+                        out.write('[]')
+                else:
+                    out.write(_dump_nested(value, self.compact, 1))
+                if idx < len(entries) - 1:
+                    out.write(',')
+                out.write(nl)
+            out.write('}')
+        os.replace(tmp_path, self.file_path)
+        self._cleanup()
+
+    def abort(self) -> None:
+        """Отмена записи с удалением временных файлов."""
+        for spool, _ in self._spools.values():
+            spool.close()
+        self._cleanup()
+
+    def _cleanup(self) -> None:
+        for _, spool_path in self._spools.values():
+            spool_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "CocoStreamWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,244 @@
+"""
+Проверка COCO аннотаций: выход боксов за границы изображения, нулевая площадь, ссылки на
+несуществующие изображения и категории, повторяющиеся ID и перекрытия боксов одной категории.
+
+Все проверки выполняются векторно на NumPy над колоночным представлением (coco_columnar) сразу
+для всех аннотаций; цикл на Python идет только по найденным проблемам при сборке отчета.
+Результат — список проблем по изображениям.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import logging
+
+import numpy as np
+
+from coco_columnar import ColumnarCoco, load_columns
+
+logger = logging.getLogger(__name__)
+
+# Базовый путь к проекту (переопределяется переменной окружения OCR_POC_BASE)
+BASE_PATH = Path(os.environ.get("OCR_POC_BASE", r"C:\Miral\OCR_PoC"))
+DATASET_PATH = BASE_PATH / "data" / "eid-field-boxes"
+
+SPLITS = ["train", "valid", "test"]
+REPORT_FILENAME = "validation_report.json"
+
+# Коды проблем в порядке проверки
+ISSUE_CODES = ("invalid_image_size", "dangling_image_id", "unknown_category", "duplicate_id",
+               "invalid_bbox", "zero_area", "out_of_bounds", "overlap")
+
+# Допуск выхода за границы изображения, пикселей (координаты экспортов округляются)
+DEFAULT_TOLERANCE = 1.0
+# Минимальная площадь бокса, пикселей
+DEFAULT_MIN_AREA = 1.0
+# Порог IoU, начиная с которого боксы одной категории на изображении считаются дублирующими
+DEFAULT_OVERLAP_IOU = 0.7
+
+
+def _image_rows(columns: ColumnarCoco) -> Tuple[np.ndarray, np.ndarray]:
+    """Строка images для каждой аннотации и маска найденных изображений."""
+    ann_image_ids = columns.annotations["image_id"]
+    if columns.num_images == 0:
+        return np.zeros(len(ann_image_ids), dtype=np.int64), np.zeros(len(ann_image_ids), dtype=bool)
+    order = np.argsort(columns.images["id"], kind="stable")
+    sorted_ids = columns.images["id"][order]
+    pos = np.minimum(np.searchsorted(sorted_ids, ann_image_ids), len(sorted_ids) - 1)
+    return order[pos], sorted_ids[pos] == ann_image_ids
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Попарный IoU строк a и b (боксы [x, y, w, h], одинаковой длины)."""
+    ix = np.minimum(a[:, 0] + a[:, 2], b[:, 0] + b[:, 2]) - np.maximum(a[:, 0], b[:, 0])
+    iy = np.minimum(a[:, 1] + a[:, 3], b[:, 1] + b[:, 3]) - np.maximum(a[:, 1], b[:, 1])
+    inter = np.clip(ix, 0, None) * np.clip(iy, 0, None)
+    union = a[:, 2] * a[:, 3] + b[:, 2] * b[:, 3] - inter
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, inter / union, 0.0)
+
+
+def same_category_overlaps(image_ids: np.ndarray, category_ids: np.ndarray, boxes: np.ndarray,
+                           min_iou: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Пары аннотаций одного изображения и категории с IoU >= min_iou: (строки i, строки j, IoU).
+
+    После сортировки по (изображение, категория) группы идут подряд, поэтому пары внутри групп
+    перебираются сдвигами k = 1, 2, ...: на каждом сдвиге сравниваются все элементы сразу, а
+    число сдвигов равно размеру наибольшей группы (единицы боксов на поле документа).
+    """
+    order = np.lexsort((category_ids, image_ids))
+    img_sorted, cat_sorted = image_ids[order], category_ids[order]
+    boxes_sorted = boxes[order].astype(np.float64)
+    rows_i, rows_j, ious = [], [], []
+    for k in range(1, len(order)):
+        same = (img_sorted[k:] == img_sorted[:-k]) & (cat_sorted[k:] == cat_sorted[:-k])
+        if not same.any():
+            break
+        first = np.flatnonzero(same)
+        iou = box_iou(boxes_sorted[first], boxes_sorted[first + k])
+        hit = iou >= min_iou
+        rows_i.append(order[first[hit]])
+        rows_j.append(order[first[hit] + k])
+        ious.append(iou[hit])
+    if not rows_i:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0)
+    return np.concatenate(rows_i), np.concatenate(rows_j), np.concatenate(ious)
+
+
+def validate_columns(columns: ColumnarCoco, overlap_iou: float = DEFAULT_OVERLAP_IOU,
+                     tolerance: float = DEFAULT_TOLERANCE, min_area: float = DEFAULT_MIN_AREA) -> Dict:
+    """
+    Проверка колоночных аннотаций; возвращает отчет с числом проблем по кодам (ISSUE_CODES)
+    и списком проблем по изображениям.
+    """
+    start = time.perf_counter()
+    anns, images = columns.annotations, columns.images
+    ann_ids = anns["id"]
+    boxes = anns["bbox"].astype(np.float64)
+    x, y, w, h = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+
+    rows, found = _image_rows(columns)
+    bad_size_images = (images["width"] <= 0) | (images["height"] <= 0)
+    if columns.num_images:
+        widths = images["width"][rows].astype(np.float64)
+        heights = images["height"][rows].astype(np.float64)
+        sized = found & ~bad_size_images[rows]
+    else:
+        widths = heights = np.zeros(len(anns))
+        sized = found
+
+    finite = np.isfinite(boxes).all(axis=1)
+    category_ids = np.array(sorted(columns.category_names), dtype=np.int64)
+    _, first_index, id_counts = np.unique(ann_ids, return_index=True, return_counts=True)
+    duplicate_ids = np.zeros(len(anns), dtype=bool)
+    duplicate_ids[np.isin(ann_ids, ann_ids[first_index[id_counts > 1]])] = True
+
+    with np.errstate(invalid="ignore"):
+        masks = {
+            "dangling_image_id": ~found,
+            "unknown_category": ~np.isin(anns["category_id"], category_ids),
+            "duplicate_id": duplicate_ids,
+            "invalid_bbox": ~finite,
+            "zero_area": finite & ((w <= 0) | (h <= 0) | (w * h < min_area)),
+            "out_of_bounds": finite & sized & ((x < -tolerance) | (y < -tolerance) |
+                                               (x + w > widths + tolerance) | (y + h > heights + tolerance)),
+        }
+    counts = {code: int(mask.sum()) for code, mask in masks.items()}
+    counts["invalid_image_size"] = int(bad_size_images.sum())
+
+    valid = found & finite
+    valid_rows = np.flatnonzero(valid)
+    pair_i, pair_j, pair_iou = same_category_overlaps(anns["image_id"][valid], anns["category_id"][valid],
+                                                      boxes[valid], overlap_iou)
+    pair_i, pair_j = valid_rows[pair_i], valid_rows[pair_j]
+    counts["overlap"] = len(pair_i)
+
+    # Сборка списка проблем по изображениям (только по найденным строкам)
+    by_image: Dict[int, List[Dict]] = {}
+    for row in np.flatnonzero(bad_size_images).tolist():
+        by_image.setdefault(int(images["id"][row]), []).append({"annotation_id": None, "code": "invalid_image_size"})
+    for code, mask in masks.items():
+        for row in np.flatnonzero(mask).tolist():
+            issue = {"annotation_id": int(ann_ids[row]), "code": code}
+            if code in ("out_of_bounds", "zero_area"):
+                issue["bbox"] = [round(v, 2) for v in boxes[row].tolist()]
+            by_image.setdefault(int(anns["image_id"][row]), []).append(issue)
+    for i, j, iou in zip(pair_i.tolist(), pair_j.tolist(), pair_iou.tolist()):
+        by_image.setdefault(int(anns["image_id"][i]), []).append(
+            {"annotation_id": int(ann_ids[i]), "code": "overlap", "other_id": int(ann_ids[j]), "iou": round(iou, 3)})
+
+    image_rows = {image_id: row for row, image_id in enumerate(images["id"].tolist())} if by_image else {}
+    issues = []
+    for image_id in sorted(by_image):
+        row = image_rows.get(image_id)
+        issues.append({"image_id": image_id, "file_name": columns.file_name(row) if row is not None else None,
+                       "issues": by_image[image_id]})
+
+    return {
+        "images": columns.num_images,
+        "annotations": columns.num_annotations,
+        "overlap_iou": overlap_iou,
+        "tolerance": tolerance,
+        "min_area": min_area,
+        "counts": {code: counts[code] for code in ISSUE_CODES},
+        "images_with_issues": len(issues),
+        "issues": issues,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def validate_file(ann_file: Path, overlap_iou: float = DEFAULT_OVERLAP_IOU, tolerance: float = DEFAULT_TOLERANCE,
+                  min_area: float = DEFAULT_MIN_AREA, use_cache: bool = True) -> Dict:
+    """Проверка COCO файла (колоночные данные берутся из кэша coco_columnar, если он актуален)."""
+    start = time.perf_counter()
+    report = validate_columns(load_columns(ann_file, use_cache=use_cache), overlap_iou, tolerance, min_area)
+    report["file"] = str(ann_file)
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def validate_splits(dataset_path: Path = DATASET_PATH, splits: Sequence[str] = SPLITS, **kwargs) -> Dict[str, Dict]:
+    """Проверка разбиений объединенного датасета; отсутствующие разбиения пропускаются."""
+    reports = {}
+    for split in splits:
+        ann_file = dataset_path / split / "_annotations.coco.json"
+        if ann_file.exists():
+            reports[split] = validate_file(ann_file, **kwargs)
+    return reports
+
+
+def total_issues(report: Dict) -> int:
+    return sum(report["counts"].values())
+
+
+def summarize(report: Dict) -> str:
+    counts = ", ".join(f"{code}: {count}" for code, count in report["counts"].items() if count)
+    return (f"{report['annotations']} аннотаций, {report['images']} изображений: "
+            f"проблем {total_issues(report)} на {report['images_with_issues']} изображениях"
+            f"{f' ({counts})' if counts else ''}, {report['seconds']:.2f} с")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Проверка COCO аннотаций объединенного датасета")
+    parser.add_argument("files", nargs="*", type=Path,
+                        help="COCO файлы для проверки (по умолчанию разбиения объединенного датасета)")
+    parser.add_argument("--splits", nargs="+", default=SPLITS)
+    parser.add_argument("--overlap-iou", type=float, default=DEFAULT_OVERLAP_IOU,
+                        help="Порог IoU перекрытия боксов одной категории")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Допуск выхода бокса за границы изображения, пикселей")
+    parser.add_argument("--min-area", type=float, default=DEFAULT_MIN_AREA, help="Минимальная площадь бокса")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать колоночный кэш")
+    parser.add_argument("--output", type=Path, default=None,
+                        help=f"Файл отчета (по умолчанию {REPORT_FILENAME} в каталоге датасета)")
+    parser.add_argument("--strict", action="store_true", help="Код возврата 1 при найденных проблемах")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    options = {"overlap_iou": args.overlap_iou, "tolerance": args.tolerance, "min_area": args.min_area,
+               "use_cache": not args.no_cache}
+    if args.files:
+        reports = {str(ann_file): validate_file(ann_file, **options) for ann_file in args.files}
+    else:
+        reports = validate_splits(DATASET_PATH, args.splits, **options)
+    for name, report in reports.items():
+        logger.info(f"{name}: {summarize(report)}")
+
+    report_path = args.output or DATASET_PATH / REPORT_FILENAME
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(reports, f, indent=2, ensure_ascii=False)
+    logger.info(f"Отчет сохранен в: {report_path}")
+    if args.strict and any(total_issues(report) for report in reports.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Контактные листы (мозаики) из уменьшенных изображений с боксами для быстрой визуальной проверки.
+
+Отрисованные плитки хранятся в общем кэше изображений (image_cache) в записи своего
+изображения: имя плитки зависит от ее боксов и размера, поэтому после исправления разметки
+перерисовываются только изменившиеся плитки, а прежняя версия плитки удаляется. Плитки
+входят в ограничение размера кэша и вытесняются вместе с записью. Уменьшенные изображения
+для отрисовки берутся из того же кэша, так что перерисовка плитки не декодирует исходник.
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from batch_render import draw_boxes, valid_bbox
+from coco_index import CocoIndex
+from image_cache import CacheStats, ImageCache
+
+# Способы группировки изображений по листам
+GROUP_BY = ("split", "source", "category")
+
+# Версия отрисовки плиток: увеличивается при изменении внешнего вида, чтобы сбросить кэш
+TILE_VERSION = 1
+
+_CAPTION_HEIGHT = 18
+
+# Параметры воркера, передаются один раз через initializer пула
+_worker_state: Dict = {}
+
+
+@dataclass
+class ContactSheetStats:
+    """Статистика построения контактных листов."""
+    sheets: int = 0
+    tiles_rendered: int = 0
+    tiles_cached: int = 0
+    tiles_failed: int = 0
+    seconds: float = 0.0
+    image_cache: Optional[CacheStats] = None
+
+    @property
+    def tile_hit_rate(self) -> float:
+        total = self.tiles_cached + self.tiles_rendered
+        return self.tiles_cached / total if total else 0.0
+
+    def summary(self) -> str:
+        text = (f"{self.sheets} листов за {self.seconds:.2f} с, плиток отрисовано: {self.tiles_rendered}, "
+                f"из кэша: {self.tiles_cached} ({self.tile_hit_rate:.0%}), ошибок: {self.tiles_failed}")
+        if self.image_cache is not None:
+            text += f"; кэш изображений: {self.image_cache.summary()}"
+        return text
+
+
+def tile_name(image_path: Path, boxes: Sequence[Tuple[int, Sequence[float]]], tile_size: int) -> str:
+    """
+    Имя файла плитки в записи кэша изображения. Одинаковые по содержимому файлы делят запись,
+    поэтому имя включает путь изображения, а не только его боксы и размер плитки.
+    """
+    payload = json.dumps([TILE_VERSION, tile_size, boxes])
+    return f"{_tile_prefix(image_path, tile_size)}{hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]}.jpg"
+
+
+def _tile_prefix(image_path: Path, tile_size: int) -> str:
+    """Общая часть имен всех версий плитки одного изображения (путь) и размера."""
+    path_key = hashlib.sha1(str(Path(image_path).resolve()).encode('utf-8')).hexdigest()[:12]
+    return f"tile_{tile_size}_{path_key}_"
+
+
+def _init_worker(image_cache_dir: str) -> None:
+    cache = ImageCache(Path(image_cache_dir))
+    # Карта путей кэша сохраняется при завершении воркера
+    Finalize(cache, cache.close, exitpriority=10)
+    _worker_state["image_cache"] = cache
+
+
+def _render_tile(task: Tuple[str, str, List, int, Dict]) -> Tuple[str, bool, CacheStats]:
+    """
+    Отрисовка одной плитки: уменьшенное изображение из кэша изображений и рамки боксов в
+    масштабе миниатюры; плитка записывается в запись кэша. Возвращает статистику кэша по плитке.
+    """
+    image_path, tile_path, boxes, tile_size, colors = task
+    cache: ImageCache = _worker_state["image_cache"]
+    cache.stats = cache_stats = CacheStats()
+    result = cache.thumbnail(Path(image_path), tile_size)
+    if result is None:
+        return tile_path, False, cache_stats
+    thumb, scale = result
+    img = cv2.cvtColor(np.asarray(thumb), cv2.COLOR_RGB2BGR)
+    scaled = [(cat_id, [v * scale for v in bbox]) for cat_id, bbox in boxes]
+    draw_boxes(img, scaled, {}, colors, labels=False)
+    ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ok:
+        return tile_path, False, cache_stats
+    cache.store_artifact(Path(tile_path), encoded.tobytes(), stale_prefix=_tile_prefix(Path(image_path), tile_size))
+    return tile_path, True, cache_stats
+
+
+def ensure_tiles(index: CocoIndex, image_ids: Sequence[int], image_dir: Path, cache_dir: Path,
+                 colors: Dict[int, Tuple[float, float, float]], tile_size: int = 256,
+                 workers: Optional[int] = None, stats: Optional[ContactSheetStats] = None) -> Dict[int, Path]:
+    """
+    Плитки для изображений: берутся из кэша изображений cache_dir, недостающие отрисовываются
+    через пул процессов.
+    """
+    stats = stats or ContactSheetStats()
+    tiles: Dict[int, Path] = {}
+    tasks = []
+    with ImageCache(cache_dir) as cache:
+        for img_id in image_ids:
+            image_path = image_dir / index.images[img_id].file_name
+            boxes = [(ann.category_id, list(ann.bbox)) for ann in index.annotations_by_image.get(img_id, [])
+                     if valid_bbox(ann.bbox)]
+            tile_path = cache.artifact(image_path, tile_name(image_path, boxes, tile_size))
+            if tile_path is None:
+                stats.tiles_failed += 1
+                continue
+            tiles[img_id] = tile_path
+            if tile_path.exists():
+                stats.tiles_cached += 1
+            else:
+                tasks.append((str(image_path), str(tile_path), boxes, tile_size, dict(colors)))
+
+    if tasks:
+        failed = set()
+        stats.image_cache = stats.image_cache or CacheStats()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(str(cache_dir),)) as executor:
+            chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 8))
+            for tile_path, ok, cache_stats in executor.map(_render_tile, tasks, chunksize=chunksize):
+                stats.image_cache.merge(cache_stats)
+                if ok:
+                    stats.tiles_rendered += 1
+                else:
+                    stats.tiles_failed += 1
+                    failed.add(Path(tile_path))
+        tiles = {img_id: path for img_id, path in tiles.items() if path not in failed}
+    return tiles
+
+
+def compose_sheet(tile_paths: Sequence[Path], captions: Sequence[str], output_path: Path,
+                  tile_size: int = 256, cols: int = 8) -> int:
+    """
+    Сборка одного листа: плитки по сетке cols столбцов с подписями под каждой.
+    Возвращает число плиток, которые не удалось прочитать (их ячейки остаются пустыми).
+    """
+    missing = 0
+    rows = (len(tile_paths) + cols - 1) // cols
+    cell_h = tile_size + _CAPTION_HEIGHT
+    sheet = np.full((rows * cell_h, cols * tile_size, 3), 255, dtype=np.uint8)
+    for idx, (tile_path, caption) in enumerate(zip(tile_paths, captions)):
+        tile = cv2.imread(str(tile_path))
+        if tile is None:
+            missing += 1
+            continue
+        row, col = divmod(idx, cols)
+        h, w = tile.shape[:2]
+        y0 = row * cell_h + (tile_size - h) // 2
+        x0 = col * tile_size + (tile_size - w) // 2
+        sheet[y0:y0 + h, x0:x0 + w] = tile
+        # Подпись обрезается под ширину плитки
+        max_chars = max(tile_size // 7, 4)
+        text = caption if len(caption) <= max_chars else "..." + caption[-(max_chars - 3):]
+        cv2.putText(sheet, text.encode('ascii', 'replace').decode('ascii'),
+                    (col * tile_size + 2, row * cell_h + tile_size + _CAPTION_HEIGHT - 5),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 0), 1, cv2.LINE_AA)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(str(output_path), sheet, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return missing
+
+
+def group_images(index: CocoIndex, group_by: str) -> Dict[str, List[int]]:
+    """Группировка изображений по листам: все разбиение, источник или категория."""
+    if group_by == "split":
+        return {"all": sorted(index.images)}
+    if group_by == "source":
+        return {source: sorted(ids) for source, ids in sorted(index.images_by_source.items())}
+    if group_by == "category":
+        groups = {}
+        for cat_id, anns in sorted(index.annotations_by_category.items()):
+            ids = sorted({ann.image_id for ann in anns if ann.image_id in index.images})
+            if ids:
+                groups[index.category_name(cat_id, str(cat_id))] = ids
+        return groups
+    raise ValueError(f"Неизвестная группировка: {group_by}")
+
+
+def build_contact_sheets(index: CocoIndex, image_dir: Path, output_dir: Path, cache_dir: Path,
+                         colors: Dict[int, Tuple[float, float, float]], group_by: str = "split",
+                         tile_size: int = 256, cols: int = 8, rows: int = 6,
+                         workers: Optional[int] = None) -> ContactSheetStats:
+    """
+    Построение контактных листов для разбиения: {группа}_{номер}.jpg по cols x rows плиток;
+    cache_dir — каталог кэша изображений (image_cache), в нем же хранятся плитки.
+    """
+    start = time.perf_counter()
+    stats = ContactSheetStats()
+    groups = group_images(index, group_by)
+    all_ids = sorted({img_id for ids in groups.values() for img_id in ids})
+    tiles = ensure_tiles(index, all_ids, image_dir, cache_dir, colors, tile_size, workers, stats)
+
+    # Листы предыдущего запуска удаляются: их число могло измениться
+    if output_dir.exists():
+        for old_sheet in output_dir.glob("*.jpg"):
+            old_sheet.unlink()
+
+    per_sheet = cols * rows
+    for group, ids in groups.items():
+        ids = [img_id for img_id in ids if img_id in tiles]
+        for sheet_idx in range(0, len(ids), per_sheet):
+            chunk = ids[sheet_idx:sheet_idx + per_sheet]
+            stats.tiles_failed += compose_sheet([tiles[img_id] for img_id in chunk],
+                                                [index.images[img_id].file_name for img_id in chunk],
+                                                output_dir / f"{group}_{sheet_idx // per_sheet + 1:03d}.jpg",
+                                                tile_size=tile_size, cols=cols)
+            stats.sheets += 1
+    stats.seconds = time.perf_counter() - start
+    return stats
@@ -1,34 +1,168 @@
+import argparse
 import os
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import List, Optional, Tuple
 from PIL import Image
 
-# Define directories
-base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+from image_cache import CACHE_DIRNAME, ImageCache
+from pdf_writer import PdfImage, build_pdf, prepare_page
+
+# Define directories (the base can be overridden with the OCR_POC_BASE environment variable)
+base_dir = os.environ.get('OCR_POC_BASE', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 train_dir = os.path.join(base_dir, 'data', 'eid-field-boxes', 'train')
 output_dir = os.path.join(base_dir, 'data', 'eid-pdf')
+image_cache_dir = os.path.join(base_dir, 'data', CACHE_DIRNAME)
+
+# Fixed PDF dates for seeded runs, so the same seed gives byte-identical documents
+REPRODUCIBLE_DATE = time.strptime('2025-01-01', '%Y-%m-%d')
+
+# Per-worker state, set once by the pool initializer
+_worker_state = {}
+
+
+def list_page_images(train_dir: str) -> Tuple[List[str], List[str]]:
+    """Split train images into front and back pages by file name."""
+    all_files = sorted(f for f in os.listdir(train_dir) if f.endswith(('.jpg', '.png')))
+    front_images = [f for f in all_files if 'front' in f.lower() or 'page_1' in f.lower()]
+    back_images = [f for f in all_files if 'back' in f.lower() or 'page_2' in f.lower()]
+    return front_images, back_images
+
+
+def plan_documents(front_images: List[str], back_images: List[str], count: int,
+                   seed: Optional[int] = None) -> List[Tuple[str, str]]:
+    """Pick the (front, back) pair for every document up front, so the result does not depend on workers."""
+    rng = random.Random(seed)
+    return [(rng.choice(front_images), rng.choice(back_images)) for _ in range(count)]
+
+
+def _init_worker(cache_size: int, reproducible: bool, reencode: bool = False,
+                 image_cache: Optional[str] = None) -> None:
+    """
+    Set up the per-worker LRU cache of pages: PDF-ready encoded pages, or decoded images with reencode.
+
+    With `image_cache`, decoded pages come from the shared on-disk image cache, so reruns skip decoding.
+    """
+    cache = None
+    if reencode and image_cache:
+        cache = ImageCache(Path(image_cache), store_decoded=True)
+        # Persist the cache path map when the worker exits
+        Finalize(cache, cache.close, exitpriority=10)
+
+    @lru_cache(maxsize=cache_size)
+    def load_page(path: str) -> Image.Image:
+        if cache is not None:
+            rgb = cache.decoded(Path(path))
+            if rgb is None:
+                raise ValueError(f'cannot decode {path}')
+            return Image.fromarray(rgb)
+        img = Image.open(path)
+        img.load()
+        return img
+
+    @lru_cache(maxsize=cache_size)
+    def load_encoded_page(path: str) -> PdfImage:
+        with open(path, 'rb') as f:
+            return prepare_page(f.read())
+
+    _worker_state['load_page'] = load_page
+    _worker_state['load_encoded_page'] = load_encoded_page
+    _worker_state['reproducible'] = reproducible
+    _worker_state['reencode'] = reencode
+
+
+def _build_document(task: Tuple[str, str, str]) -> Tuple[str, Optional[str]]:
+    """Write one two-page (front + back) PDF."""
+    front_path, back_path, pdf_path = task
+    try:
+        if not _worker_state['reencode']:
+            # JPEG pages are embedded as-is; the output has no timestamps and is always reproducible
+            load_encoded_page = _worker_state['load_encoded_page']
+            pdf_bytes = build_pdf([load_encoded_page(front_path), load_encoded_page(back_path)])
+            with open(pdf_path, 'wb') as f:
+                f.write(pdf_bytes)
+            return pdf_path, None
+
+        load_page = _worker_state['load_page']
+        front_img = load_page(front_path)
+        back_img = load_page(back_path)
+
+        save_kwargs = {}
+        if _worker_state['reproducible']:
+            save_kwargs = {'creationDate': REPRODUCIBLE_DATE, 'modDate': REPRODUCIBLE_DATE}
+
+        # Save as multi-page PDF
+        front_img.save(pdf_path, 'PDF', save_all=True, append_images=[back_img], **save_kwargs)
+        return pdf_path, None
+    except Exception as e:
+        return pdf_path, str(e)
+
+
+def generate_pdf_dataset(count: int = 200, seed: Optional[int] = None, workers: Optional[int] = None,
+                         cache_size: int = 64, source_dir: str = train_dir,
+                         target_dir: str = output_dir, reencode: bool = False,
+                         image_cache: Optional[str] = image_cache_dir) -> int:
+    """
+    Generate `count` random front+back PDF documents in parallel. Returns the number written.
+
+    JPEG pages are copied into the PDF without recompression; `reencode` restores the old
+    decode-and-re-encode path through PIL, with decoded pages taken from `image_cache` (None disables it).
+    """
+    front_images, back_images = list_page_images(source_dir)
+    if not front_images or not back_images:
+        raise ValueError(f'No front/back images found in {source_dir}')
+    os.makedirs(target_dir, exist_ok=True)
+
+    tasks = [
+        (os.path.join(source_dir, front_file), os.path.join(source_dir, back_file),
+         os.path.join(target_dir, f'document_{i + 1}.pdf'))
+        for i, (front_file, back_file) in enumerate(plan_documents(front_images, back_images, count, seed))
+    ]
+
+    written = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(cache_size, seed is not None, reencode, image_cache)) as executor:
+        chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 16))
+        for pdf_path, error in executor.map(_build_document, tasks, chunksize=chunksize):
+            if error is None:
+                written += 1
+            else:
+                print(f'Failed to write {pdf_path}: {error}')
+    elapsed = time.perf_counter() - start
+
+    rate = written / elapsed if elapsed > 0 else 0.0
+    print(f'Generated {written} PDF documents in {elapsed:.1f}s ({rate:.1f} docs/s).')
+    return written
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Generate random two-page Emirates ID PDF documents')
+    parser.add_argument('--count', type=int, default=200, help='Number of documents to generate')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for a reproducible corpus')
+    parser.add_argument('--workers', type=int, default=None, help='Process pool size')
+    parser.add_argument('--cache-size', type=int, default=64,
+                        help='Pages kept in each worker LRU cache')
+    parser.add_argument('--reencode', action='store_true',
+                        help='Decode and re-encode pages with PIL instead of embedding JPEG bytes as-is')
+    parser.add_argument('--image-cache-dir', default=image_cache_dir,
+                        help='Shared decoded-image cache used with --reencode')
+    parser.add_argument('--no-image-cache', action='store_true', help='Decode pages from scratch with --reencode')
+    parser.add_argument('--train-dir', default=train_dir)
+    parser.add_argument('--output-dir', default=output_dir)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    generate_pdf_dataset(count=args.count, seed=args.seed, workers=args.workers, cache_size=args.cache_size,
+                         source_dir=args.train_dir, target_dir=args.output_dir, reencode=args.reencode,
+                         image_cache=None if args.no_image_cache else args.image_cache_dir)
+
 
-# List all files in train_dir
-all_files = [f for f in os.listdir(train_dir) if f.endswith(('.jpg', '.png'))]
-
-# Separate front and back images
-front_images = [f for f in all_files if 'front' in f.lower() or 'page_1' in f.lower()]
-back_images = [f for f in all_files if 'back' in f.lower() or 'page_2' in f.lower()]
-
-# Generate 200 random PDFs
-for i in range(200):
-    # Randomly select front and back
-    front_file = random.choice(front_images)
-    back_file = random.choice(back_images)
-    
-    front_path = os.path.join(train_dir, front_file)
-    back_path = os.path.join(train_dir, back_file)
-    
-    # Open images
-    front_img = Image.open(front_path)
-    back_img = Image.open(back_path)
-    
-    # Save as multi-page PDF
-    pdf_path = os.path.join(output_dir, f'document_{i+1}.pdf')
-    front_img.save(pdf_path, 'PDF', save_all=True, append_images=[back_img])
-    
-print('Generated 200 PDF documents.') 
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,473 @@
+"""
+Поиск почти одинаковых изображений в объединенном датасете по перцептивным хэшам.
+
+Хэши (dHash или pHash, 64 бита) считаются параллельно через пул процессов и кэшируются по
+mtime/размеру файла. Пары с расстоянием Хэмминга <= max_distance ищутся multi-index
+hashing: хэш делится на m частей, и по принципу Дирихле у близких хэшей хотя бы одна часть
+отличается не больше чем на max_distance // m бит. Для каждой части перебираются значения
+в этом радиусе (поиск по отсортированному массиву частей), а кандидаты проверяются
+векторизованным popcount. Число частей выбирается по числу хэшей так, чтобы корзины
+оставались почти пустыми; одинаковые хэши сначала схлопываются, поэтому скопления
+дубликатов не раздувают число кандидатов. Масштабирование: python dedup.py --benchmark.
+
+Кластеры строятся от представителей: изображения перебираются по приоритету (train > valid
+> test, затем имя файла), первое еще не распределенное становится сохраняемым, а дубликатами
+кластера — нераспределенные изображения на расстоянии <= max_distance именно от него. Так
+цепочка A~B~C не удаляет C, далекое от A. Кластеры из разных разбиений помечаются как утечка
+между разбиениями.
+"""
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from math import comb
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import logging
+
+import cv2
+import numpy as np
+
+from coco_stream import CocoStreamWriter, iter_coco
+from id_allocator import ID_MAP_FILENAME, IdRemapper
+from merge_manifest import MANIFEST_FILENAME, MergeManifest
+
+logger = logging.getLogger(__name__)
+
+# Базовый путь к проекту (переопределяется переменной окружения OCR_POC_BASE)
+BASE_PATH = Path(os.environ.get("OCR_POC_BASE", r"C:\Miral\OCR_PoC"))
+DATASET_PATH = BASE_PATH / "data" / "eid-field-boxes"
+
+HASH_METHODS = ("dhash", "phash")
+HASH_BITS = 64
+DEFAULT_MAX_DISTANCE = 6
+
+SPLITS = ["train", "valid", "test"]
+REPORT_FILENAME = "dedup_report.json"
+HASH_CACHE_FILENAME = ".dedup_hashes.json"
+
+# Ключ изображения: (разбиение, имя файла)
+ImageKey = Tuple[str, str]
+
+
+def compute_hash(image_path: str, method: str = "dhash") -> Optional[int]:
+    """64-битный перцептивный хэш изображения; None, если файл не читается."""
+    # Уменьшенное декодирование JPEG: для хэша полное разрешение не нужно
+    img = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if img is None:
+        return None
+    if method == "dhash":
+        small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+        bits = (small[:, 1:] > small[:, :-1]).flatten()
+    elif method == "phash":
+        small = cv2.resize(img, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+        low = cv2.dct(small)[:8, :8].flatten()
+        bits = low > np.median(low[1:])
+    else:
+        raise ValueError(f"Неизвестный метод хэширования: {method}")
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _hash_task(task: Tuple[str, str]) -> Tuple[str, Optional[int]]:
+    image_path, method = task
+    return image_path, compute_hash(image_path, method)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Размер блока запросов при поиске пар (ограничивает память на промежуточные массивы)
+_QUERY_BLOCK = 1 << 16
+# Наибольшая ширина части, для которой начала корзин хранятся таблицей (2^ширина элементов)
+_MAX_TABLE_BITS = 22
+
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """Число единичных бит в каждом элементе массива uint64."""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.int64)
+    return _POPCOUNT8[values.view(np.uint8)].reshape(len(values), 8).sum(axis=1, dtype=np.int64)
+
+
+def _flip_masks(width: int, radius: int) -> np.ndarray:
+    """Все маски из width бит с не более чем radius единицами."""
+    masks = [0]
+    for count in range(1, radius + 1):
+        masks.extend(sum(1 << bit for bit in bits) for bits in combinations(range(width), count))
+    return np.array(masks, dtype=np.int64)
+
+
+def _chunk_bounds(count: int, max_distance: int, bits: int = HASH_BITS) -> List[Tuple[int, int]]:
+    """
+    Границы частей хэша (сдвиг, ширина) с наименьшей оценкой стоимости поиска: число
+    перебираемых значений частей плюс ожидаемое число кандидатов на равномерных хэшах.
+    """
+    best = None
+    for num_chunks in range(1, min(max_distance + 1, bits) + 1):
+        bounds = [bits * i // num_chunks for i in range(num_chunks + 1)]
+        width = bits // num_chunks
+        probes = sum(comb(width, k) for k in range(max_distance // num_chunks + 1))
+        cost = num_chunks * probes * count * (1 + count / 2 ** width)
+        if best is None or cost < best[0]:
+            best = (cost, [(start, end - start) for start, end in zip(bounds, bounds[1:])])
+    return best[1]
+
+
+def near_pairs(hashes: np.ndarray, max_distance: int = DEFAULT_MAX_DISTANCE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Пары (i, j), i < j, различных хэшей на расстоянии Хэмминга <= max_distance (номера в hashes).
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    count = len(hashes)
+    found = []
+    chunks = _chunk_bounds(count, max_distance)
+    radius = max_distance // len(chunks)
+    for shift, width in chunks:
+        values = ((hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)).astype(np.int64)
+        order = np.argsort(values, kind="stable")
+        sorted_values = values[order]
+        # Начала корзин: таблицей по всем значениям части или поиском по отсортированному массиву
+        starts = (np.searchsorted(sorted_values, np.arange((1 << width) + 1))
+                  if width <= _MAX_TABLE_BITS else None)
+        for mask in _flip_masks(width, radius).tolist():
+            for block_start in range(0, count, _QUERY_BLOCK):
+                query = np.arange(block_start, min(block_start + _QUERY_BLOCK, count))
+                targets = values[query] ^ mask
+                if mask:
+                    # Пара корзин (v, v ^ mask) просматривается один раз — со стороны меньшего значения
+                    forward = targets > values[query]
+                    query, targets = query[forward], targets[forward]
+                if starts is not None:
+                    lo = starts[targets]
+                    counts = starts[targets + 1] - lo
+                else:
+                    lo = np.searchsorted(sorted_values, targets, side="left")
+                    counts = np.searchsorted(sorted_values, targets, side="right") - lo
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                other = order[np.repeat(lo, counts) + offsets]
+                query = np.repeat(query, counts)
+                if not mask:
+                    keep = query < other
+                    query, other = query[keep], other[keep]
+                close = popcount64(hashes[query] ^ hashes[other]) <= max_distance
+                query, other = query[close], other[close]
+                found.append(np.minimum(query, other) * count + np.maximum(query, other))
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    pairs = np.unique(np.concatenate(found))
+    return pairs // count, pairs % count
+
+
+def find_clusters(hashes: Sequence[int], max_distance: int = DEFAULT_MAX_DISTANCE) -> List[List[int]]:
+    """
+    Кластеры почти одинаковых хэшей (номера в hashes), только из двух и более элементов.
+
+    hashes перебираются по порядку: первый нераспределенный становится представителем
+    (первый элемент кластера), остальные элементы кластера — нераспределенные хэши на
+    расстоянии <= max_distance от него.
+    """
+    if not hashes:
+        return []
+    unique, inverse = np.unique(np.array(hashes, dtype=np.uint64), return_inverse=True)
+    first, second = near_pairs(unique, max_distance)
+
+    # Соседи каждого уникального хэша и оставшиеся (нераспределенные) элементы с этим хэшем
+    neighbors: List[List[int]] = [[] for _ in range(len(unique))]
+    for a, b in zip(first.tolist(), second.tolist()):
+        neighbors[a].append(b)
+        neighbors[b].append(a)
+    remaining: List[List[int]] = [[] for _ in range(len(unique))]
+    for i, u in enumerate(inverse.ravel().tolist()):
+        remaining[u].append(i)
+
+    assigned = [False] * len(hashes)
+    clusters = []
+    for i, u in enumerate(inverse.ravel().tolist()):
+        if assigned[i]:
+            continue
+        members = []
+        for v in [u] + neighbors[u]:
+            members.extend(j for j in remaining[v] if not assigned[j])
+            remaining[v] = []
+        for j in members:
+            assigned[j] = True
+        if len(members) > 1:
+            members.sort()
+            clusters.append(members)
+    return clusters
+
+
+def benchmark_clusters(sizes: Sequence[int], max_distance: int = DEFAULT_MAX_DISTANCE,
+                       seed: int = 0) -> List[Dict]:
+    """
+    Время find_clusters на синтетических хэшах: равномерных и скученных (похожие макеты
+    карт — центры с 8..16 измененными битами), в обоих случаях 10% почти точных копий.
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+
+    def flip(values: np.ndarray, max_bits: int, min_bits: int = 1) -> np.ndarray:
+        flipped = values.copy()
+        counts = rng.integers(min_bits, max_bits + 1, len(values))
+        for bits in range(1, max_bits + 1):
+            rows = np.nonzero(counts >= bits)[0]
+            flipped[rows] ^= np.uint64(1) << rng.integers(0, HASH_BITS, len(rows)).astype(np.uint64)
+        return flipped
+
+    for size in sizes:
+        base_count = size - size // 10
+        uniform = rng.integers(0, 2 ** 63, base_count, dtype=np.uint64) * np.uint64(2) + \
+            rng.integers(0, 2, base_count, dtype=np.uint64)
+        centers = rng.integers(0, 2 ** 63, max(1, size // 1000), dtype=np.uint64) * np.uint64(2)
+        clustered = flip(centers[rng.integers(0, len(centers), base_count)], 16, 8)
+        for distribution, base in (("uniform", uniform), ("clustered", clustered)):
+            copies = flip(base[rng.integers(0, base_count, size - base_count)], max_distance)
+            values = np.concatenate([base, copies]).tolist()
+            start = time.perf_counter()
+            clusters = find_clusters(values, max_distance)
+            results.append({"size": size, "distribution": distribution, "clusters": len(clusters),
+                            "seconds": round(time.perf_counter() - start, 3)})
+    return results
+
+
+def _load_hash_cache(path: Path, method: str) -> Dict[str, List]:
+    if path.exists():
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("method") == method:
+                return data["entries"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Кэш хэшей {path} не прочитан: {e}")
+    return {}
+
+
+def hash_images(dataset_path: Path, keys: Sequence[ImageKey], method: str = "dhash",
+                workers: Optional[int] = None) -> Dict[ImageKey, int]:
+    """
+    Хэши изображений разбиений: из кэша, если mtime и размер файла не изменились,
+    остальные — через пул процессов.
+    """
+    cache_path = dataset_path / HASH_CACHE_FILENAME
+    cache = _load_hash_cache(cache_path, method)
+    # Записи кэша для разбиений вне запроса сохраняются как есть
+    requested_splits = {split for split, _ in keys}
+    new_cache = {key: entry for key, entry in cache.items() if key.split("/", 1)[0] not in requested_splits}
+    hashes: Dict[ImageKey, int] = {}
+    tasks = []
+    pending: Dict[str, Tuple[ImageKey, int, int]] = {}
+    for split, file_name in keys:
+        image_path = dataset_path / split / file_name
+        try:
+            st = image_path.stat()
+        except FileNotFoundError:
+            continue
+        cache_key = f"{split}/{file_name}"
+        cached = cache.get(cache_key)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            hashes[(split, file_name)] = int(cached[2], 16)
+            new_cache[cache_key] = cached
+        else:
+            pending[str(image_path)] = ((split, file_name), st.st_mtime_ns, st.st_size)
+            tasks.append((str(image_path), method))
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 8))
+            for image_path, value in executor.map(_hash_task, tasks, chunksize=chunksize):
+                if value is None:
+                    logger.warning(f"Не удалось прочитать изображение: {image_path}")
+                    continue
+                (split, file_name), mtime_ns, size = pending[image_path]
+                hashes[(split, file_name)] = value
+                new_cache[f"{split}/{file_name}"] = [mtime_ns, size, f"{value:016x}"]
+
+    tmp_path = cache_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"method": method, "entries": new_cache}, f, ensure_ascii=False, separators=(",", ":"))
+    tmp_path.replace(cache_path)
+    return hashes
+
+
+def find_duplicates(dataset_path: Path = DATASET_PATH, splits: Sequence[str] = SPLITS, method: str = "dhash",
+                    max_distance: int = DEFAULT_MAX_DISTANCE, workers: Optional[int] = None) -> Dict:
+    """
+    Отчет о почти одинаковых изображениях во всех разбиениях: кластеры с выбранным для
+    сохранения изображением и признаком утечки между разбиениями.
+    """
+    start = time.perf_counter()
+    images: Dict[ImageKey, int] = {}
+    for split in splits:
+        ann_file = dataset_path / split / "_annotations.coco.json"
+        if not ann_file.exists():
+            continue
+        for key, item in iter_coco(ann_file, sections=("images", "annotations")):
+            if key == "images":
+                images[(split, item["file_name"])] = item["id"]
+
+    hashes = hash_images(dataset_path, list(images), method, workers)
+    # Порядок приоритета сохранения: train > valid > test, затем имя файла
+    split_priority = {split: i for i, split in enumerate(splits)}
+    keys = sorted(hashes, key=lambda k: (split_priority[k[0]], k[1]))
+    clusters = []
+    for members in find_clusters([hashes[key] for key in keys], max_distance):
+        member_keys = [keys[i] for i in members]
+        keep = member_keys[0]
+        clusters.append({
+            "keep": {"split": keep[0], "file_name": keep[1], "id": images[keep]},
+            "duplicates": [{"split": split, "file_name": file_name, "id": images[(split, file_name)],
+                            "distance": hamming(hashes[keep], hashes[(split, file_name)])}
+                           for split, file_name in member_keys[1:]],
+            "cross_split": len({split for split, _ in member_keys}) > 1,
+        })
+    clusters.sort(key=lambda c: (c["keep"]["split"], c["keep"]["file_name"]))
+
+    return {
+        "method": method,
+        "max_distance": max_distance,
+        "images": len(images),
+        "hashed": len(hashes),
+        "clusters": clusters,
+        "duplicates": sum(len(c["duplicates"]) for c in clusters),
+        "cross_split_clusters": sum(c["cross_split"] for c in clusters),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def drop_duplicates(report: Dict, dataset_path: Path = DATASET_PATH, compact_json: bool = False) -> Dict[str, List[str]]:
+    """
+    Удаление дубликатов из отчета: изображения и их аннотации убираются из _annotations.coco.json
+    разбиений и из карт ID (_id_map.json), файлы удаляются. Возвращает удаленные имена файлов
+    по разбиениям.
+    """
+    dropped: Dict[str, set] = defaultdict(set)
+    for cluster in report["clusters"]:
+        for dup in cluster["duplicates"]:
+            dropped[dup["split"]].add(dup["file_name"])
+
+    result = {}
+    for split, file_names in dropped.items():
+        split_dir = dataset_path / split
+        ann_file = split_dir / "_annotations.coco.json"
+        # Заголовок заполняется по ходу чтения: writer использует его только при закрытии,
+        # а исходный файл заменяется уже после завершения чтения
+        header, image_ids, annotation_ids = {}, set(), set()
+        with CocoStreamWriter(ann_file, header, compact=compact_json) as writer:
+            for key, item in iter_coco(ann_file):
+                if key == "images":
+                    if item["file_name"] in file_names:
+                        image_ids.add(item["id"])
+                    else:
+                        writer.write("images", item)
+                elif key == "annotations":
+                    if item["image_id"] in image_ids:
+                        annotation_ids.add(item["id"])
+                    else:
+                        writer.write("annotations", item)
+                else:
+                    header[key] = item
+        # Удаленные ID не должны находиться при переводе предсказаний (IdRemapper.rekey)
+        id_map_file = split_dir / ID_MAP_FILENAME
+        remapper = IdRemapper.load(id_map_file)
+        if remapper is not None:
+            remapper.discard(image_ids, annotation_ids)
+            remapper.save(id_map_file)
+        for file_name in file_names:
+            image_path = split_dir / file_name
+            if image_path.is_symlink() or image_path.exists():
+                image_path.unlink()
+        result[split] = sorted(file_names)
+    return result
+
+
+def record_dropped(manifest: MergeManifest, dropped: Dict[str, List[str]], dataset_path: Path = DATASET_PATH) -> None:
+    """
+    Фиксация удаленных дубликатов в манифесте объединения: имена файлов и новый отпечаток
+    аннотаций разбиения, чтобы инкрементальный merge не счел разбиение измененным и не вернул
+    удаленные изображения. Разбиения, которых нет в манифесте, пропускаются.
+    """
+    for split, file_names in dropped.items():
+        state = manifest.get_split(split)
+        if not state:
+            continue
+        state["dedup_dropped"] = sorted(set(state.get("dedup_dropped", [])) | set(file_names))
+        out_stat = (dataset_path / split / "_annotations.coco.json").stat()
+        state["output"] = {"mtime_ns": out_stat.st_mtime_ns, "size": out_stat.st_size}
+    manifest.save()
+
+
+def save_report(report: Dict, report_path: Path) -> None:
+    """
+    Запись отчета. Удаленные ранее дубликаты переносятся из прежнего отчета: после удаления
+    повторный поиск их уже не находит, и без переноса отчет потерял бы эти сведения.
+    """
+    dropped: Dict[str, set] = defaultdict(set)
+    try:
+        with open(report_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        for split, file_names in previous.get("dropped", {}).items():
+            dropped[split].update(file_names)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning(f"Не удалось прочитать прежний отчет {report_path}: {e}")
+    for split, file_names in report.get("dropped", {}).items():
+        dropped[split].update(file_names)
+    if dropped:
+        report["dropped"] = {split: sorted(file_names) for split, file_names in sorted(dropped.items())}
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+def summarize(report: Dict) -> str:
+    return (f"{report['hashed']} изображений ({report['method']}, расстояние <= {report['max_distance']}): "
+            f"{len(report['clusters'])} кластеров, {report['duplicates']} дубликатов, "
+            f"утечек между разбиениями: {report['cross_split_clusters']}, {report['seconds']:.2f} с")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Поиск почти одинаковых изображений в объединенном датасете")
+    parser.add_argument("--splits", nargs="+", default=SPLITS)
+    parser.add_argument("--method", choices=HASH_METHODS, default="dhash")
+    parser.add_argument("--max-distance", type=int, default=DEFAULT_MAX_DISTANCE,
+                        help="Максимальное расстояние Хэмминга между хэшами дубликатов")
+    parser.add_argument("--drop", action="store_true", help="Удалить дубликаты из датасета")
+    parser.add_argument("--compact-json", action="store_true",
+                        help="Перезаписывать аннотации без отступов (как merge --compact-json)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--benchmark", type=int, nargs="+", default=None, metavar="N",
+                        help="Только замер поиска кластеров на N синтетических хэшах")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    if args.benchmark:
+        for result in benchmark_clusters(args.benchmark, args.max_distance):
+            logger.info(f"{result['size']} хэшей ({result['distribution']}): {result['clusters']} кластеров, "
+                        f"{result['seconds']:.2f} с")
+        return
+    report = find_duplicates(DATASET_PATH, args.splits, args.method, args.max_distance, args.workers)
+    logger.info(f"Дубликаты: {summarize(report)}")
+    if args.drop:
+        report["dropped"] = drop_duplicates(report, DATASET_PATH, args.compact_json)
+        record_dropped(MergeManifest.load(DATASET_PATH / MANIFEST_FILENAME), report["dropped"], DATASET_PATH)
+        logger.info(f"Удалено изображений: {sum(len(names) for names in report['dropped'].values())}")
+    report_path = DATASET_PATH / REPORT_FILENAME
+    save_report(report, report_path)
+    logger.info(f"Отчет сохранен в: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
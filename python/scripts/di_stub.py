@@ -0,0 +1,192 @@
+"""
+Локальная заглушка Azure Document Intelligence для нагрузочного теста API без обращения к Azure.
+
+Эмулирует REST API, которым пользуется DocumentIntelligenceClient (Azure.AI.DocumentIntelligence 1.0):
+    POST /documentintelligence/documentClassifiers/{id}:analyze  — классификация,
+    POST /documentintelligence/documentModels/{id}:analyze       — извлечение полей,
+    GET  .../analyzeResults/{resultId}                            — опрос длительной операции.
+Операция завершается через заданную задержку (с разбросом); до этого опрос возвращает
+"running" и retry-after-ms, который учитывает SDK. Поля результата согласованы между собой
+(idNumber содержится в backID), поэтому EmiratesIdProcessor отвечает 200.
+
+Ограничение --tps-limit эмулирует лимит запросов тарифа (S0: 15 в секунду) ответами 429.
+С --api заглушка дополнительно отвечает на POST /api/id-document/parse/{documentType}
+готовым ApiResponse — для проверки самого нагрузочного теста без .NET сервиса.
+
+Для работы сервиса через заглушку:
+    DocumentIntelligence__Endpoint=http://localhost:5080/ DocumentIntelligence__ApiKey=stub dotnet run
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from async_http import serve
+
+DEFAULT_PORT = 5080
+API_VERSION = "2024-11-30"
+
+_ANALYZE_RE = re.compile(r"^/documentintelligence/(documentClassifiers|documentModels)/([^/:?]+):analyze")
+_RESULT_RE = re.compile(r"^/documentintelligence/(documentClassifiers|documentModels)/([^/?]+)/analyzeResults/([^/?]+)")
+_PARSE_RE = re.compile(r"^/api/id-document/parse/([^/?]+)")
+
+
+def _field(value: str, confidence: float, field_type: str = "string") -> Dict:
+    field = {"type": field_type, "content": value, "confidence": confidence}
+    field["valueDate" if field_type == "date" else "valueString"] = value
+    return field
+
+
+def sample_fields(rng: random.Random) -> Dict[str, Dict]:
+    """Поля извлечения в формате DocumentField: номер ID с лицевой стороны совпадает с MRZ оборота."""
+    year = rng.randint(1960, 2005)
+    id_number = f"784-{year}-{rng.randint(0, 9999999):07d}-{rng.randint(0, 9)}"
+    digits = id_number.replace("-", "")
+    return {
+        "name": _field("John Doe Smith", 0.97),
+        "nameAR": _field("جون دو سميث", 0.93),
+        "idNumber": _field(id_number, 0.99),
+        "occupation": _field("Software Engineer", 0.91),
+        "expiryDate": _field(f"{rng.randint(2026, 2034)}-06-15", 0.95, "date"),
+        "birthDate": _field(f"{year}-01-01", 0.96, "date"),
+        "backID": _field(f"ILARE{digits}<<<<<<<<", 0.94),
+    }
+
+
+class DocumentIntelligenceStub:
+    """Состояние заглушки: незавершенные операции, лимит запросов и счетчики."""
+
+    def __init__(self, classify_ms: float = 300.0, analyze_ms: float = 1500.0, jitter: float = 0.2,
+                 tps_limit: Optional[float] = None, api: bool = False, seed: Optional[int] = None):
+        self.classify_ms = classify_ms
+        self.analyze_ms = analyze_ms
+        self.jitter = jitter
+        self.tps_limit = tps_limit
+        self.api = api
+        self.rng = random.Random(seed)
+        self.operations: Dict[str, Tuple[float, Dict]] = {}
+        self.counters: Dict[str, int] = {}
+        self._tokens = tps_limit or 0.0
+        self._refilled = time.monotonic()
+
+    def _count(self, name: str) -> None:
+        self.counters[name] = self.counters.get(name, 0) + 1
+
+    def _delay(self, mean_ms: float) -> float:
+        return max(0.0, mean_ms * (1 + self.jitter * self.rng.uniform(-1, 1))) / 1000
+
+    def _take_token(self) -> bool:
+        """Корзина токенов лимита запросов в секунду (как у тарифов Document Intelligence)."""
+        if not self.tps_limit:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.tps_limit, self._tokens + (now - self._refilled) * self.tps_limit)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _result(self, kind: str, model_id: str) -> Dict:
+        if kind == "documentClassifiers":
+            document = {"docType": "eid", "confidence": round(self.rng.uniform(0.9, 0.99), 3),
+                        "boundingRegions": [], "spans": []}
+        else:
+            document = {"docType": f"{model_id}:eid", "confidence": 0.95, "boundingRegions": [], "spans": [],
+                        "fields": sample_fields(self.rng)}
+        return {"apiVersion": API_VERSION, "modelId": model_id, "stringIndexType": "textElements",
+                "content": "", "pages": [], "documents": [document]}
+
+    async def handle(self, method: str, path: str, headers: Dict[str, str],
+                     body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        request_id = str(uuid.uuid4())
+        base_headers = {"Content-Type": "application/json", "apim-request-id": request_id}
+
+        match = _ANALYZE_RE.match(path)
+        if method == "POST" and match:
+            kind, model_id = match.groups()
+            if not self._take_token():
+                self._count("throttled")
+                return 429, {**base_headers, "Retry-After": "1"}, json.dumps(
+                    {"error": {"code": "429", "message": "Rate limit exceeded (stub)"}}).encode()
+            self._count(kind)
+            delay = self._delay(self.classify_ms if kind == "documentClassifiers" else self.analyze_ms)
+            self.operations[request_id] = (time.monotonic() + delay, self._result(kind, model_id))
+            host = headers.get("host", f"localhost:{DEFAULT_PORT}")
+            location = f"http://{host}/documentintelligence/{kind}/{model_id}/analyzeResults/{request_id}" \
+                       f"?api-version={API_VERSION}"
+            return 202, {**base_headers, "Operation-Location": location,
+                         "retry-after-ms": str(int(delay * 1000))}, b""
+
+        match = _RESULT_RE.match(path)
+        if method == "GET" and match:
+            operation = self.operations.get(match.group(3))
+            if operation is None:
+                return 404, base_headers, json.dumps({"error": {"code": "NotFound", "message": "Unknown operation"}}).encode()
+            self._count("polls")
+            ready_at, result = operation
+            now = time.monotonic()
+            timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            status = {"createdDateTime": timestamp, "lastUpdatedDateTime": timestamp}
+            if now < ready_at:
+                return 200, {**base_headers, "retry-after-ms": str(max(1, int((ready_at - now) * 1000)))}, \
+                    json.dumps({"status": "running", **status}).encode()
+            del self.operations[match.group(3)]
+            return 200, base_headers, json.dumps({"status": "succeeded", **status, "analyzeResult": result},
+                                                 ensure_ascii=False).encode("utf-8")
+
+        match = _PARSE_RE.match(path)
+        if method == "POST" and match and self.api:
+            self._count("parse")
+            await asyncio.sleep(self._delay(self.classify_ms) + self._delay(self.analyze_ms))
+            fields = sample_fields(self.rng)
+            data = {name: field["content"] for name, field in fields.items() if name != "backID"}
+            return 200, base_headers, json.dumps({"response": 200, "errMsg": "", "data": data},
+                                                 ensure_ascii=False).encode("utf-8")
+
+        return 404, base_headers, json.dumps({"error": {"code": "NotFound", "message": path}}).encode()
+
+
+async def run_stub(stub: DocumentIntelligenceStub, host: str, port: int) -> None:
+    server = await serve(stub.handle, host, port)
+    print(f"Заглушка Document Intelligence: http://{host}:{port}/ "
+          f"(классификация {stub.classify_ms:.0f} мс, извлечение {stub.analyze_ms:.0f} мс, "
+          f"лимит: {stub.tps_limit or '-'} запросов/с{', эмуляция API' if stub.api else ''})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        print(f"Запросы: {stub.counters}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Локальная заглушка Azure Document Intelligence")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--classify-ms", type=float, default=300.0, help="Средняя длительность классификации, мс")
+    parser.add_argument("--analyze-ms", type=float, default=1500.0, help="Средняя длительность извлечения, мс")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Разброс длительности (доля среднего)")
+    parser.add_argument("--tps-limit", type=float, default=None,
+                        help="Лимит запросов анализа в секунду (сверх лимита — 429)")
+    parser.add_argument("--api", action="store_true",
+                        help="Отвечать и на POST /api/id-document/parse/{documentType} (проверка нагрузочного теста)")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    stub = DocumentIntelligenceStub(args.classify_ms, args.analyze_ms, args.jitter, args.tps_limit, args.api,
+                                    args.seed)
+    try:
+        asyncio.run(run_stub(stub, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Пакетное извлечение кропов полей (унифицированные категории) из объединенного датасета.
+
+Каждое изображение декодируется один раз, и из него вырезаются все его боксы; при заданном
+размере кропы масштабируются с сохранением пропорций и дополняются до фиксированной формы
+одним батчем. Изображения обрабатываются пулом процессов, кропы пишутся в упакованный формат
+(packed_dataset) отдельно по категориям: {output}/{split}/{category}/.
+
+Запись кропа в пакете: "image" — описание кропа (ID = ID аннотации, исходное изображение,
+область в исходных координатах, размер и масштаб), "annotations" — исходная аннотация.
+"""
+import argparse
+import os
+import time
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from coco_stream import iter_coco
+from packed_dataset import DEFAULT_SHARD_SIZE, PackWriter
+
+# Базовый путь к проекту (переопределяется переменной окружения OCR_POC_BASE)
+BASE_PATH = Path(os.environ.get("OCR_POC_BASE", r"C:\Miral\OCR_PoC"))
+DATASET_PATH = BASE_PATH / "data" / "eid-field-boxes"
+CROPS_DIRNAME = "crops"
+
+SPLITS = ["train", "valid", "test"]
+
+# Форматы хранения кропов: PNG без потерь, JPEG или сырые пиксели (uint8 BGR, размер в записи)
+CROP_FORMATS = ("png", "jpg", "raw")
+
+# Параметры воркера, передаются один раз через initializer пула
+_worker_state: Dict = {}
+
+
+@dataclass
+class CropStats:
+    """Статистика извлечения кропов."""
+    images: int = 0
+    crops: int = 0
+    bytes: int = 0
+    skipped_boxes: int = 0
+    seconds: float = 0.0
+    by_category: Dict[str, int] = field(default_factory=dict)
+    errors: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def crops_per_second(self) -> float:
+        return self.crops / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.crops} кропов из {self.images} изображений за {self.seconds:.2f} с "
+                f"({self.crops_per_second:.1f} кропов/с, {self.bytes / 1e6:.1f} MB), "
+                f"пропущено боксов: {self.skipped_boxes}, ошибок: {len(self.errors)}")
+
+
+def crop_regions(boxes: np.ndarray, width: int, height: int, margin: float = 0.0) -> np.ndarray:
+    """
+    Целочисленные области кропов [x1, y1, x2, y2] для боксов [x, y, w, h] (все сразу):
+    расширение на margin пикселей и обрезка по границам изображения.
+    """
+    x1 = np.floor(boxes[:, 0] - margin)
+    y1 = np.floor(boxes[:, 1] - margin)
+    x2 = np.ceil(boxes[:, 0] + boxes[:, 2] + margin)
+    y2 = np.ceil(boxes[:, 1] + boxes[:, 3] + margin)
+    regions = np.stack([x1, y1, x2, y2], axis=1)
+    np.clip(regions, 0, [width, height, width, height], out=regions)
+    return regions.astype(np.int64)
+
+
+def letterbox_batch(img: np.ndarray, regions: np.ndarray, size: Tuple[int, int],
+                    pad_value: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Кропы областей, вписанные в size (ширина, высота) с сохранением пропорций: один массив
+    (N, высота, ширина, каналы), кроп прижат к левому верхнему углу, остаток заполнен pad_value.
+    Возвращает батч и масштаб каждого кропа.
+    """
+    out_w, out_h = size
+    batch = np.full((len(regions), out_h, out_w) + img.shape[2:], pad_value, dtype=img.dtype)
+    widths, heights = regions[:, 2] - regions[:, 0], regions[:, 3] - regions[:, 1]
+    scales = np.minimum(out_w / widths, out_h / heights)
+    new_w = np.clip(np.round(widths * scales).astype(np.int64), 1, out_w)
+    new_h = np.clip(np.round(heights * scales).astype(np.int64), 1, out_h)
+    for i, (x1, y1, x2, y2) in enumerate(regions.tolist()):
+        interpolation = cv2.INTER_AREA if scales[i] < 1 else cv2.INTER_LINEAR
+        batch[i, :new_h[i], :new_w[i]] = cv2.resize(img[y1:y2, x1:x2], (int(new_w[i]), int(new_h[i])),
+                                                    interpolation=interpolation)
+    return batch, scales
+
+
+def _encode(crop: np.ndarray, fmt: str, quality: int) -> bytes:
+    if fmt == "raw":
+        return np.ascontiguousarray(crop).tobytes()
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if fmt == "jpg" else []
+    ok, encoded = cv2.imencode(f".{fmt}", crop, params)
+    if not ok:
+        raise ValueError("не удалось закодировать кроп")
+    return encoded.tobytes()
+
+
+def _init_worker(options: Dict) -> None:
+    _worker_state.update(options)
+
+
+def _crop_task(task: Tuple[str, np.ndarray]) -> Tuple[str, Optional[List[Tuple[int, List[int], float, bytes]]],
+                                                      Optional[str]]:
+    """
+    Кропы одного изображения в воркере: одно декодирование, все боксы.
+
+    Возвращает для каждого бокса (номер бокса, область, масштаб, байты); пустые области пропускаются.
+    """
+    image_path, boxes = task
+    img = cv2.imread(image_path)
+    if img is None:
+        return image_path, None, "не удалось прочитать изображение"
+    height, width = img.shape[:2]
+    regions = crop_regions(boxes, width, height, _worker_state["margin"])
+    keep = np.flatnonzero((regions[:, 2] > regions[:, 0]) & (regions[:, 3] > regions[:, 1]))
+    regions = regions[keep]
+    fmt, quality = _worker_state["format"], _worker_state["quality"]
+
+    if _worker_state["size"]:
+        crops, scales = letterbox_batch(img, regions, _worker_state["size"], _worker_state["pad_value"])
+    else:
+        crops = [img[y1:y2, x1:x2] for x1, y1, x2, y2 in regions.tolist()]
+        scales = np.ones(len(regions))
+    results = [(int(i), region, float(scale), _encode(crop, fmt, quality))
+               for i, region, scale, crop in zip(keep.tolist(), regions.tolist(), scales.tolist(), crops)]
+    return image_path, results, None
+
+
+def extract_split(ann_file: Path, image_dir: Path, output_dir: Path, categories: Optional[Sequence[str]] = None,
+                  size: Optional[Tuple[int, int]] = None, margin: float = 0.0, fmt: str = "png",
+                  quality: int = 95, pad_value: int = 0, workers: Optional[int] = None,
+                  shard_size: int = DEFAULT_SHARD_SIZE) -> CropStats:
+    """
+    Кропы разбиения в пакеты по категориям output_dir/{category}/; categories — имена категорий
+    (по умолчанию все). Порядок кропов в пакетах совпадает с порядком изображений и аннотаций.
+    """
+    if fmt not in CROP_FORMATS:
+        raise ValueError(f"Неизвестный формат кропов: {fmt}")
+    images: List[Dict] = []
+    annotations_by_image: Dict[int, List[Dict]] = {}
+    category_list: List[Dict] = []
+    for key, item in iter_coco(ann_file):
+        if key == "images":
+            images.append(item)
+        elif key == "annotations":
+            annotations_by_image.setdefault(item["image_id"], []).append(item)
+        elif key == "categories":
+            category_list = item
+    selected = {cat["id"]: cat for cat in category_list if categories is None or cat["name"] in categories}
+
+    tasks, task_anns = [], []
+    for img in images:
+        anns = [ann for ann in annotations_by_image.get(img["id"], []) if ann["category_id"] in selected]
+        if anns:
+            tasks.append((str(image_dir / img["file_name"]),
+                          np.array([ann["bbox"][:4] for ann in anns], dtype=np.float64).reshape(-1, 4)))
+            task_anns.append((img, anns))
+
+    stats = CropStats()
+    options = {"size": tuple(size) if size else None, "margin": margin, "format": fmt, "quality": quality,
+               "pad_value": pad_value}
+    start = time.perf_counter()
+    # Пакеты всех выбранных категорий (в том числе пустые) заменяют пакеты прошлого запуска
+    with ExitStack() as stack:
+        writers = {cat_id: stack.enter_context(PackWriter(output_dir / cat["name"], [cat], shard_size))
+                   for cat_id, cat in selected.items()}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as executor:
+            chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 8))
+            results = executor.map(_crop_task, tasks, chunksize=chunksize)
+            for (img, anns), (image_path, crops, error) in zip(task_anns, results):
+                if error is not None:
+                    stats.errors.append((image_path, error))
+                    continue
+                stats.images += 1
+                stats.skipped_boxes += len(anns) - len(crops)
+                for i, (x1, y1, x2, y2), scale, data in crops:
+                    ann = anns[i]
+                    crop_w, crop_h = size if size else (x2 - x1, y2 - y1)
+                    record = {"id": ann["id"], "image_id": img["id"], "file_name": img["file_name"],
+                              "category_id": ann["category_id"], "region": [x1, y1, x2 - x1, y2 - y1],
+                              "width": crop_w, "height": crop_h, "scale": round(scale, 6), "format": fmt}
+                    writers[ann["category_id"]].add(record, [ann], data)
+                    stats.crops += 1
+                    stats.bytes += len(data)
+                    name = selected[ann["category_id"]]["name"]
+                    stats.by_category[name] = stats.by_category.get(name, 0) + 1
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Извлечение кропов полей из объединенного датасета Emirates ID")
+    parser.add_argument("--splits", nargs="+", default=SPLITS)
+    parser.add_argument("--categories", nargs="+", default=None,
+                        help="Имена категорий (по умолчанию все унифицированные категории)")
+    parser.add_argument("--size", type=int, nargs=2, default=None, metavar=("WIDTH", "HEIGHT"),
+                        help="Вписать кропы в фиксированный размер с сохранением пропорций")
+    parser.add_argument("--margin", type=float, default=0.0, help="Расширение бокса, пикселей")
+    parser.add_argument("--pad-value", type=int, default=0, help="Значение заполнения при --size")
+    parser.add_argument("--format", choices=CROP_FORMATS, default="png")
+    parser.add_argument("--quality", type=int, default=95, help="Качество JPEG")
+    parser.add_argument("--shard-size-mb", type=int, default=256)
+    parser.add_argument("--output", type=Path, default=None,
+                        help=f"Каталог кропов (по умолчанию {CROPS_DIRNAME} в каталоге датасета)")
+    parser.add_argument("--workers", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    output = args.output or DATASET_PATH / CROPS_DIRNAME
+    for split in args.splits:
+        ann_file = DATASET_PATH / split / "_annotations.coco.json"
+        if not ann_file.exists():
+            print(f"Файл аннотаций не найден: {ann_file}")
+            continue
+        print(f"Кропы разбиения {split}...")
+        stats = extract_split(ann_file, ann_file.parent, output / split, args.categories,
+                              tuple(args.size) if args.size else None, args.margin, args.format, args.quality,
+                              args.pad_value, args.workers, args.shard_size_mb * 1024 * 1024)
+        print(f"  {stats.summary()}")
+        for name, count in sorted(stats.by_category.items()):
+            print(f"    {name}: {count}")
+        for image_path, error in stats.errors[:10]:
+            print(f"    Ошибка: {image_path}: {error}")
+    print(f"Кропы сохранены в: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Выдача и ремаппинг ID при объединении датасетов.
+
+Новые ID выдаются последовательно за один проход по источнику (без смещений по максимуму
+и без предположения о плотных исходных ID). Изображения ключуются именем файла источника,
+аннотации — исходным ID, поэтому при инкрементальном объединении ранее выданные ID
+сохраняются, а новые выдаются выше всех когда-либо выданных.
+
+Карты старый -> новый ID сохраняются рядом с объединенными аннотациями (_id_map.json) и
+используются для перевода предсказаний, сделанных по исходным датасетам.
+"""
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+ID_MAP_VERSION = 1
+ID_MAP_FILENAME = "_id_map.json"
+
+
+class IdRemapper:
+    """
+    Карты ID одного разбиения: по датасетам-источникам для изображений и аннотаций.
+
+    previous — карты прошлого запуска (IdRemapper.load); их ID переиспользуются.
+    """
+
+    def __init__(self, previous: Optional["IdRemapper"] = None):
+        self.next_image_id = previous.next_image_id if previous else 0
+        self.next_annotation_id = previous.next_annotation_id if previous else 0
+        self._previous_images = previous._images_by_name if previous else {}
+        self._previous_annotations = previous.annotations if previous else {}
+        # датасет -> {имя файла: новый ID}, {старый ID изображения: новый ID}, {старый ID аннотации: новый ID}
+        self._images_by_name: Dict[str, Dict[str, int]] = {}
+        self._images_by_id: Dict[str, Dict[int, int]] = {}
+        self._image_records: Dict[str, List[Tuple[int, str, int]]] = {}
+        self.annotations: Dict[str, Dict[int, int]] = {}
+
+    def image(self, dataset: str, old_id: int, file_name: str) -> int:
+        """Новый ID изображения источника (прежний, если файл уже встречался)."""
+        by_name = self._images_by_name.setdefault(dataset, {})
+        new_id = by_name.get(file_name)
+        if new_id is None:
+            new_id = self._previous_images.get(dataset, {}).get(file_name)
+            if new_id is None:
+                new_id = self.next_image_id
+                self.next_image_id += 1
+            by_name[file_name] = new_id
+            self._image_records.setdefault(dataset, []).append((old_id, file_name, new_id))
+        self._images_by_id.setdefault(dataset, {})[old_id] = new_id
+        return new_id
+
+    def image_id(self, dataset: str, old_id: int) -> Optional[int]:
+        """Новый ID изображения по исходному ID; None, если изображение не вошло в результат."""
+        return self._images_by_id.get(dataset, {}).get(old_id)
+
+    def annotation(self, dataset: str, old_id: int) -> int:
+        """Новый ID аннотации источника (прежний, если исходный ID уже встречался)."""
+        mapping = self.annotations.setdefault(dataset, {})
+        new_id = mapping.get(old_id)
+        if new_id is None:
+            new_id = self._previous_annotations.get(dataset, {}).get(old_id)
+            if new_id is None:
+                new_id = self.next_annotation_id
+                self.next_annotation_id += 1
+            mapping[old_id] = new_id
+        return new_id
+
+    def image_ids(self, dataset: str) -> Dict[int, int]:
+        """Карта старый -> новый ID изображений источника."""
+        return self._images_by_id.get(dataset, {})
+
+    def id_ranges(self, dataset: str) -> Dict[str, Optional[List[int]]]:
+        """Диапазоны выходных ID источника (для манифеста)."""
+        image_ids = self._images_by_name.get(dataset, {}).values()
+        ann_ids = self.annotations.get(dataset, {}).values()
+        return {
+            "image_id": [min(image_ids), max(image_ids)] if image_ids else None,
+            "annotation_id": [min(ann_ids), max(ann_ids)] if ann_ids else None,
+        }
+
+    def rekey(self, items: Iterable[Dict], dataset: str, field: str = "image_id") -> List[Dict]:
+        """
+        Перевод записей с исходными ID изображений (например, предсказаний в формате COCO results)
+        на ID объединенного датасета; записи с неизвестными ID отбрасываются.
+        """
+        mapping = self.image_ids(dataset)
+        return [{**item, field: mapping[item[field]]} for item in items if item[field] in mapping]
+
+    def discard(self, image_ids: Iterable[int], annotation_ids: Iterable[int]) -> None:
+        """
+        Удаление записей по новым ID (например, изображений, удаленных как дубликаты).
+        Счетчики не уменьшаются: удаленные ID повторно не выдаются.
+        """
+        image_ids, annotation_ids = set(image_ids), set(annotation_ids)
+        for dataset, records in self._image_records.items():
+            self._image_records[dataset] = [record for record in records if record[2] not in image_ids]
+        for mapping, removed in ((self._images_by_name, image_ids), (self._images_by_id, image_ids),
+                                 (self.annotations, annotation_ids)):
+            for dataset, ids in mapping.items():
+                mapping[dataset] = {key: new_id for key, new_id in ids.items() if new_id not in removed}
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": ID_MAP_VERSION,
+            "next_image_id": self.next_image_id,
+            "next_annotation_id": self.next_annotation_id,
+            "datasets": {
+                dataset: {
+                    "images": [list(record) for record in self._image_records.get(dataset, [])],
+                    "annotations": sorted(self.annotations.get(dataset, {}).items()),
+                }
+                for dataset in sorted(set(self._image_records) | set(self.annotations))
+            },
+        }
+
+    def save(self, path: Path) -> None:
+        """Атомарная запись карт ID (компактный JSON: [старый ID, имя файла, новый ID] и [старый, новый])."""
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, separators=(",", ":"))
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["IdRemapper"]:
+        """Карты ID прошлого запуска; None при отсутствии файла или несовместимой версии."""
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать карты ID {path}: {e}")
+            return None
+        if data.get("version") != ID_MAP_VERSION:
+            return None
+        remapper = cls()
+        remapper.next_image_id = data["next_image_id"]
+        remapper.next_annotation_id = data["next_annotation_id"]
+        for dataset, maps in data["datasets"].items():
+            for old_id, file_name, new_id in maps["images"]:
+                remapper._images_by_name.setdefault(dataset, {})[file_name] = new_id
+                remapper._images_by_id.setdefault(dataset, {})[old_id] = new_id
+                remapper._image_records.setdefault(dataset, []).append((old_id, file_name, new_id))
+            remapper.annotations[dataset] = {old_id: new_id for old_id, new_id in maps["annotations"]}
+        return remapper
@@ -0,0 +1,358 @@
+"""
+Персистентный кэш декодированных изображений и миниатюр, общий для инструментов датасета.
+
+Ключ записи — SHA-256 содержимого файла, поэтому копии одного изображения (например, в
+разбиениях объединенного датасета и в исходных датасетах) используют одну запись, а
+измененный файл получает новую. Хэш пересчитывается, только если изменились mtime или
+размер файла (карта путей хранится в paths.json).
+
+Запись — каталог {ключ[:2]}/{ключ}/ с миниатюрами нескольких разрешений (длинная сторона
+THUMBNAIL_SIZES) и, при store_decoded, полным RGB изображением; массивы хранятся в .npy
+и открываются через mmap. В записи также хранятся производные файлы инструментов (плитки
+контактных листов, см. artifact), они учитываются в размере кэша. Файлы пишутся атомарно (временный файл и переименование), поэтому
+кэшем могут одновременно пользоваться несколько процессов. Время последнего обращения —
+mtime каталога записи; при превышении max_bytes вытесняются давно не использованные записи.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from merge_manifest import file_fingerprint
+
+# Базовый путь к проекту (переопределяется переменной окружения OCR_POC_BASE)
+BASE_PATH = Path(os.environ.get("OCR_POC_BASE", r"C:\Miral\OCR_PoC"))
+CACHE_DIRNAME = ".image_cache"
+CACHE_PATH = BASE_PATH / "data" / CACHE_DIRNAME
+
+CACHE_VERSION = 1
+PATHS_FILENAME = "paths.json"
+
+# Разрешения миниатюр (длинная сторона, пикселей)
+THUMBNAIL_SIZES = (128, 256, 512)
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+_DECODED_NAME = "decoded.npy"
+_META_NAME = "meta.json"
+
+
+@dataclass
+class CacheStats:
+    """Статистика обращений к кэшу."""
+    hits: int = 0
+    misses: int = 0
+    written_bytes: int = 0
+    evicted: int = 0
+    evicted_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def merge(self, other: "CacheStats") -> None:
+        """Добавление статистики другого экземпляра (например, воркера пула)."""
+        self.hits += other.hits
+        self.misses += other.misses
+        self.written_bytes += other.written_bytes
+        self.evicted += other.evicted
+        self.evicted_bytes += other.evicted_bytes
+
+    def summary(self) -> str:
+        return (f"попаданий: {self.hits}, промахов: {self.misses} ({self.hit_rate:.0%}), "
+                f"записано: {self.written_bytes / 1e6:.1f} MB, вытеснено: {self.evicted} "
+                f"({self.evicted_bytes / 1e6:.1f} MB)")
+
+
+def decode_rgb(path: Path) -> Optional[np.ndarray]:
+    """Декодирование изображения в RGB (uint8, 3 канала); None, если файл не читается."""
+    img = cv2.imread(str(path))
+    if img is None:
+        return None
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def _save_npy(path: Path, array: np.ndarray) -> int:
+    """Атомарная запись массива; возвращает размер файла."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(array), allow_pickle=False)
+    os.replace(tmp_path, path)
+    return path.stat().st_size
+
+
+def _entry_size(entry: Path) -> int:
+    return sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+
+
+class ImageCache:
+    """
+    Кэш изображений в каталоге directory.
+
+    thumbnail() и decoded() возвращают RGB массивы (из кэша — только для чтения, через mmap);
+    при промахе изображение декодируется один раз, и в запись сразу сохраняются все уровни
+    миниатюр (и полное изображение при store_decoded).
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = DEFAULT_MAX_BYTES, store_decoded: bool = False,
+                 sizes: Sequence[int] = THUMBNAIL_SIZES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.store_decoded = store_decoded
+        self.sizes = tuple(sorted(sizes))
+        self.stats = CacheStats()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._paths: Dict[str, Dict] = self._load_paths()
+        self._paths_changed = False
+        self._written_since_evict = 0
+
+    def _load_paths(self) -> Dict[str, Dict]:
+        try:
+            with open(self.directory / PATHS_FILENAME, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data["paths"] if data.get("version") == CACHE_VERSION else {}
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def content_key(self, path: Path) -> Optional[str]:
+        """SHA-256 содержимого файла (без чтения файла, если mtime и размер не изменились)."""
+        name = str(Path(path).resolve())
+        previous = self._paths.get(name)
+        try:
+            fingerprint = file_fingerprint(Path(path), previous)
+        except FileNotFoundError:
+            return None
+        if fingerprint is not previous:
+            self._paths[name] = fingerprint
+            self._paths_changed = True
+        return fingerprint["sha256"]
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def _load(self, entry: Path, name: str) -> Optional[np.ndarray]:
+        try:
+            array = np.load(entry / name, mmap_mode="r", allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return array
+
+    def _populate(self, path: Path, entry: Path) -> Optional[np.ndarray]:
+        """Декодирование и запись всех уровней миниатюр (и полного изображения при store_decoded)."""
+        img = decode_rgb(path)
+        if img is None:
+            return None
+        entry.mkdir(parents=True, exist_ok=True)
+        height, width = img.shape[:2]
+        written = 0
+        for size in self.sizes:
+            if (entry / f"thumb_{size}.npy").exists():
+                continue
+            scale = size / max(height, width)
+            thumb = img if scale >= 1 else cv2.resize(
+                img, (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)),
+                interpolation=cv2.INTER_AREA)
+            written += _save_npy(entry / f"thumb_{size}.npy", thumb)
+        if self.store_decoded:
+            written += _save_npy(entry / _DECODED_NAME, img)
+        tmp_meta = entry / f".{_META_NAME}.{os.getpid()}.tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"width": width, "height": height}, f)
+        os.replace(tmp_meta, entry / _META_NAME)
+
+        self.stats.written_bytes += written
+        self._written_since_evict += written
+        if self._written_since_evict > self.max_bytes // 10:
+            self.evict()
+        return img
+
+    def source_size(self, path: Path) -> Optional[Tuple[int, int]]:
+        """Размер исходного изображения (ширина, высота) из записи кэша."""
+        key = self.content_key(path)
+        if key is None:
+            return None
+        try:
+            with open(self._entry(key) / _META_NAME, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            return meta["width"], meta["height"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def thumbnail(self, path: Path, max_side: int) -> Optional[Tuple[np.ndarray, float]]:
+        """
+        Миниатюра с длинной стороной не больше max_side и ее масштаб относительно исходника.
+
+        Берется наименьший уровень не меньше max_side и при необходимости уменьшается; если
+        max_side больше всех уровней, используется полное изображение.
+        """
+        key = self.content_key(path)
+        if key is None:
+            return None
+        entry = self._entry(key)
+        level = next((size for size in self.sizes if size >= max_side), None)
+        name = f"thumb_{level}.npy" if level is not None else _DECODED_NAME
+        img = self._load(entry, name)
+        size = self.source_size(path) if img is not None else None
+        if img is not None and size is not None:
+            self.stats.hits += 1
+            width, height = size
+        else:
+            self.stats.misses += 1
+            full = self._populate(path, entry)
+            if full is None:
+                return None
+            height, width = full.shape[:2]
+            img = full if level is None else np.load(entry / name, mmap_mode="r", allow_pickle=False)
+        scale = min(max_side / max(height, width), 1.0)
+        target = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+        if (img.shape[1], img.shape[0]) != target:
+            img = cv2.resize(np.asarray(img), target, interpolation=cv2.INTER_AREA)
+        return img, scale
+
+    def decoded(self, path: Path) -> Optional[np.ndarray]:
+        """Полное RGB изображение: из кэша при store_decoded, иначе декодирование (с записью миниатюр)."""
+        key = self.content_key(path)
+        if key is None:
+            return None
+        entry = self._entry(key)
+        if self.store_decoded:
+            img = self._load(entry, _DECODED_NAME)
+            if img is not None:
+                self.stats.hits += 1
+                return img
+        self.stats.misses += 1
+        if (entry / _META_NAME).exists() and not self.store_decoded:
+            # Миниатюры уже есть, полное изображение не хранится
+            return decode_rgb(path)
+        return self._populate(path, entry)
+
+    def artifact(self, path: Path, name: str) -> Optional[Path]:
+        """
+        Путь производного файла изображения (например, отрисованной плитки) в его записи:
+        такие файлы входят в размер записи и вытесняются вместе с ней. Если файл есть, время
+        обращения записи обновляется. None, если исходник не найден. В stats не учитывается.
+        """
+        key = self.content_key(path)
+        if key is None:
+            return None
+        entry = self._entry(key)
+        artifact = entry / name
+        if artifact.exists():
+            try:
+                os.utime(entry)
+            except OSError:
+                pass
+        return artifact
+
+    def store_artifact(self, artifact: Path, data: bytes, stale_prefix: Optional[str] = None) -> None:
+        """
+        Атомарная запись производного файла (путь из artifact()); файлы записи с именем на
+        stale_prefix, кроме записываемого, удаляются как устаревшие версии.
+        """
+        artifact.parent.mkdir(parents=True, exist_ok=True)
+        if stale_prefix:
+            for old in artifact.parent.glob(f"{stale_prefix}*"):
+                if old.name != artifact.name:
+                    old.unlink(missing_ok=True)
+        tmp_path = artifact.with_name(f".{artifact.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, artifact)
+        self.stats.written_bytes += len(data)
+        self._written_since_evict += len(data)
+        if self._written_since_evict > self.max_bytes // 10:
+            self.evict()
+
+    def entries(self) -> List[Tuple[Path, float, int]]:
+        """Записи кэша: (каталог, время последнего обращения, размер в байтах)."""
+        result = []
+        for shard in self.directory.iterdir():
+            if not shard.is_dir():
+                continue
+            for entry in shard.iterdir():
+                try:
+                    result.append((entry, entry.stat().st_mtime, _entry_size(entry)))
+                except OSError:
+                    continue
+        return result
+
+    def evict(self) -> None:
+        """Вытеснение давно не использованных записей до размера max_bytes."""
+        self._written_since_evict = 0
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        for entry, _, size in sorted(entries, key=lambda item: item[1]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            self.stats.evicted += 1
+            self.stats.evicted_bytes += size
+
+    def close(self) -> None:
+        """Сохранение карты путей (объединяется с записанной другими процессами)."""
+        if not self._paths_changed:
+            return
+        paths = {**self._load_paths(), **self._paths}
+        tmp_path = self.directory / f".{PATHS_FILENAME}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "paths": paths}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.directory / PATHS_FILENAME)
+        self._paths_changed = False
+
+    def __enter__(self) -> "ImageCache":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Кэш декодированных изображений и миниатюр")
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_PATH)
+    parser.add_argument("--warm", type=Path, nargs="+", default=None,
+                        help="Заполнить кэш изображениями из каталогов")
+    parser.add_argument("--decoded", action="store_true", help="При --warm сохранять и полные изображения")
+    parser.add_argument("--max-gb", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3)
+    parser.add_argument("--evict", action="store_true", help="Вытеснить записи сверх --max-gb")
+    parser.add_argument("--clear", action="store_true", help="Удалить кэш")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.clear:
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
+        print(f"Кэш удален: {args.cache_dir}")
+        return
+    with ImageCache(args.cache_dir, int(args.max_gb * 1024 ** 3), store_decoded=args.decoded) as cache:
+        if args.warm:
+            start = time.perf_counter()
+            for directory in args.warm:
+                for path in sorted(directory.iterdir()):
+                    if path.suffix.lower() in (".jpg", ".jpeg", ".png"):
+                        if args.decoded:
+                            cache.decoded(path)
+                        else:
+                            cache.thumbnail(path, cache.sizes[-1])
+            print(f"Заполнение за {time.perf_counter() - start:.2f} с: {cache.stats.summary()}")
+        if args.evict:
+            cache.evict()
+        entries = cache.entries()
+        print(f"Кэш {args.cache_dir}: {len(entries)} записей, "
+              f"{sum(size for _, _, size in entries) / 1e6:.1f} MB (лимит {args.max_gb:g} GB)")
+
+
+if __name__ == "__main__":
+    main()
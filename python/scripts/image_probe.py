@@ -0,0 +1,193 @@
+"""
+Проверка изображений по заголовкам файлов без декодирования пикселей.
+
+Размеры читаются из заголовка (JPEG: сегмент SOF, PNG: чанк IHDR), обрезанные файлы
+определяются по концу потока (JPEG: маркер EOI, PNG: чанк IEND). Читаются только несколько
+сотен байт начала и конца файла, поэтому проверка всего корпуса занимает малую долю времени
+полного декодирования через cv2.imread. Файлы проверяются параллельно пулом потоков.
+"""
+import argparse
+import json
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+import logging
+
+from coco_records import ImageRecord
+from coco_stream import iter_coco
+from pdf_writer import SOF_MARKERS, STANDALONE_MARKERS
+
+logger = logging.getLogger(__name__)
+
+# Базовый путь к проекту (переопределяется переменной окружения OCR_POC_BASE)
+BASE_PATH = Path(os.environ.get("OCR_POC_BASE", r"C:\Miral\OCR_PoC"))
+DATASET_PATH = BASE_PATH / "data" / "eid-field-boxes"
+
+SPLITS = ["train", "valid", "test"]
+REPORT_FILENAME = "probe_report.json"
+
+# Коды ошибок файла
+ERROR_CODES = ("missing", "unsupported_format", "corrupt_header", "truncated")
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_IEND = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+# Сколько байт конца JPEG просматривается в поисках EOI (после него бывают байты-заполнители)
+_JPEG_TAIL_BYTES = 1024
+
+
+@dataclass
+class ProbeResult:
+    """Результат проверки одного файла."""
+    format: Optional[str] = None
+    width: int = 0
+    height: int = 0
+    file_size: int = 0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _jpeg_frame(f: BinaryIO, file_size: int) -> Optional[Tuple[int, int]]:
+    """Размеры кадра из сегмента SOF; None при поврежденной структуре маркеров."""
+    pos = 2
+    while pos + 4 <= file_size:
+        f.seek(pos)
+        head = f.read(4)
+        if head[0] != 0xFF:
+            return None
+        marker = head[1]
+        if marker == 0xFF:  # байт-заполнитель
+            pos += 1
+            continue
+        if marker in STANDALONE_MARKERS:
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):  # EOI или начало данных до SOF
+            return None
+        (length,) = struct.unpack(">H", head[2:4])
+        if marker in SOF_MARKERS:
+            segment = f.read(5)
+            if len(segment) < 5:
+                return None
+            _, height, width = struct.unpack(">BHH", segment)
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def probe_image(path: Path) -> ProbeResult:
+    """Формат, размеры и размер файла по заголовку; error — код из ERROR_CODES."""
+    try:
+        file_size = path.stat().st_size
+        with open(path, "rb") as f:
+            head = f.read(24)
+            if head[:2] == b"\xff\xd8":
+                result = ProbeResult("jpeg", file_size=file_size)
+                frame = _jpeg_frame(f, file_size)
+                f.seek(max(0, file_size - _JPEG_TAIL_BYTES))
+                complete = b"\xff\xd9" in f.read()
+            elif head[:8] == _PNG_SIGNATURE:
+                result = ProbeResult("png", file_size=file_size)
+                frame = struct.unpack(">II", head[16:24]) if head[12:16] == b"IHDR" else None
+                f.seek(max(0, file_size - len(_PNG_IEND)))
+                complete = f.read() == _PNG_IEND
+            else:
+                return ProbeResult(file_size=file_size, error="unsupported_format")
+    except FileNotFoundError:
+        return ProbeResult(error="missing")
+
+    if frame is None or frame[0] == 0 or frame[1] == 0:
+        result.error = "corrupt_header"
+    else:
+        result.width, result.height = frame
+        if not complete:
+            result.error = "truncated"
+    return result
+
+
+def probe_images(paths: Iterable[Path], workers: Optional[int] = None) -> List[ProbeResult]:
+    """Параллельная проверка файлов (чтение заголовков — операции I/O-bound, пул потоков)."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(probe_image, paths))
+
+
+def image_issue(img: ImageRecord, result: ProbeResult) -> Optional[Dict]:
+    """
+    Проблема изображения COCO по результату проверки: ошибка файла или несовпадение размеров
+    с записью (swapped — размеры переставлены, как при неучтенном EXIF-повороте); None, если
+    все в порядке.
+    """
+    if result.error:
+        return {"file_name": img.file_name, "id": img.id, "error": result.error,
+                "file_size": result.file_size}
+    expected = (img.width, img.height)
+    if expected != (result.width, result.height):
+        return {"file_name": img.file_name, "id": img.id, "error": "dimension_mismatch",
+                "coco": list(expected), "actual": [result.width, result.height],
+                "swapped": expected == (result.height, result.width), "file_size": result.file_size}
+    return None
+
+
+def probe_coco(ann_file: Path, image_dir: Path, workers: Optional[int] = None) -> Dict:
+    """Проверка всех изображений COCO файла: ошибки файлов и несовпадения размеров с записями."""
+    start = time.perf_counter()
+    images = [ImageRecord.from_json(item) for key, item in iter_coco(ann_file, sections=("images",))
+              if key == "images"]
+    results = probe_images([image_dir / img.file_name for img in images], workers)
+
+    issues = [issue for issue in map(image_issue, images, results) if issue]
+    counts = dict.fromkeys(ERROR_CODES + ("dimension_mismatch",), 0)
+    for issue in issues:
+        counts[issue["error"]] += 1
+    return {
+        "file": str(ann_file),
+        "images": len(images),
+        "bytes": sum(result.file_size for result in results),
+        "formats": {fmt: sum(result.format == fmt for result in results) for fmt in ("jpeg", "png")},
+        "counts": counts,
+        "issues": issues,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def summarize(report: Dict) -> str:
+    counts = ", ".join(f"{code}: {count}" for code, count in report["counts"].items() if count)
+    return (f"{report['images']} изображений, {report['bytes'] / 1e6:.1f} MB: "
+            f"проблем {len(report['issues'])}{f' ({counts})' if counts else ''}, {report['seconds']:.2f} с")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Проверка изображений датасета по заголовкам файлов")
+    parser.add_argument("--splits", nargs="+", default=SPLITS)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", type=Path, default=None,
+                        help=f"Файл отчета (по умолчанию {REPORT_FILENAME} в каталоге датасета)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args(argv)
+    reports = {}
+    for split in args.splits:
+        ann_file = DATASET_PATH / split / "_annotations.coco.json"
+        if not ann_file.exists():
+            logger.warning(f"Файл аннотаций не найден: {ann_file}")
+            continue
+        reports[split] = probe_coco(ann_file, ann_file.parent, args.workers)
+        logger.info(f"{split}: {summarize(reports[split])}")
+
+    report_path = args.output or DATASET_PATH / REPORT_FILENAME
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(reports, f, indent=2, ensure_ascii=False)
+    logger.info(f"Отчет сохранен в: {report_path}")
+
+
+if __name__ == "__main__":
+    main()
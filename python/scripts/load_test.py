@@ -0,0 +1,216 @@
+"""
+Нагрузочный тест эндпоинта POST api/id-document/parse/{documentType} (IdDocumentController).
+
+Документы берутся из корпуса create_pdf_dataset.py (PDF, поле Front) или парами лицевая/оборотная
+сторона из eid-field-boxes/train (--pairs, поля Front и Back). Тела multipart собираются заранее
+в памяти, чтобы генератор нагрузки не читал диск во время замера.
+
+Режимы:
+    замкнутый цикл (по умолчанию) — --concurrency воркеров, каждый отправляет следующий запрос
+        сразу после ответа на предыдущий;
+    открытый цикл (--rate) — запросы запланированы с заданной частотой; задержка считается от
+        запланированного момента, поэтому ожидание свободного воркера входит в нее (отдельно
+        выводится время обслуживания — от фактической отправки).
+
+Без доступа к Azure сервис запускается с локальной заглушкой Document Intelligence (di_stub.py).
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from async_http import HttpConnection, multipart_body
+from create_pdf_dataset import list_page_images, plan_documents
+
+# Базовый путь к проекту (переопределяется переменной окружения OCR_POC_BASE)
+BASE_PATH = Path(os.environ.get("OCR_POC_BASE", r"C:\Miral\OCR_PoC"))
+PDF_PATH = BASE_PATH / "data" / "eid-pdf"
+TRAIN_PATH = BASE_PATH / "data" / "eid-field-boxes" / "train"
+
+DEFAULT_URL = "http://localhost:5154"
+PARSE_PATH = "/api/id-document/parse/{document_type}"
+
+_CONTENT_TYPES = {".pdf": "application/pdf", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+
+PERCENTILES = (50, 95, 99)
+
+
+@dataclass
+class RequestResult:
+    """Результат одного запроса; latency — от запланированного момента, service — от отправки."""
+    status: int
+    response: Optional[int]
+    latency: float
+    service: float
+    error: Optional[str] = None
+
+
+def _file_part(field: str, path: Path) -> Tuple[str, str, str, bytes]:
+    return field, path.name, _CONTENT_TYPES.get(path.suffix.lower(), "application/octet-stream"), path.read_bytes()
+
+
+def load_pdf_bodies(pdf_dir: Path, limit: Optional[int] = None) -> List[Tuple[str, bytes]]:
+    """Тела запросов из PDF корпуса: (content-type, тело)."""
+    paths = sorted(pdf_dir.glob("*.pdf"))[:limit]
+    return [multipart_body([_file_part("Front", path)]) for path in paths]
+
+
+def load_pair_bodies(train_dir: Path, count: int, seed: Optional[int] = None) -> List[Tuple[str, bytes]]:
+    """Тела запросов из пар изображений лицевой и оборотной стороны (подбор как в create_pdf_dataset)."""
+    front_images, back_images = list_page_images(str(train_dir))
+    if not front_images or not back_images:
+        return []
+    pairs = plan_documents(front_images, back_images, count, seed)
+    return [multipart_body([_file_part("Front", train_dir / front), _file_part("Back", train_dir / back)])
+            for front, back in pairs]
+
+
+async def _send(connection: HttpConnection, path: str, body: Tuple[str, bytes], scheduled: float) -> RequestResult:
+    content_type, data = body
+    sent = time.perf_counter()
+    try:
+        response = await connection.request("POST", path, {"Content-Type": content_type}, data)
+    except (OSError, asyncio.IncompleteReadError) as e:
+        now = time.perf_counter()
+        return RequestResult(0, None, now - scheduled, now - sent, f"{type(e).__name__}: {e}")
+    now = time.perf_counter()
+    api_response = None
+    try:
+        api_response = json.loads(response.body).get("response")
+    except (ValueError, AttributeError):
+        pass
+    return RequestResult(response.status, api_response, now - scheduled, now - sent)
+
+
+async def run_load(url: str, document_type: str, bodies: List[Tuple[str, bytes]], concurrency: int = 8,
+                   rate: Optional[float] = None, requests: Optional[int] = 200, duration: Optional[float] = None,
+                   warmup: int = 0, verify_tls: bool = True) -> Tuple[List[RequestResult], float]:
+    """
+    Отправка запросов (документы по кругу); возвращает результаты без прогрева и длительность
+    измеряемой части в секундах. Останов по числу запросов или по duration секунд.
+    """
+    path = PARSE_PATH.format(document_type=document_type)
+    total = None if duration else warmup + (requests or 0)
+    results: List[RequestResult] = []
+    counter = 0
+    measure_start: List[float] = []
+    start = time.perf_counter()
+    deadline = None
+
+    async def worker() -> None:
+        nonlocal counter, deadline
+        connection = HttpConnection(url, verify_tls)
+        try:
+            while True:
+                index = counter
+                if total is not None and index >= total:
+                    break
+                counter += 1
+                if rate:
+                    scheduled = start + index / rate
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    scheduled = time.perf_counter()
+                if index == warmup:
+                    measure_start.append(scheduled)
+                    if duration:
+                        deadline = scheduled + duration
+                if deadline is not None and scheduled >= deadline:
+                    break
+                result = await _send(connection, path, bodies[index % len(bodies)], scheduled)
+                if index >= warmup:
+                    results.append(result)
+        finally:
+            await connection.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - (measure_start[0] if measure_start else start)
+    return results, elapsed
+
+
+def build_report(results: List[RequestResult], elapsed: float) -> Dict:
+    """Сводка: коды HTTP и ApiResponse.response, перцентили задержки (мс), документов в секунду."""
+    report: Dict = {"requests": len(results), "seconds": round(elapsed, 3), "status": {}, "response": {},
+                    "errors": {}}
+    for result in results:
+        report["status"][str(result.status)] = report["status"].get(str(result.status), 0) + 1
+        if result.response is not None:
+            report["response"][str(result.response)] = report["response"].get(str(result.response), 0) + 1
+        if result.error:
+            report["errors"][result.error] = report["errors"].get(result.error, 0) + 1
+    succeeded = sum(result.status == 200 for result in results)
+    report["docs_per_second"] = round(succeeded / elapsed, 2) if elapsed > 0 else 0.0
+    report["requests_per_second"] = round(len(results) / elapsed, 2) if elapsed > 0 else 0.0
+    for name in ("latency", "service"):
+        values = np.array([getattr(result, name) for result in results]) * 1000
+        if len(values):
+            stats = {f"p{p}": value for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+            stats.update(mean=values.mean(), max=values.max())
+            report[f"{name}_ms"] = {key: round(float(value), 1) for key, value in stats.items()}
+    return report
+
+
+def summarize(report: Dict) -> str:
+    latency = report.get("latency_ms", {})
+    percentiles = ", ".join(f"p{p} {latency[f'p{p}']:.0f}" for p in PERCENTILES if f"p{p}" in latency)
+    return (f"{report['requests']} запросов за {report['seconds']:.1f} с: {report['docs_per_second']} док/с, "
+            f"задержка мс: {percentiles or '-'}, HTTP: {report['status']}, response: {report['response']}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API извлечения данных Emirates ID")
+    parser.add_argument("--url", default=DEFAULT_URL, help="Адрес сервиса")
+    parser.add_argument("--document-type", default="emirates-id")
+    parser.add_argument("--pdf-dir", type=Path, default=PDF_PATH, help="Корпус PDF (create_pdf_dataset.py)")
+    parser.add_argument("--pairs", action="store_true",
+                        help="Отправлять пары изображений лицевой и оборотной стороны вместо PDF")
+    parser.add_argument("--train-dir", type=Path, default=TRAIN_PATH)
+    parser.add_argument("--documents", type=int, default=200, help="Число различных документов в наборе")
+    parser.add_argument("--seed", type=int, default=None, help="Seed подбора пар (--pairs)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Число воркеров (соединений)")
+    parser.add_argument("--rate", type=float, default=None, help="Открытый цикл: запросов в секунду")
+    parser.add_argument("--requests", type=int, default=200, help="Число измеряемых запросов")
+    parser.add_argument("--duration", type=float, default=None, help="Длительность замера, с (вместо --requests)")
+    parser.add_argument("--warmup", type=int, default=0, help="Запросы прогрева (не входят в статистику)")
+    parser.add_argument("--insecure", action="store_true", help="Не проверять TLS сертификат (dev-certs)")
+    parser.add_argument("--output", type=Path, default=None, help="JSON файл отчета")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.pairs:
+        bodies = load_pair_bodies(args.train_dir, args.documents, args.seed)
+    else:
+        bodies = load_pdf_bodies(args.pdf_dir, args.documents)
+    if not bodies:
+        print(f"Документы не найдены: {args.train_dir if args.pairs else args.pdf_dir}")
+        return
+    print(f"Документов: {len(bodies)} ({sum(len(body) for _, body in bodies) / 1e6:.1f} MB), "
+          f"воркеров: {args.concurrency}, {f'{args.rate} запросов/с' if args.rate else 'замкнутый цикл'}")
+
+    results, elapsed = asyncio.run(run_load(args.url, args.document_type, bodies, args.concurrency, args.rate,
+                                            args.requests, args.duration, args.warmup, not args.insecure))
+    report = build_report(results, elapsed)
+    report.update(url=args.url, document_type=args.document_type, concurrency=args.concurrency, rate=args.rate)
+    print(summarize(report))
+    if "service_ms" in report:
+        print(f"Время обслуживания мс: {report['service_ms']}")
+    for error, count in list(report["errors"].items())[:10]:
+        print(f"  Ошибка ({count}): {error}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Отчет сохранен в: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Материализация изображений в выходной датасет: копирование или связывание файлов через пул потоков.
+"""
+import errno
+import os
+import shutil
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Поддерживаемые режимы материализации
+LINK_MODES = ("copy", "hardlink", "symlink", "reflink")
+
+# FICLONE из linux/fs.h: клонирование файла на CoW файловых системах (btrfs, xfs)
+_FICLONE = 0x40049409
+
+
+@dataclass
+class MaterializeStats:
+    """Статистика материализации для одного режима."""
+    mode: str
+    files: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    fallbacks: int = 0
+    errors: List[Tuple[Path, str]] = field(default_factory=list)
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / (1024 * 1024) / self.seconds if self.seconds > 0 else 0.0
+
+    def merge(self, other: "MaterializeStats") -> None:
+        """Накопление статистики другого прогона того же режима."""
+        self.files += other.files
+        self.bytes += other.bytes
+        self.seconds += other.seconds
+        self.fallbacks += other.fallbacks
+        self.errors.extend(other.errors)
+
+    def summary(self) -> str:
+        return (f"{self.mode}: {self.files} файлов, {self.bytes / (1024 * 1024):.1f} МБ "
+                f"за {self.seconds:.2f} с ({self.files_per_second:.1f} файлов/с, "
+                f"{self.mb_per_second:.1f} МБ/с), fallback на копирование: {self.fallbacks}, "
+                f"ошибок: {len(self.errors)}")
+
+
+def _remove_existing(dst: Path) -> None:
+    """Удаление результата предыдущего запуска (ссылки нельзя перезаписать поверх)."""
+    if dst.is_symlink() or dst.exists():
+        dst.unlink()
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    """Клонирование файла через ioctl FICLONE (только Linux)."""
+    import fcntl  # недоступен на Windows
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            dst.unlink()
+            raise
+    shutil.copystat(src, dst)
+
+
+def _materialize_one(src: Path, dst: Path, mode: str) -> bool:
+    """
+    Материализация одного файла. Возвращает True, если пришлось откатиться на копирование
+    (другая файловая система, отсутствие поддержки ссылок или reflink).
+    """
+    # Результат предыдущего запуска в другом режиме может оказаться ссылкой на сам источник
+    _remove_existing(dst)
+    if mode == "copy":
+        shutil.copy2(src, dst)
+        return False
+
+    try:
+        if mode == "hardlink":
+            os.link(src, dst)
+        elif mode == "symlink":
+            os.symlink(src.resolve(), dst)
+        elif mode == "reflink":
+            _reflink(src, dst)
+        else:
+            raise ValueError(f"Неизвестный режим материализации: {mode}")
+        return False
+    except (OSError, ImportError, NotImplementedError) as e:
+        if isinstance(e, OSError) and e.errno not in (
+                errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EMLINK, None):
+            raise
+        shutil.copy2(src, dst)
+        return True
+
+
+def default_workers() -> int:
+    """Размер пула по умолчанию: операции I/O-bound, как у ThreadPoolExecutor."""
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def _run_job(src: Path, dst: Path, mode: str) -> Tuple[int, bool, Optional[str]]:
+    try:
+        size = src.stat().st_size
+        fallback = _materialize_one(src, dst, mode)
+        return size, fallback, None
+    except Exception as e:
+        return 0, False, str(e)
+
+
+class Materializer:
+    """
+    Фоновая материализация: задания ставятся в пул потоков по мере появления (например, пока
+    разбираются аннотации следующего источника), результаты собираются в close().
+
+    Ошибки по отдельным файлам не прерывают прогон, а собираются в статистику в порядке заданий.
+    """
+
+    def __init__(self, mode: str = "copy", workers: Optional[int] = None):
+        if mode not in LINK_MODES:
+            raise ValueError(f"Неизвестный режим материализации: {mode}")
+        self.stats = MaterializeStats(mode=mode)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._workers = workers
+        self._futures: List[Tuple[Path, Future]] = []
+        self._start = 0.0
+
+    def submit(self, src: Path, dst: Path) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers or default_workers())
+            self._start = time.perf_counter()
+        self._futures.append((src, self._executor.submit(_run_job, src, dst, self.stats.mode)))
+
+    def close(self) -> MaterializeStats:
+        """Ожидание всех заданий; seconds — время от первого задания до завершения последнего."""
+        if self._executor is None:
+            return self.stats
+        for src, future in self._futures:
+            size, fallback, error = future.result()
+            if error is not None:
+                logger.warning(f"    Не удалось материализовать {src}: {error}")
+                self.stats.errors.append((src, error))
+                continue
+            self.stats.files += 1
+            self.stats.bytes += size
+            self.stats.fallbacks += int(fallback)
+        self._executor.shutdown()
+        self._executor, self._futures = None, []
+        self.stats.seconds += time.perf_counter() - self._start
+        return self.stats
+
+    def __enter__(self) -> "Materializer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        elif self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
@@ -1,21 +1,39 @@
 """
 Скрипт для объединения трех COCO датасетов Emirates ID с унифицированными названиями классов.
 """
+import argparse
+import cProfile
 import json
 import os
-import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 import logging
 
+from coco_records import AnnotationRecord, ImageRecord
+from coco_stream import CocoStreamWriter, iter_coco
+from coco_validate import DEFAULT_OVERLAP_IOU, REPORT_FILENAME as VALIDATION_REPORT_FILENAME
+from coco_validate import summarize as summarize_validation, total_issues, validate_file
+from dedup import (DEFAULT_MAX_DISTANCE, REPORT_FILENAME, drop_duplicates, find_duplicates, record_dropped,
+                   save_report, summarize)
+from image_probe import REPORT_FILENAME as PROBE_REPORT_FILENAME, image_issue, probe_images
+from id_allocator import ID_MAP_FILENAME, IdRemapper
+from materialize import LINK_MODES, MaterializeStats, Materializer
+from merge_metrics import MergeMetrics
+from merge_manifest import (MANIFEST_FILENAME, MergeManifest, config_hash, fingerprints,
+                            same_content, same_stat)
+from packed_dataset import pack_coco
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Базовый путь к проекту
-BASE_PATH = Path(r"C:\Miral\OCR_PoC")
+# Базовый путь к проекту (переопределяется переменной окружения OCR_POC_BASE)
+BASE_PATH = Path(os.environ.get("OCR_POC_BASE", r"C:\Miral\OCR_PoC"))
 DATA_PATH = BASE_PATH / "data"
 OUTPUT_PATH = DATA_PATH / "eid-field-boxes"
+PACKED_DIRNAME = "packed"
 
 # Пути к датасетам
 DATASETS = {
@@ -80,134 +98,464 @@ def load_coco_json(file_path: Path) -> Dict:
         logger.error(f"Ошибка при загрузке файла {file_path}: {e}")
         raise
 
-def merge_datasets(splits: List[str] = ["train", "valid", "test"]) -> None:
-    """Объединение датасетов с унифицированными категориями."""
+def split_unchanged(split: str, state: Dict, link_mode: str, compact_json: bool = False,
+                    workers: Optional[int] = None, pack_shard_size: Optional[int] = None,
+                    dedup: Optional[str] = None, probe: bool = False) -> bool:
+    """
+    Проверка, что разбиение не изменилось с прошлого запуска: совпадают конфигурация,
+    режим материализации, исходные аннотации и изображения, а выходные файлы на месте.
+    """
+    if not state or state.get("config") != config_hash(UNIFIED_CATEGORIES, CATEGORY_MAPPINGS):
+        return False
+    if state.get("link_mode") != link_mode or state.get("compact_json", False) != compact_json:
+        return False
+    if state.get("pack_shard_size") != pack_shard_size:
+        return False
+    if pack_shard_size and not (OUTPUT_PATH / PACKED_DIRNAME / split / "meta.json").exists():
+        return False
+    if state.get("dedup") != dedup or state.get("probe", False) != probe:
+        return False
+    if set(state.get("sources", {})) != set(DATASETS):
+        return False
+    
+    split_dir = OUTPUT_PATH / split
+    if not same_stat(split_dir / "_annotations.coco.json", state.get("output")):
+        return False
+    if not (split_dir / ID_MAP_FILENAME).exists():
+        return False
+    
+    # Изображения, удаленные как дубликаты, в выходном каталоге отсутствуют намеренно
+    dropped = set(state.get("dedup_dropped", []))
+    items = []
+    for dataset_name, dataset_path in DATASETS.items():
+        source_state = state["sources"][dataset_name]
+        if source_state.get("missing"):
+            # Разбиения не было в источнике: изменение — только появление файла аннотаций
+            if (dataset_path / split / "_annotations.coco.json").exists():
+                return False
+            continue
+        items.append((f"{dataset_name}/_annotations", dataset_path / split / "_annotations.coco.json",
+                      source_state.get("annotations")))
+        for old_filename, image_fp in source_state.get("images", {}).items():
+            new_filename = f"{dataset_name}_{old_filename}"
+            if new_filename not in dropped and not (split_dir / new_filename).exists():
+                return False
+            items.append((f"{dataset_name}/{old_filename}", dataset_path / split / old_filename, image_fp))
+    
+    current = fingerprints(items, workers=workers)
+    return all(same_content(previous, current[key]) for key, _, previous in items)
+
+def merge_datasets(splits: List[str] = ["train", "valid", "test"], link_mode: str = "copy",
+                   workers: Optional[int] = None, full_rebuild: bool = False,
+                   compact_json: bool = False, pack_shard_size: Optional[int] = None,
+                   metrics: Optional[MergeMetrics] = None, dedup: Optional[str] = None,
+                   dedup_distance: int = DEFAULT_MAX_DISTANCE, validate: bool = False,
+                   overlap_iou: float = DEFAULT_OVERLAP_IOU,
+                   split_workers: Optional[int] = None, probe: bool = False) -> MaterializeStats:
+    """
+    Инкрементальное объединение датасетов с унифицированными категориями: неизмененные по
+    манифесту разбиения пропускаются, измененные объединяются параллельно в split_workers
+    процессах. link_mode — способ материализации изображений (materialize.LINK_MODES),
+    full_rebuild — объединение без манифеста с новой выдачей ID. Необязательные этапы: probe
+    (проверка изображений), dedup ("report" или "drop"), validate и pack_shard_size (упаковка
+    в шарды); их отчеты пишутся рядом с результатом. Возвращает статистику материализации.
+    """
     
     # Создание выходной директории
     OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
     logger.info(f"Создана выходная директория: {OUTPUT_PATH}")
     
+    total_materialize_stats = MaterializeStats(mode=link_mode)
+    manifest = MergeManifest.load(OUTPUT_PATH / MANIFEST_FILENAME)
+    metrics = metrics if metrics is not None else MergeMetrics()
+    changed_splits = []
+    pending = []
+    probe_reports = {}
+    
     for split in splits:
         logger.info(f"\nОбработка разбиения: {split}")
         
-        # Инициализация объединенного датасета
-        merged_data = {
-            "info": {
-                "year": "2025",
-                "version": "1.0",
-                "description": "Unified Emirates ID fields dataset combining detection and segmentation annotations",
-                "contributor": "Yaroslav Kazakov",
-                "url": "",
-                "date_created": "2025-07-16"
-            },
-            "licenses": [{
-                "id": 1,
-                "url": "https://creativecommons.org/licenses/by/4.0/",
-                "name": "CC BY 4.0"
-            }],
-            "categories": [{"id": cat_id, **cat_info} for cat_id, cat_info in UNIFIED_CATEGORIES.items()],
-            "images": [],
-            "annotations": []
-        }
-        
-        # Создание директории для изображений
-        split_dir = OUTPUT_PATH / split
-        split_dir.mkdir(exist_ok=True)
-        
-        # Счетчики
-        image_id_offset = 0
-        annotation_id_offset = 0
-        
-        # Статистика
-        stats = {name: {"images": 0, "annotations": 0, "categories": {}} for name in DATASETS}
-        
+        previous_state = {} if full_rebuild else manifest.get_split(split)
+        with metrics.scope(split), metrics.stage("fingerprint"):
+            unchanged = split_unchanged(split, previous_state, link_mode, compact_json, workers,
+                                        pack_shard_size, dedup, probe)
+        if unchanged:
+            logger.info(f"  Разбиение {split} не изменилось с прошлого запуска — пропуск")
+            metrics.mark_skipped(split)
+            continue
+        pending.append((split, previous_state))
+    
+    # Объединение измененных разбиений; состояние в манифест записывает только этот процесс.
+    # Разбиения независимы, а источники внутри разбиения идут в фиксированном порядке, поэтому
+    # результат побайтно совпадает с последовательным объединением
+    options = {"link_mode": link_mode, "workers": workers, "compact_json": compact_json,
+               "pack_shard_size": pack_shard_size, "dedup": dedup, "probe": probe}
+    tasks = [(split, previous_state, options) for split, previous_state in pending]
+    split_workers = min(len(tasks), split_workers or os.cpu_count() or 1)
+    executor = ProcessPoolExecutor(max_workers=split_workers) if split_workers > 1 else None
+    try:
+        results = executor.map(_merge_split_task, tasks) if executor else map(_merge_split_task, tasks)
+        for split, split_state, materialize_stats, split_metrics, probe_report in results:
+            metrics.merge(split_metrics)
+            if probe_report is not None:
+                probe_reports[split] = probe_report
+            total_materialize_stats.merge(materialize_stats)
+            manifest.set_split(split, split_state)
+            manifest.save()
+            changed_splits.append(split)
+            logger.info(f"  Метрики разбиения {split} — {metrics.summary(split)}")
+    finally:
+        if executor:
+            executor.shutdown()
+    
+    # Проблемы изображений, найденные по заголовкам (отчет дополняется измененными разбиениями)
+    if probe_reports:
+        probe_report_file = OUTPUT_PATH / PROBE_REPORT_FILENAME
+        all_probe_reports = load_coco_json(probe_report_file) if probe_report_file.exists() else {}
+        all_probe_reports.update(probe_reports)
+        with open(probe_report_file, 'w', encoding='utf-8') as f:
+            json.dump(all_probe_reports, f, indent=2, ensure_ascii=False)
+    
+    # Поиск (и удаление) почти одинаковых изображений по всем разбиениям
+    if dedup:
+        with metrics.stage("dedup"):
+            report = find_duplicates(OUTPUT_PATH, splits, max_distance=dedup_distance, workers=workers)
+        logger.info(f"\nДубликаты — {summarize(report)}")
+        metrics.count("duplicates", report["duplicates"])
+        metrics.count("cross_split_duplicate_clusters", report["cross_split_clusters"])
+        if dedup == "drop":
+            with metrics.stage("dedup"):
+                report["dropped"] = drop_duplicates(report, OUTPUT_PATH, compact_json)
+            record_dropped(manifest, report["dropped"], OUTPUT_PATH)
+            for split, file_names in report["dropped"].items():
+                if split not in changed_splits:
+                    changed_splits.append(split)
+                logger.info(f"  Удалено дубликатов из {split}: {len(file_names)}")
+        save_report(report, OUTPUT_PATH / REPORT_FILENAME)
+    
+    # Проверка итоговых аннотаций
+    if validate:
+        validation = {}
+        for split in splits:
+            ann_file = OUTPUT_PATH / split / "_annotations.coco.json"
+            if not ann_file.exists():
+                continue
+            with metrics.scope(split), metrics.stage("validate"):
+                validation[split] = validate_file(ann_file, overlap_iou=overlap_iou)
+            with metrics.scope(split):
+                metrics.count("validation_issues", total_issues(validation[split]))
+            logger.info(f"  Проверка {split} — {summarize_validation(validation[split])}")
+        with open(OUTPUT_PATH / VALIDATION_REPORT_FILENAME, 'w', encoding='utf-8') as f:
+            json.dump(validation, f, indent=2, ensure_ascii=False)
+    
+    # Упаковка измененных разбиений в шарды (после удаления дубликатов)
+    if pack_shard_size:
+        for split in changed_splits:
+            with metrics.scope(split):
+                _pack_split(split, pack_shard_size, metrics)
+    
+    logger.info(f"\nМатериализация изображений (всего) — {total_materialize_stats.summary()}")
+    logger.info(f"Метрики объединения — {metrics.summary()}")
+    return total_materialize_stats
+
+def _pack_split(split: str, pack_shard_size: int, metrics: MergeMetrics) -> None:
+    """Упаковка объединенного разбиения в шарды (packed_dataset)."""
+    pack_dir = OUTPUT_PATH / PACKED_DIRNAME / split
+    with metrics.stage("pack"):
+        pack = pack_coco(OUTPUT_PATH / split / "_annotations.coco.json", OUTPUT_PATH / split, pack_dir,
+                         pack_shard_size)
+    logger.info(f"  Упакован датасет: {pack_dir} ({len(pack.index)} изображений, "
+                f"{pack.num_shards} шардов, {pack.bytes_written / 1e6:.1f} MB)")
+
+def _merge_split_task(task: Tuple[str, Dict, Dict]) -> Tuple[str, Dict, MaterializeStats, MergeMetrics,
+                                                             Optional[Dict]]:
+    """
+    Объединение разбиения (в том числе в отдельном процессе): метрики собираются локально
+    и возвращаются вместе с состоянием разбиения для манифеста и отчетом проверки изображений.
+    """
+    split, previous_state, options = task
+    logger.info(f"\nОбъединение разбиения: {split}")
+    metrics = MergeMetrics()
+    with metrics.scope(split):
+        split_state, materialize_stats, probe_report = _merge_split(split, previous_state, metrics=metrics,
+                                                                    **options)
+    return split, split_state, materialize_stats, metrics, probe_report
+
+def _remove_stale_images(split_dir: Path, dataset_name: str, file_names: Iterable[str]) -> None:
+    """Удаление материализованных изображений источника (имена файлов источника)."""
+    for old_filename in file_names:
+        stale_image = split_dir / f"{dataset_name}_{old_filename}"
+        if stale_image.is_symlink() or stale_image.exists():
+            stale_image.unlink()
+
+def _merge_split(split: str, previous_state: Dict, link_mode: str, workers: Optional[int],
+                 compact_json: bool, pack_shard_size: Optional[int], dedup: Optional[str],
+                 probe: bool, metrics: MergeMetrics) -> Tuple[Dict, MaterializeStats, Optional[Dict]]:
+    """
+    Объединение одного разбиения (см. merge_datasets); возвращает состояние разбиения для
+    манифеста, статистику материализации и отчет проверки изображений (None без probe).
+    """
+    reuse_images = bool(previous_state) and previous_state.get("link_mode") == link_mode
+    split_state = {
+        "config": config_hash(UNIFIED_CATEGORIES, CATEGORY_MAPPINGS),
+        "link_mode": link_mode,
+        "compact_json": compact_json,
+        "pack_shard_size": pack_shard_size,
+        "dedup": dedup,
+        "probe": probe,
+        "sources": {},
+        "id_ranges": {}
+    }
+    
+    # Заголовок объединенного датасета; images и annotations пишутся потоково
+    merged_header = {
+        "info": {
+            "year": "2025",
+            "version": "1.0",
+            "description": "Unified Emirates ID fields dataset combining detection and segmentation annotations",
+            "contributor": "Yaroslav Kazakov",
+            "url": "",
+            "date_created": "2025-07-16"
+        },
+        "licenses": [{
+            "id": 1,
+            "url": "https://creativecommons.org/licenses/by/4.0/",
+            "name": "CC BY 4.0"
+        }],
+        "categories": [{"id": cat_id, **cat_info} for cat_id, cat_info in UNIFIED_CATEGORIES.items()]
+    }
+    
+    # Создание директории для изображений
+    split_dir = OUTPUT_PATH / split
+    split_dir.mkdir(exist_ok=True)
+    output_file = split_dir / "_annotations.coco.json"
+    
+    # Выдача новых ID; ранее выданные ID сохраняются, если разбиение уже объединялось
+    id_map_file = split_dir / ID_MAP_FILENAME
+    remapper = IdRemapper(IdRemapper.load(id_map_file) if previous_state else None)
+    
+    # Статистика
+    stats = {name: {"images": 0, "annotations": 0, "categories": {}} for name in DATASETS}
+    
+    # Материализация изображений в фоне по мере разбора источников
+    reused_images = 0
+    probe_report = {"images": 0, "bytes": 0, "issues": []} if probe else None
+    
+    with CocoStreamWriter(output_file, merged_header, compact=compact_json) as writer, \
+            Materializer(link_mode, workers) as materializer:
         # Обработка каждого датасета
         for dataset_name, dataset_path in DATASETS.items():
             logger.info(f"  Обработка датасета: {dataset_name}")
             
             # Путь к аннотациям
             ann_file = dataset_path / split / "_annotations.coco.json"
+            previous_source = previous_state.get("sources", {}).get(dataset_name, {})
+            previous_images = previous_source.get("images", {})
             if not ann_file.exists():
                 logger.warning(f"    Файл аннотаций не найден: {ann_file}")
+                # Отсутствие разбиения в источнике фиксируется в манифесте (см. split_unchanged),
+                # изображения источника из прошлого запуска удаляются
+                split_state["sources"][dataset_name] = {"missing": True, "annotations": None, "images": {}}
+                _remove_stale_images(split_dir, dataset_name, previous_images)
                 continue
             
-            # Загрузка аннотаций
-            data = load_coco_json(ann_file)
+            source_dir = dataset_path / split
+            source_state = {"annotations": None, "images": {}}
+            category_mapping = CATEGORY_MAPPINGS[dataset_name]
             
-            # Маппинг старых ID изображений на новые
-            image_id_map = {}
+            # Время этапов и счетчики датасета копятся локально и передаются в metrics в конце
+            timings = dict.fromkeys(("json_load", "fingerprint", "probe", "process", "serialize"), 0.0)
+            counters = dict.fromkeys(("annotations_dropped", "annotations_orphaned", "missing_images", "corrupt_images",
+                                      "dimension_mismatches", "images_reused", "images_queued"), 0)
             
-            # Обработка изображений
-            for img in data["images"]:
-                old_img_id = img["id"]
-                new_img_id = old_img_id + image_id_offset
-                image_id_map[old_img_id] = new_img_id
+            def process_images(images: List[ImageRecord]) -> None:
+                """Ремаппинг изображений источника и постановка их в очередь материализации."""
+                nonlocal reused_images
                 
-                # Создание нового имени файла с префиксом датасета
-                old_filename = img["file_name"]
-                new_filename = f"{dataset_name}_{old_filename}"
+                # Отпечатки исходных файлов (хэш пересчитывается только при смене mtime/размера)
+                fingerprint_start = time.perf_counter()
+                current = fingerprints(
+                    [("_annotations", ann_file, previous_source.get("annotations"))] +
+                    [(img.file_name, source_dir / img.file_name, previous_images.get(img.file_name))
+                     for img in images],
+                    workers=workers
+                )
+                timings["fingerprint"] += time.perf_counter() - fingerprint_start
+                source_state["annotations"] = current.pop("_annotations")
                 
-                # Копирование изображения
-                src_image = dataset_path / split / old_filename
-                dst_image = split_dir / new_filename
+                # Проверка заголовков найденных изображений (размеры, обрезанные и поврежденные файлы)
+                probe_results = {}
+                if probe:
+                    probe_start = time.perf_counter()
+                    present = [img.file_name for img in images if current.get(img.file_name) is not None]
+                    probe_results = dict(zip(present, probe_images([source_dir / name for name in present], workers)))
+                    probe_report["images"] += len(present)
+                    probe_report["bytes"] += sum(result.file_size for result in probe_results.values())
+                    timings["probe"] += time.perf_counter() - probe_start
                 
-                if src_image.exists():
-                    shutil.copy2(src_image, dst_image)
+                for img in images:
+                    # Создание нового имени файла с префиксом датасета
+                    old_filename = img.file_name
+                    new_filename = f"{dataset_name}_{old_filename}"
+                    
+                    # Копирование изображения
+                    src_image = source_dir / old_filename
+                    dst_image = split_dir / new_filename
                     
-                    # Обновление информации об изображении
-                    img["id"] = new_img_id
-                    img["file_name"] = new_filename
-                    merged_data["images"].append(img)
-                    stats[dataset_name]["images"] += 1
-                else:
-                    logger.warning(f"    Изображение не найдено: {src_image}")
+                    image_fp = current.get(old_filename)
+                    issue = image_issue(img, probe_results[old_filename]) if old_filename in probe_results else None
+                    if issue is not None:
+                        probe_report["issues"].append({"dataset": dataset_name, **issue})
+                        if issue["error"] != "dimension_mismatch":
+                            logger.warning(f"    Поврежденное изображение ({issue['error']}): {src_image}")
+                            counters["corrupt_images"] += 1
+                            continue
+                        logger.warning(f"    Размеры изображения {src_image} {issue['actual']} не совпадают "
+                                       f"с аннотацией {issue['coco']}")
+                        counters["dimension_mismatches"] += 1
+                    
+                    if image_fp is not None:
+                        source_state["images"][old_filename] = image_fp
+                        if reuse_images and dst_image.exists() and same_content(previous_images.get(old_filename), image_fp):
+                            reused_images += 1
+                            counters["images_reused"] += 1
+                        else:
+                            materializer.submit(src_image, dst_image)
+                            counters["images_queued"] += 1
+                        
+                        # Обновление информации об изображении
+                        img.id = remapper.image(dataset_name, img.id, old_filename)
+                        img.file_name = new_filename
+                        write_start = time.perf_counter()
+                        writer.write("images", img.to_json())
+                        timings["serialize"] += time.perf_counter() - write_start
+                        stats[dataset_name]["images"] += 1
+                    else:
+                        logger.warning(f"    Изображение не найдено: {src_image}")
+                        counters["missing_images"] += 1
             
-            # Обработка аннотаций
-            category_mapping = CATEGORY_MAPPINGS[dataset_name]
-            for ann in data["annotations"]:
+            def process_annotation(ann: Dict) -> None:
+                """Ремаппинг одной аннотации на унифицированные категории и новые ID."""
                 old_cat_id = ann["category_id"]
                 
                 # Пропускаем категории, которых нет в маппинге
                 if old_cat_id not in category_mapping:
-                    continue
+                    counters["annotations_dropped"] += 1
+                    return
                 
                 new_cat_id = category_mapping[old_cat_id]
                 
-                # Обновление аннотации
-                new_ann = ann.copy()
-                new_ann["id"] = ann["id"] + annotation_id_offset
-                new_ann["image_id"] = image_id_map.get(ann["image_id"], ann["image_id"])
-                new_ann["category_id"] = new_cat_id
+                # Аннотации изображений, не вошедших в результат (файл не найден), пропускаются
+                new_image_id = remapper.image_id(dataset_name, ann["image_id"])
+                if new_image_id is None:
+                    counters["annotations_orphaned"] += 1
+                    return
+                
+                # Обновление аннотации (элемент прочитан потоково и принадлежит только нам)
+                ann["id"] = remapper.annotation(dataset_name, ann["id"])
+                ann["image_id"] = new_image_id
+                ann["category_id"] = new_cat_id
                 
-                merged_data["annotations"].append(new_ann)
+                write_start = time.perf_counter()
+                writer.write("annotations", ann)
+                timings["serialize"] += time.perf_counter() - write_start
                 stats[dataset_name]["annotations"] += 1
                 
                 # Обновление статистики по категориям
                 cat_name = UNIFIED_CATEGORIES[new_cat_id]["name"]
                 stats[dataset_name]["categories"][cat_name] = stats[dataset_name]["categories"].get(cat_name, 0) + 1
             
-            # Обновление смещений
-            image_id_offset = max([img["id"] for img in merged_data["images"]], default=0) + 1
-            annotation_id_offset = max([ann["id"] for ann in merged_data["annotations"]], default=0) + 1
-        
-        # Сохранение объединенных аннотаций
-        output_file = split_dir / "_annotations.coco.json"
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(merged_data, f, indent=2, ensure_ascii=False)
-        
-        logger.info(f"  Сохранены объединенные аннотации: {output_file}")
-        logger.info(f"  Всего изображений: {len(merged_data['images'])}")
-        logger.info(f"  Всего аннотаций: {len(merged_data['annotations'])}")
+            # Потоковое чтение источника. Массив images в экспортах Roboflow идет перед
+            # annotations; аннотации, встреченные до изображений, откладываются до их обработки.
+            # Накапливаемые элементы хранятся компактными записями coco_records.
+            images: List[ImageRecord] = []
+            images_processed = False
+            pending_annotations: List[AnnotationRecord] = []
+            tick = time.perf_counter()
+            for key, item in iter_coco(ann_file):
+                item_start = time.perf_counter()
+                timings["json_load"] += item_start - tick
+                if key == "images":
+                    images.append(ImageRecord.from_json(item))
+                elif key == "annotations":
+                    if not images_processed and images:
+                        process_images(images)
+                        images, images_processed = [], True
+                    if images_processed:
+                        process_annotation(item)
+                    else:
+                        pending_annotations.append(AnnotationRecord.from_json(item))
+                tick = time.perf_counter()
+                timings["process"] += tick - item_start
+            process_start = time.perf_counter()
+            timings["json_load"] += process_start - tick
+            if not images_processed:
+                process_images(images)
+            for ann in pending_annotations:
+                process_annotation(ann.to_json())
+            timings["process"] += time.perf_counter() - process_start
+            
+            metrics.add_time("json_load", timings["json_load"], dataset_name)
+            metrics.add_time("fingerprint", timings["fingerprint"], dataset_name)
+            if probe:
+                metrics.add_time("probe", timings["probe"], dataset_name)
+            metrics.add_time("remap", timings["process"] - timings["fingerprint"] - timings["probe"] - timings["serialize"],
+                             dataset_name)
+            metrics.add_time("serialize", timings["serialize"], dataset_name)
+            metrics.count("images", stats[dataset_name]["images"], dataset_name)
+            metrics.count("annotations", stats[dataset_name]["annotations"], dataset_name)
+            for name, value in counters.items():
+                metrics.count(name, value, dataset_name)
+            
+            # Удаление изображений, исчезнувших из источника с прошлого запуска
+            _remove_stale_images(split_dir, dataset_name, set(previous_images) - set(source_state["images"]))
+            
+            # Диапазоны выходных ID источника
+            split_state["id_ranges"][dataset_name] = remapper.id_ranges(dataset_name)
+            split_state["sources"][dataset_name] = source_state
         
-        # Вывод статистики
-        logger.info("\n  Статистика по датасетам:")
-        for dataset_name, dataset_stats in stats.items():
-            logger.info(f"\n    {dataset_name}:")
-            logger.info(f"      Изображений: {dataset_stats['images']}")
-            logger.info(f"      Аннотаций: {dataset_stats['annotations']}")
-            logger.info(f"      Категории:")
-            for cat_name, count in sorted(dataset_stats['categories'].items()):
-                logger.info(f"        {cat_name}: {count}")
+        # Ожидание материализации изображений разбиения (время, не перекрытое разбором источников)
+        with metrics.stage("image_copy"):
+            materialize_stats = materializer.close()
+        metrics.count("files_materialized", materialize_stats.files)
+        metrics.count("bytes_copied", materialize_stats.bytes)
+        metrics.count("materialize_fallbacks", materialize_stats.fallbacks)
+        metrics.count("materialize_errors", len(materialize_stats.errors))
+        logger.info(f"  Материализация изображений — {materialize_stats.summary()}")
+        # Записи изображений уже в потоке writer: при ошибках разбиение не фиксируется, writer
+        # отбрасывает результат, прежние аннотации и манифест остаются нетронутыми
+        if materialize_stats.errors:
+            raise RuntimeError(f"Не удалось материализовать {len(materialize_stats.errors)} изображений "
+                               f"разбиения {split}, первое: {materialize_stats.errors[0][0]}")
+        logger.info(f"  Не изменились с прошлого запуска (пропущены): {reused_images} изображений")
+        finalize_start = time.perf_counter()
+    # Сборка итогового JSON из потоковых секций при закрытии writer
+    metrics.add_time("serialize", time.perf_counter() - finalize_start)
+    
+    logger.info(f"  Сохранены объединенные аннотации: {output_file}")
+    
+    # Карты старый -> новый ID для перевода предсказаний и следующего инкрементального запуска
+    remapper.save(id_map_file)
+    logger.info(f"  Сохранены карты ID: {id_map_file}")
+    
+    # Фиксация состояния разбиения в манифесте
+    out_stat = output_file.stat()
+    metrics.count("output_bytes", out_stat.st_size)
+    split_state["output"] = {"mtime_ns": out_stat.st_mtime_ns, "size": out_stat.st_size}
+    logger.info(f"  Всего изображений: {writer.counts['images']}")
+    logger.info(f"  Всего аннотаций: {writer.counts['annotations']}")
+    
+    # Вывод статистики
+    logger.info("\n  Статистика по датасетам:")
+    for dataset_name, dataset_stats in stats.items():
+        logger.info(f"\n    {dataset_name}:")
+        logger.info(f"      Изображений: {dataset_stats['images']}")
+        logger.info(f"      Аннотаций: {dataset_stats['annotations']}")
+        logger.info(f"      Категории:")
+        for cat_name, count in sorted(dataset_stats['categories'].items()):
+            logger.info(f"        {cat_name}: {count}")
+    
+    return split_state, materialize_stats, probe_report
 
 def create_dataset_info():
     """Создание файла с информацией о датасете."""
@@ -227,13 +575,71 @@ def create_dataset_info():
     
     logger.info(f"\nСоздан файл с информацией о датасете: {info_file}")
 
-def main():
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Разбор аргументов командной строки."""
+    parser = argparse.ArgumentParser(description="Объединение COCO датасетов Emirates ID")
+    parser.add_argument("--link-mode", choices=LINK_MODES, default="copy",
+                        help="Способ материализации изображений в выходном датасете")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Размер пула потоков для материализации изображений")
+    parser.add_argument("--split-workers", type=int, default=None,
+                        help="Число процессов для параллельного объединения разбиений (1 — последовательно)")
+    parser.add_argument("--compact-json", action="store_true",
+                        help="Записывать объединенные аннотации без отступов")
+    parser.add_argument("--pack", action="store_true",
+                        help="Дополнительно записать разбиения в упакованном шардированном формате")
+    parser.add_argument("--shard-size-mb", type=int, default=256,
+                        help="Размер шарда упакованного формата, MB")
+    parser.add_argument("--dedup", choices=("report", "drop"), default=None,
+                        help="Поиск почти одинаковых изображений: только отчет или удаление дубликатов")
+    parser.add_argument("--dedup-distance", type=int, default=DEFAULT_MAX_DISTANCE,
+                        help="Максимальное расстояние Хэмминга между перцептивными хэшами дубликатов")
+    parser.add_argument("--probe", action="store_true",
+                        help="Проверить изображения по заголовкам файлов (размеры, обрезанные и поврежденные файлы)")
+    parser.add_argument("--validate", action="store_true",
+                        help="Проверить итоговые аннотации и сохранить список проблем по изображениям")
+    parser.add_argument("--overlap-iou", type=float, default=DEFAULT_OVERLAP_IOU,
+                        help="Порог IoU, при котором боксы одной категории считаются перекрывающимися")
+    parser.add_argument("--metrics", type=Path, default=None,
+                        help="Сохранить метрики этапов и счетчики объединения в JSON файл")
+    parser.add_argument("--profile", type=Path, default=None,
+                        help="Сохранить профиль cProfile объединения в файл (pstats); "
+                             "разбиения объединяются последовательно")
+    parser.add_argument("--full", action="store_true",
+                        help="Полная пересборка без учета манифеста предыдущего запуска")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
     """Основная функция."""
+    args = parse_args(argv)
     logger.info("Начало объединения датасетов Emirates ID")
     
     try:
         # Объединение датасетов
-        merge_datasets()
+        metrics = MergeMetrics()
+        profiler = cProfile.Profile() if args.profile else None
+        split_workers = args.split_workers
+        if profiler:
+            # cProfile видит только текущий процесс: разбиения объединяются в нем последовательно
+            if split_workers not in (None, 1):
+                logger.warning("--profile: разбиения объединяются последовательно (--split-workers 1)")
+            split_workers = 1
+            profiler.enable()
+        try:
+            merge_datasets(link_mode=args.link_mode, workers=args.workers, full_rebuild=args.full,
+                           compact_json=args.compact_json,
+                           pack_shard_size=args.shard_size_mb * 1024 * 1024 if args.pack else None,
+                           metrics=metrics, dedup=args.dedup, dedup_distance=args.dedup_distance,
+                           validate=args.validate, overlap_iou=args.overlap_iou,
+                           split_workers=split_workers, probe=args.probe)
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(str(args.profile))
+                logger.info(f"Профиль сохранен в: {args.profile}")
+        if args.metrics:
+            metrics.save(args.metrics)
+            logger.info(f"Метрики сохранены в: {args.metrics}")
         
         # Создание файла с информацией
         create_dataset_info()
@@ -0,0 +1,118 @@
+"""
+Манифест инкрементального объединения датасетов: отпечатки исходных файлов и диапазоны ID.
+"""
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+MANIFEST_FILENAME = "merge_manifest.json"
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def sha256_file(path: Path) -> str:
+    """SHA-256 содержимого файла, читаемого блоками."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def config_hash(*parts) -> str:
+    """Хэш конфигурации объединения (схема категорий, маппинги), влияющей на результат."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def file_fingerprint(path: Path, previous: Optional[Dict] = None) -> Dict:
+    """
+    Отпечаток файла: mtime, размер и SHA-256.
+
+    Если mtime и размер совпадают с предыдущим отпечатком, хэш не пересчитывается.
+    """
+    st = path.stat()
+    if previous and previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns:
+        return previous
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": sha256_file(path)}
+
+
+def fingerprints(items: Iterable[Tuple[str, Path, Optional[Dict]]],
+                 workers: Optional[int] = None) -> Dict[str, Optional[Dict]]:
+    """
+    Параллельный расчет отпечатков для набора (ключ, путь, предыдущий отпечаток).
+
+    Для отсутствующих файлов возвращается None.
+    """
+    def run(item: Tuple[str, Path, Optional[Dict]]) -> Tuple[str, Optional[Dict]]:
+        key, path, previous = item
+        try:
+            return key, file_fingerprint(path, previous)
+        except FileNotFoundError:
+            return key, None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(run, items))
+
+
+def same_content(previous: Optional[Dict], current: Optional[Dict]) -> bool:
+    """Совпадает ли содержимое файла с зафиксированным в манифесте."""
+    return previous is not None and current is not None and previous.get("sha256") == current.get("sha256")
+
+
+def same_stat(path: Path, previous: Optional[Dict]) -> bool:
+    """Быстрая проверка выходного файла по mtime и размеру без чтения содержимого."""
+    if previous is None or not path.exists():
+        return False
+    st = path.stat()
+    return previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns
+
+
+class MergeManifest:
+    """
+    Персистентный манифест объединения.
+
+    Структура по каждому разбиению::
+
+        {"config": ..., "link_mode": ..., "output": {отпечаток _annotations.coco.json},
+         "sources": {датасет: {"annotations": {отпечаток},
+                               "images": {исходное имя файла: {отпечаток}}}},
+         "id_ranges": {датасет: {"image_id": [min, max], "annotation_id": [min, max]}}}
+    """
+
+    def __init__(self, path: Path, data: Optional[Dict] = None):
+        self.path = path
+        self.data = data or {"version": MANIFEST_VERSION, "splits": {}}
+
+    @classmethod
+    def load(cls, path: Path) -> "MergeManifest":
+        """Загрузка манифеста; при отсутствии или несовместимой версии — пустой манифест."""
+        if path.exists():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("version") == MANIFEST_VERSION:
+                    return cls(path, data)
+                logger.warning(f"Версия манифеста {path} не поддерживается, выполняется полная пересборка")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Не удалось прочитать манифест {path}: {e}")
+        return cls(path)
+
+    def get_split(self, split: str) -> Dict:
+        return self.data["splits"].get(split, {})
+
+    def set_split(self, split: str, state: Dict) -> None:
+        self.data["splits"][split] = state
+
+    def save(self) -> None:
+        """Атомарная запись манифеста."""
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        tmp_path.replace(self.path)
@@ -0,0 +1,113 @@
+"""
+Инструментирование объединения датасетов: таймеры этапов и счетчики по разбиениям и датасетам.
+
+Крупные этапы (материализация, упаковка) замеряются через stage(). В горячем цикле по
+аннотациям время копится в локальных переменных и добавляется через add_time() один раз
+на датасет, чтобы замеры не замедляли само объединение.
+"""
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+METRICS_VERSION = 1
+
+# Этапы объединения
+STAGES = ("fingerprint", "json_load", "probe", "remap", "serialize", "image_copy", "dedup", "validate", "pack")
+
+
+def _new_scope() -> Dict:
+    return {"stages": {}, "counters": {}}
+
+
+def _add(target: Dict, key: str, value) -> None:
+    target[key] = target.get(key, 0) + value
+
+
+def _merge_scope(target: Dict, source: Dict) -> None:
+    for section in ("stages", "counters"):
+        for key, value in source[section].items():
+            _add(target[section], key, value)
+
+
+class MergeMetrics:
+    """
+    Метрики объединения: итог, разбиения и датасеты внутри разбиений.
+
+    Текущее разбиение задается через scope(); время этапов и счетчики записываются в итог,
+    текущее разбиение и, если указан dataset, в датасет этого разбиения.
+    """
+
+    def __init__(self):
+        self.totals = _new_scope()
+        self.splits: Dict[str, Dict] = {}
+        self._split: Optional[str] = None
+
+    def _split_scope(self, split: str) -> Dict:
+        return self.splits.setdefault(split, {"seconds": 0.0, **_new_scope(), "datasets": {}})
+
+    def _targets(self, dataset: Optional[str]):
+        yield self.totals
+        if self._split is not None:
+            split_scope = self._split_scope(self._split)
+            yield split_scope
+            if dataset is not None:
+                yield split_scope["datasets"].setdefault(dataset, _new_scope())
+
+    @contextmanager
+    def scope(self, split: str) -> Iterator[None]:
+        """Область записи метрик разбиения; общее время разбиения накапливается в seconds."""
+        previous, self._split = self._split, split
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._split_scope(split)["seconds"] += time.perf_counter() - start
+            self._split = previous
+
+    @contextmanager
+    def stage(self, name: str, dataset: Optional[str] = None) -> Iterator[None]:
+        """Таймер этапа."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, dataset)
+
+    def add_time(self, name: str, seconds: float, dataset: Optional[str] = None) -> None:
+        for target in self._targets(dataset):
+            _add(target["stages"], name, seconds)
+
+    def count(self, name: str, value: int = 1, dataset: Optional[str] = None) -> None:
+        for target in self._targets(dataset):
+            _add(target["counters"], name, value)
+
+    def mark_skipped(self, split: str) -> None:
+        self._split_scope(split)["skipped"] = True
+
+    def merge(self, other: "MergeMetrics") -> None:
+        """Накопление метрик, собранных отдельно (например, в процессе, объединявшем разбиение)."""
+        _merge_scope(self.totals, other.totals)
+        for split, source in other.splits.items():
+            target = self._split_scope(split)
+            target["seconds"] += source["seconds"]
+            _merge_scope(target, source)
+            for dataset, dataset_scope in source["datasets"].items():
+                _merge_scope(target["datasets"].setdefault(dataset, _new_scope()), dataset_scope)
+            if source.get("skipped"):
+                target["skipped"] = True
+
+    def to_dict(self) -> Dict:
+        return {"version": METRICS_VERSION, "totals": self.totals, "splits": self.splits}
+
+    def save(self, path: Path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+
+    def summary(self, split: Optional[str] = None) -> str:
+        """Однострочная сводка этапов и счетчиков разбиения или итога."""
+        scope = self._split_scope(split) if split else self.totals
+        stages = ", ".join(f"{name} {seconds:.2f} с" for name, seconds in scope["stages"].items())
+        counters = ", ".join(f"{name}: {value}" for name, value in scope["counters"].items())
+        return f"этапы: {stages or '-'}; счетчики: {counters or '-'}"
@@ -0,0 +1,236 @@
+"""
+Упакованный шардированный формат датасета для чтения при обучении.
+
+Каталог пакета разбиения:
+    shard-00000.pack, shard-00001.pack, ... — подряд записанные байты изображений
+        и компактный JSON записи {"image": ..., "annotations": [...]} для каждого изображения;
+    index.npy — смещения записей (INDEX_DTYPE) в порядке записи;
+    meta.json — версия формата, категории, список шардов.
+
+Шарды открываются через mmap, поэтому чтение образца не требует открытия файлов, а
+произвольный доступ по ID изображения — один бинарный поиск по индексу.
+"""
+import json
+import mmap
+import shutil
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional
+import logging
+
+import numpy as np
+
+from coco_records import AnnotationRecord, ImageRecord
+from coco_stream import iter_coco
+
+logger = logging.getLogger(__name__)
+
+PACK_VERSION = 1
+
+# Размер шарда по умолчанию; запись изображения не делится между шардами
+DEFAULT_SHARD_SIZE = 256 * 1024 * 1024
+
+INDEX_DTYPE = np.dtype([
+    ("id", np.int64),
+    ("shard", np.int32),
+    ("offset", np.int64),
+    ("image_length", np.int64),
+    ("record_length", np.int32),
+])
+
+
+def shard_name(shard: int) -> str:
+    return f"shard-{shard:05d}.pack"
+
+
+class PackedSample(NamedTuple):
+    """Образец из пакета: запись изображения, его аннотации и байты файла (без копирования)."""
+    image: Dict
+    annotations: List[Dict]
+    data: memoryview
+
+
+class PackWriter:
+    """
+    Запись пакета во временный каталог; на close() он атомарно заменяет предыдущий пакет.
+
+    Используется как контекстный менеджер; при исключении временный каталог удаляется.
+    """
+
+    def __init__(self, directory: Path, categories: List[Dict], shard_size: int = DEFAULT_SHARD_SIZE):
+        self.directory = directory
+        self.categories = categories
+        self.shard_size = shard_size
+        self.tmp_dir = directory.with_name(directory.name + ".tmp")
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self.tmp_dir.mkdir(parents=True)
+        self.index: List[tuple] = []
+        self.bytes_written = 0
+        self._shard = -1
+        self._file = None
+        self._offset = 0
+
+    @property
+    def num_shards(self) -> int:
+        return self._shard + 1
+
+    def _next_shard(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._shard += 1
+        self._file = open(self.tmp_dir / shard_name(self._shard), "wb")
+        self._offset = 0
+
+    def add(self, image: Dict, annotations: List[Dict], data: bytes) -> None:
+        """Добавление изображения: байты файла и компактный JSON записи."""
+        record = json.dumps({"image": image, "annotations": annotations},
+                            ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        size = len(data) + len(record)
+        if self._file is None or (self._offset and self._offset + size > self.shard_size):
+            self._next_shard()
+        self._file.write(data)
+        self._file.write(record)
+        self.index.append((image["id"], self._shard, self._offset, len(data), len(record)))
+        self._offset += size
+        self.bytes_written += size
+
+    def add_file(self, image: Dict, annotations: List[Dict], path: Path) -> None:
+        with open(path, "rb") as f:
+            self.add(image, annotations, f.read())
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        np.save(self.tmp_dir / "index.npy", np.array(self.index, dtype=INDEX_DTYPE), allow_pickle=False)
+        meta = {
+            "version": PACK_VERSION,
+            "categories": self.categories,
+            "shards": [shard_name(shard) for shard in range(self.num_shards)],
+            "num_images": len(self.index),
+        }
+        with open(self.tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.tmp_dir.rename(self.directory)
+
+    def abort(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __enter__(self) -> "PackWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class PackedDataset:
+    """
+    Чтение пакета: шарды отображаются в память при первом обращении.
+
+    ds[image_id] — произвольный доступ по ID, iter(ds) — последовательное чтение в порядке записи.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        with open(directory / "meta.json", "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != PACK_VERSION:
+            raise ValueError(f"Неподдерживаемая версия пакета {directory}: {self.meta.get('version')}")
+        self.categories = self.meta["categories"]
+        self.index = np.load(directory / "index.npy", allow_pickle=False)
+        self._order = np.argsort(self.index["id"], kind="stable")
+        self._sorted_ids = self.index["id"][self._order]
+        self._shards: Dict[int, mmap.mmap] = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self.index["id"]
+
+    def _shard(self, shard: int) -> mmap.mmap:
+        mapped = self._shards.get(shard)
+        if mapped is None:
+            with open(self.directory / self.meta["shards"][shard], "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._shards[shard] = mapped
+        return mapped
+
+    def _row(self, image_id: int) -> Optional[int]:
+        pos = int(np.searchsorted(self._sorted_ids, image_id))
+        if pos < len(self._sorted_ids) and self._sorted_ids[pos] == image_id:
+            return int(self._order[pos])
+        return None
+
+    def sample(self, row: int) -> PackedSample:
+        """Образец по номеру записи в индексе."""
+        entry = self.index[row]
+        view = memoryview(self._shard(int(entry["shard"])))
+        offset, image_length = int(entry["offset"]), int(entry["image_length"])
+        record_end = offset + image_length + int(entry["record_length"])
+        record = json.loads(bytes(view[offset + image_length:record_end]))
+        return PackedSample(record["image"], record["annotations"], view[offset:offset + image_length])
+
+    def __contains__(self, image_id: int) -> bool:
+        return self._row(image_id) is not None
+
+    def __getitem__(self, image_id: int) -> PackedSample:
+        row = self._row(image_id)
+        if row is None:
+            raise KeyError(image_id)
+        return self.sample(row)
+
+    def __iter__(self) -> Iterator[PackedSample]:
+        for row in range(len(self.index)):
+            yield self.sample(row)
+
+    def close(self) -> None:
+        for mapped in self._shards.values():
+            try:
+                mapped.close()
+            except BufferError:
+                # На шард еще ссылаются memoryview выданных образцов; закроется сборщиком мусора
+                pass
+        self._shards.clear()
+
+    def __enter__(self) -> "PackedDataset":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def pack_coco(ann_file: Path, image_dir: Path, directory: Path,
+              shard_size: int = DEFAULT_SHARD_SIZE) -> PackWriter:
+    """
+    Упаковка COCO разбиения: изображения в порядке файла аннотаций, каждое со своими аннотациями.
+
+    Аннотации группируются по изображениям в памяти (компактными записями coco_records);
+    изображения без файла пропускаются.
+    """
+    images: List[ImageRecord] = []
+    annotations_by_image: Dict[int, List[AnnotationRecord]] = {}
+    categories: List[Dict] = []
+    for key, item in iter_coco(ann_file):
+        if key == "images":
+            images.append(ImageRecord.from_json(item))
+        elif key == "annotations":
+            ann = AnnotationRecord.from_json(item)
+            annotations_by_image.setdefault(ann.image_id, []).append(ann)
+        elif key == "categories":
+            categories = item
+
+    with PackWriter(directory, categories, shard_size) as writer:
+        for image in images:
+            image_path = image_dir / image.file_name
+            try:
+                writer.add_file(image.to_json(), [ann.to_json() for ann in annotations_by_image.get(image.id, [])],
+                                image_path)
+            except FileNotFoundError:
+                logger.warning(f"Изображение не найдено, пропущено при упаковке: {image_path}")
+    return writer
@@ -0,0 +1,139 @@
+"""
+Minimal PDF writer that embeds JPEG pages as-is (DCTDecode), without decoding or re-encoding.
+
+PNG and other inputs fall back to a lossless FlateDecode image via PIL. Output has no
+timestamps, so the same pages always give the same bytes.
+"""
+import io
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+# SOFn markers that carry frame dimensions (C4 = DHT, C8 = JPG, CC = DAC are not frames)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers without a length field
+STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+_COLOR_SPACES = {1: b'/DeviceGray', 3: b'/DeviceRGB', 4: b'/DeviceCMYK'}
+
+
+@dataclass
+class PdfImage:
+    """An image ready to be placed on a PDF page."""
+    width: int
+    height: int
+    components: int
+    bits_per_component: int
+    filter: bytes
+    data: bytes
+    decode: Optional[bytes] = None
+
+
+def parse_jpeg(data: bytes) -> Optional[PdfImage]:
+    """
+    Read frame size and colour components from JPEG markers (no pixel decoding).
+
+    Returns None when the stream cannot be passed through to a PDF as-is.
+    """
+    if len(data) < 4 or data[0:2] != b'\xff\xd8':
+        return None
+    pos = 2
+    adobe_transform = None
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        pos += 2
+        if marker in STANDALONE_MARKERS:
+            continue
+        if marker == 0xD9 or pos + 2 > len(data):
+            return None
+        (length,) = struct.unpack('>H', data[pos:pos + 2])
+        segment = data[pos + 2:pos + length]
+        if marker == 0xEE and segment[:5] == b'Adobe' and len(segment) >= 12:
+            adobe_transform = segment[11]
+        if marker in SOF_MARKERS:
+            if len(segment) < 6:
+                return None
+            precision, height, width, components = struct.unpack('>BHHB', segment[:6])
+            if precision != 8 or height == 0 or width == 0 or components not in _COLOR_SPACES:
+                return None
+            # Adobe CMYK JPEGs store inverted values
+            decode = b'[1 0 1 0 1 0 1 0]' if components == 4 and adobe_transform is not None else None
+            return PdfImage(width, height, components, 8, b'/DCTDecode', data, decode)
+        pos += length
+    return None
+
+
+def encode_fallback(data: bytes) -> PdfImage:
+    """Lossless FlateDecode image for PNG and other non-passthrough inputs (decoded with PIL)."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        components = 1 if img.mode == 'L' else 3
+        return PdfImage(img.width, img.height, components, 8, b'/FlateDecode',
+                        zlib.compress(img.tobytes(), 6))
+
+
+def prepare_page(data: bytes) -> PdfImage:
+    """Embed JPEG bytes directly; re-encode only what cannot be passed through."""
+    return parse_jpeg(data) or encode_fallback(data)
+
+
+def build_pdf(pages: Sequence[PdfImage]) -> bytes:
+    """Build a PDF with one full-page image per page (page size = image size at 72 dpi)."""
+    objects: List[bytes] = []
+
+    def add(obj: bytes) -> int:
+        objects.append(obj)
+        return len(objects)
+
+    catalog_id = add(b'')
+    pages_id = add(b'')
+    kids = []
+    for page in pages:
+        image_dict = (b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s '
+                      b'/BitsPerComponent %d /Filter %s /Length %d'
+                      % (page.width, page.height, _COLOR_SPACES[page.components],
+                         page.bits_per_component, page.filter, len(page.data)))
+        if page.decode:
+            image_dict += b' /Decode ' + page.decode
+        image_id = add(image_dict + b' >>\nstream\n' + page.data + b'\nendstream')
+        content = b'q %d 0 0 %d 0 0 cm /Im0 Do Q' % (page.width, page.height)
+        content_id = add(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content))
+        kids.append(add(b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+                        b'/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>'
+                        % (pages_id, page.width, page.height, image_id, content_id)))
+    objects[catalog_id - 1] = b'<< /Type /Catalog /Pages %d 0 R >>' % pages_id
+    objects[pages_id - 1] = (b'<< /Type /Pages /Count %d /Kids [%s] >>'
+                             % (len(kids), b' '.join(b'%d 0 R' % kid for kid in kids)))
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for obj_id, obj in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n' % obj_id + obj + b'\nendobj\n')
+    xref_offset = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b'%010d 00000 n \n' % offset)
+    out.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+              % (len(objects) + 1, catalog_id, xref_offset))
+    return out.getvalue()
+
+
+def images_to_pdf(images: Sequence[bytes]) -> bytes:
+    """Bytes in, bytes out: image files (e.g. front and back of an ID) to a multi-page PDF."""
+    return build_pdf([prepare_page(data) for data in images])
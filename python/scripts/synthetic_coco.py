@@ -0,0 +1,171 @@
+"""
+Генератор синтетических COCO датасетов, повторяющих структуру исходных датасетов Emirates ID.
+
+Создает три источника (back detection, front detection, front segmentation) с их исходными
+категориями, включая группирующую категорию 0, которую объединение отбрасывает. Масштаб
+задается общим числом аннотаций (от тысяч до миллионов); аннотации пишутся потоково.
+"""
+import argparse
+import random
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from coco_stream import CocoStreamWriter
+
+# Каталоги источников (как в merge_coco_datasets.DATASETS) и сторона документа в именах файлов
+SOURCE_DATASETS = {
+    "eid_back_detection": ("EID back fields object detection", "back"),
+    "eid_front_detection": ("EID front fields object detection", "front"),
+    "eid_front_segmentation": ("EID front fields segmantation", "front"),
+}
+
+# Исходные категории источников (см. CATEGORY_MAPPINGS в merge_coco_datasets)
+SOURCE_CATEGORIES = {
+    "eid_back_detection": ["MRZ-Employer-Issuing_Place-DOB", "DOB", "Employer", "Expiry-Date",
+                           "Issuing-Place", "MRZ", "Sex"],
+    "eid_front_detection": ["ID-Number-Name-D", "DOB", "ID_Number", "Issue_Expiry_date", "Name",
+                            "Nationality", "Sex"],
+    "eid_front_segmentation": ["id", "cin", "date of birth", "exp date", "fullname", "iss date",
+                               "nationality", "sex"],
+}
+
+SPLIT_RATIOS = {"train": 0.7, "valid": 0.2, "test": 0.1}
+
+# Доля аннотаций группирующей категории 0, отбрасываемой при объединении
+GROUP_CATEGORY_RATE = 0.05
+
+
+@dataclass
+class SyntheticStats:
+    """Статистика сгенерированного датасета."""
+    images: int = 0
+    annotations: int = 0
+    image_bytes: int = 0
+    seconds: float = 0.0
+
+    def summary(self) -> str:
+        return (f"{self.images} изображений, {self.annotations} аннотаций, "
+                f"{self.image_bytes / 1e6:.1f} MB изображений за {self.seconds:.1f} с")
+
+
+def _card_image(side: str, image_size: Tuple[int, int], rng: random.Random) -> bytes:
+    """JPEG-заглушка карты: фон и несколько полос "текста"."""
+    width, height = image_size
+    img = np.full((height, width, 3), 235, dtype=np.uint8)
+    color = (180, 200, 160) if side == "front" else (200, 180, 160)
+    cv2.rectangle(img, (4, 4), (width - 5, height - 5), color, -1)
+    for _ in range(8):
+        x, y = rng.randrange(0, width // 2), rng.randrange(0, height - 10)
+        cv2.rectangle(img, (x, y), (x + rng.randrange(20, width // 2), y + 6), (60, 60, 60), -1)
+    ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ok:
+        raise RuntimeError("Не удалось закодировать изображение")
+    return encoded.tobytes()
+
+
+def _annotation(ann_id: int, image_id: int, category_id: int, image_size: Tuple[int, int],
+                rng: random.Random, segmentation: bool) -> Dict:
+    width, height = image_size
+    w = round(rng.uniform(0.05, 0.5) * width, 1)
+    h = round(rng.uniform(0.03, 0.15) * height, 1)
+    x = round(rng.uniform(0, width - w), 1)
+    y = round(rng.uniform(0, height - h), 1)
+    return {
+        "id": ann_id,
+        "image_id": image_id,
+        "category_id": category_id,
+        "bbox": [x, y, w, h],
+        "area": round(w * h, 2),
+        "segmentation": [[x, y, x + w, y, x + w, y + h, x, y + h]] if segmentation else [],
+        "iscrowd": 0,
+    }
+
+
+def generate_split(dataset_name: str, split_dir: Path, num_annotations: int,
+                   boxes_per_image: Tuple[int, int] = (4, 10), image_size: Tuple[int, int] = (320, 200),
+                   seed: int = 0, stats: Optional[SyntheticStats] = None) -> SyntheticStats:
+    """Один источник и разбиение: изображения и _annotations.coco.json в формате экспорта Roboflow."""
+    stats = stats or SyntheticStats()
+    rng = random.Random(f"{seed}:{dataset_name}:{split_dir.name}")
+    _, side = SOURCE_DATASETS[dataset_name]
+    names = SOURCE_CATEGORIES[dataset_name]
+    segmentation = dataset_name.endswith("segmentation")
+    split_dir.mkdir(parents=True, exist_ok=True)
+
+    header = {
+        "info": {"year": "2025", "version": "1", "description": f"Synthetic {dataset_name}"},
+        "licenses": [{"id": 1, "url": "https://creativecommons.org/licenses/by/4.0/", "name": "CC BY 4.0"}],
+        "categories": [{"id": cat_id, "name": name, "supercategory": names[0] if cat_id else "none"}
+                       for cat_id, name in enumerate(names)],
+    }
+    # Несколько вариантов изображения на источник: генерация не упирается в кодирование JPEG
+    variants = [_card_image(side, image_size, rng) for _ in range(4)]
+
+    with CocoStreamWriter(split_dir / "_annotations.coco.json", header) as writer:
+        ann_id = 0
+        image_id = 0
+        while ann_id < num_annotations:
+            file_name = f"{side}_{image_id:07d}.jpg"
+            data = variants[image_id % len(variants)]
+            with open(split_dir / file_name, "wb") as f:
+                f.write(data)
+            writer.write("images", {"id": image_id, "license": 1, "file_name": file_name,
+                                    "height": image_size[1], "width": image_size[0],
+                                    "date_captured": "2025-01-01T00:00:00+00:00"})
+            stats.images += 1
+            stats.image_bytes += len(data)
+
+            for _ in range(min(rng.randint(*boxes_per_image), num_annotations - ann_id)):
+                if rng.random() < GROUP_CATEGORY_RATE:
+                    category_id = 0
+                else:
+                    category_id = rng.randrange(1, len(names))
+                writer.write("annotations", _annotation(ann_id, image_id, category_id, image_size, rng,
+                                                        segmentation))
+                ann_id += 1
+            image_id += 1
+        stats.annotations += ann_id
+    return stats
+
+
+def generate_dataset(data_path: Path, annotations: int, boxes_per_image: Tuple[int, int] = (4, 10),
+                     image_size: Tuple[int, int] = (320, 200), seed: int = 0) -> SyntheticStats:
+    """
+    Три источника во всех разбиениях в data_path; annotations — общее число аннотаций,
+    делится поровну между источниками и по SPLIT_RATIOS между разбиениями.
+    """
+    start = time.perf_counter()
+    stats = SyntheticStats()
+    per_source = annotations / len(SOURCE_DATASETS)
+    for dataset_name, (dirname, _) in SOURCE_DATASETS.items():
+        for split, ratio in SPLIT_RATIOS.items():
+            generate_split(dataset_name, data_path / dirname / split, max(1, round(per_source * ratio)),
+                           boxes_per_image, image_size, seed, stats)
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Генерация синтетических COCO датасетов Emirates ID")
+    parser.add_argument("data_path", type=Path, help="Каталог data, в котором создаются источники")
+    parser.add_argument("--annotations", type=int, default=10000, help="Общее число аннотаций")
+    parser.add_argument("--boxes-per-image", type=int, nargs=2, default=(4, 10), metavar=("MIN", "MAX"))
+    parser.add_argument("--image-size", type=int, nargs=2, default=(320, 200), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    stats = generate_dataset(args.data_path, args.annotations, tuple(args.boxes_per_image),
+                             tuple(args.image_size), args.seed)
+    print(f"Сгенерировано: {stats.summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,27 @@
 """
 Скрипт для визуализации и проверки объединенного датасета Emirates ID.
 """
+import argparse
 import json
 import os
 import random
 from pathlib import Path
-from typing import Dict, List
-import cv2
+from typing import Dict, List, Optional
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
-from collections import defaultdict
+from functools import lru_cache
 
-# Базовый путь к проекту
-BASE_PATH = Path(r"C:\Miral\OCR_PoC")
+from batch_render import RENDER_MODES, RenderStats, find_anomalies, render_images, select_images
+from box_index import place_labels
+from coco_index import CocoIndex
+from coco_records import AnnotationRecord
+from contact_sheet import GROUP_BY, ContactSheetStats, build_contact_sheets
+from coco_stream import load_coco
+from image_cache import CACHE_DIRNAME, ImageCache
+
+# Базовый путь к проекту (переопределяется переменной окружения OCR_POC_BASE)
+BASE_PATH = Path(os.environ.get("OCR_POC_BASE", r"C:\Miral\OCR_PoC"))
 DATASET_PATH = BASE_PATH / "data" / "eid-field-boxes"
 
 # Цвета для каждой категории (RGB normalized)
@@ -36,27 +44,39 @@ def load_dataset_info() -> Dict:
     with open(info_file, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def annotations_path(split: str) -> Path:
+    """Путь к файлу аннотаций указанного разбиения."""
+    return DATASET_PATH / split / "_annotations.coco.json"
+
 def load_annotations(split: str) -> Dict:
     """Загрузка аннотаций для указанного разбиения."""
-    ann_file = DATASET_PATH / split / "_annotations.coco.json"
-    with open(ann_file, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return load_coco(annotations_path(split))
 
-def visualize_image_with_boxes(image_path: Path, annotations: List[Dict], categories: Dict, save_path: Path = None):
+@lru_cache(maxsize=None)
+def image_cache() -> ImageCache:
+    """Общий кэш декодированных изображений и миниатюр (data/.image_cache)."""
+    return ImageCache(DATASET_PATH.parent / CACHE_DIRNAME, store_decoded=True)
+
+@lru_cache(maxsize=None)
+def load_index(split: str) -> CocoIndex:
+    """Индекс разбиения; строится один раз и переиспользуется статистикой и визуализацией."""
+    return CocoIndex.from_file(annotations_path(split))
+
+def visualize_image_with_boxes(image_path: Path, annotations: List[AnnotationRecord], category_names: Dict[int, str], save_path: Path = None):
     """Визуализация изображения с боксами."""
-    # Загрузка изображения
-    img = cv2.imread(str(image_path))
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    # Загрузка изображения (RGB из кэша; декодируется только при первом обращении)
+    img_rgb = image_cache().decoded(image_path)
     
     # Создание фигуры
     fig, ax = plt.subplots(1, figsize=(12, 8))
     ax.imshow(img_rgb)
     
     # Отрисовка боксов
+    labels = []
     for ann in annotations:
-        cat_id = ann['category_id']
-        cat_name = categories[str(cat_id)]['name']
-        bbox = ann['bbox']
+        cat_id = ann.category_id
+        cat_name = category_names.get(cat_id, 'unknown')
+        bbox = ann.bbox
         x, y, w, h = bbox
         
         # Получение цвета для категории
@@ -71,14 +91,31 @@ def visualize_image_with_boxes(image_path: Path, annotations: List[Dict], catego
         )
         ax.add_patch(rect)
         
-        # Добавление подписи
-        ax.text(
+        # Добавление подписи (положение уточняется ниже)
+        labels.append(ax.text(
             x, y - 5, cat_name,
             color=color,
             fontsize=10,
             weight='bold',
+            verticalalignment='top',
             bbox=dict(boxstyle='round,pad=0.3', facecolor='white', alpha=0.8)
-        )
+        ))
+    
+    # Размещение подписей без наложений: размеры текста в координатах изображения
+    if labels:
+        ax.apply_aspect()
+        renderer = fig.canvas.get_renderer()
+        to_data = ax.transData.inverted()
+        label_sizes = []
+        for label in labels:
+            extent = label.get_window_extent(renderer).expanded(1.2, 1.3)
+            (x0, y0), (x1, y1) = to_data.transform([[extent.x0, extent.y0], [extent.x1, extent.y1]])
+            label_sizes.append((abs(x1 - x0), abs(y1 - y0)))
+        boxes = np.array([ann.bbox[:4] for ann in annotations], dtype=np.float64)
+        positions = place_labels(boxes, label_sizes, (img_rgb.shape[1], img_rgb.shape[0]))
+        for label, (lx, ly, lw, lh) in zip(labels, positions):
+            # Подложка выступает за текст на половину запаса, заложенного в размер
+            label.set_position((lx + lw * 0.1 / 1.2, ly + lh * 0.15 / 1.3))
     
     ax.set_title(f"Изображение: {image_path.name}")
     ax.axis('off')
@@ -93,73 +130,44 @@ def analyze_dataset_statistics(split: str):
     """Анализ статистики датасета."""
     print(f"\n=== Анализ разбиения: {split} ===")
     
-    # Загрузка аннотаций
-    data = load_annotations(split)
+    index = load_index(split)
+    categories = index.categories
+    category_counts = index.category_counts()
+    category_boxes_per_image = index.boxes_per_image()
+    source_counts = index.source_counts()
     
     # Общая статистика
-    print(f"Количество изображений: {len(data['images'])}")
-    print(f"Количество аннотаций: {len(data['annotations'])}")
-    print(f"Количество категорий: {len(data['categories'])}")
-    
-    # Статистика по категориям
-    category_counts = defaultdict(int)
-    category_boxes_per_image = defaultdict(list)
-    
-    # Создание маппинга изображений
-    image_map = {img['id']: img for img in data['images']}
-    
-    # Подсчет аннотаций
-    for ann in data['annotations']:
-        cat_id = ann['category_id']
-        img_id = ann['image_id']
-        category_counts[cat_id] += 1
-        category_boxes_per_image[img_id].append(cat_id)
+    print(f"Количество изображений: {len(index.images)}")
+    print(f"Количество аннотаций: {index.num_annotations}")
+    print(f"Количество категорий: {len(categories)}")
     
     # Вывод статистики по категориям
     print("\nСтатистика по категориям:")
-    for cat in data['categories']:
-        cat_id = cat['id']
-        cat_name = cat['name']
-        count = category_counts[cat_id]
+    for cat in categories:
+        cat_id = cat.id
+        cat_name = cat.name
+        count = category_counts.get(cat_id, 0)
         print(f"  {cat_name}: {count} боксов")
     
     # Анализ источников изображений
-    source_counts = defaultdict(int)
-    for img in data['images']:
-        # Определение источника по префиксу имени файла
-        filename = img['file_name']
-        if filename.startswith('eid_back_detection_'):
-            source_counts['back_detection'] += 1
-        elif filename.startswith('eid_front_detection_'):
-            source_counts['front_detection'] += 1
-        elif filename.startswith('eid_front_segmentation_'):
-            source_counts['front_segmentation'] += 1
-    
     print("\nИсточники изображений:")
     for source, count in source_counts.items():
         print(f"  {source}: {count} изображений")
     
     # Среднее количество боксов на изображение
     if len(category_boxes_per_image) > 0:
-        avg_boxes = sum(len(boxes) for boxes in category_boxes_per_image.values()) / len(category_boxes_per_image)
+        avg_boxes = sum(category_boxes_per_image.values()) / len(category_boxes_per_image)
         print(f"\nСреднее количество боксов на изображение: {avg_boxes:.2f}")
 
 def visualize_random_samples(split: str, n_samples: int = 5):
     """Визуализация случайных примеров из датасета."""
     print(f"\nВизуализация {n_samples} случайных изображений из {split}...")
     
-    # Загрузка данных
-    dataset_info = load_dataset_info()
-    data = load_annotations(split)
-    
-    # Создание маппингов
-    image_map = {img['id']: img for img in data['images']}
-    annotations_by_image = defaultdict(list)
-    for ann in data['annotations']:
-        annotations_by_image[ann['image_id']].append(ann)
+    # Загрузка индекса разбиения
+    index = load_index(split)
     
     # Выбор случайных изображений
-    available_images = [img_id for img_id in annotations_by_image.keys() if img_id in image_map]
+    available_images = index.annotated_image_ids()
     sample_image_ids = random.sample(available_images, min(n_samples, len(available_images)))
     
     # Создание директории для сохранения визуализаций
@@ -168,19 +176,92 @@ def visualize_random_samples(split: str, n_samples: int = 5):
     
     # Визуализация каждого изображения
     for idx, img_id in enumerate(sample_image_ids):
-        img_info = image_map[img_id]
-        img_path = DATASET_PATH / split / img_info['file_name']
-        annotations = annotations_by_image[img_id]
+        img_info = index.images[img_id]
+        img_path = DATASET_PATH / split / img_info.file_name
+        annotations = index.annotations_by_image[img_id]
         
         if img_path.exists():
-            save_path = vis_dir / f"sample_{idx + 1}_{img_info['file_name']}"
-            visualize_image_with_boxes(img_path, annotations, dataset_info['categories'], save_path)
+            save_path = vis_dir / f"sample_{idx + 1}_{img_info.file_name}"
+            visualize_image_with_boxes(img_path, annotations, index.category_names, save_path)
             print(f"  Сохранено: {save_path.name}")
         else:
             print(f"  Изображение не найдено: {img_path}")
+    print(f"  Кэш изображений: {image_cache().stats.summary()}")
+
+def render_split(split: str, mode: str = "all", per_source: int = 5, workers: Optional[int] = None,
+                 seed: Optional[int] = None) -> RenderStats:
+    """
+    Пакетная отрисовка разбиения через пул процессов (OpenCV, без фигуры matplotlib на изображение):
+    все изображения, N на источник или только изображения с аномалиями разметки.
+    """
+    index = load_index(split)
+    anomalies = find_anomalies(index) if mode == "anomalies" else None
+    image_ids = select_images(index, mode, per_source=per_source, seed=seed, anomalies=anomalies)
+    output_dir = DATASET_PATH / "visualizations" / split / mode
+    print(f"\nПакетная отрисовка {split} ({mode}): {len(image_ids)} изображений...")
+    
+    stats = render_images(index, image_ids, DATASET_PATH / split, output_dir, CATEGORY_COLORS, workers=workers,
+                          image_cache_dir=DATASET_PATH.parent / CACHE_DIRNAME)
+    if anomalies is not None:
+        with open(output_dir / "anomalies.json", 'w', encoding='utf-8') as f:
+            json.dump({index.images[img_id].file_name: issues for img_id, issues in anomalies.items()},
+                      f, indent=2, ensure_ascii=False)
+    
+    print(f"  Отрисовано: {stats.summary()}")
+    for image_path, error in stats.errors:
+        print(f"  Ошибка: {image_path}: {error}")
+    return stats
+
+def build_split_contact_sheets(split: str, group_by: str = "split", tile_size: int = 256, cols: int = 8,
+                               rows: int = 6, workers: Optional[int] = None) -> ContactSheetStats:
+    """Контактные листы разбиения; плитки хранятся в общем кэше изображений."""
+    index = load_index(split)
+    output_dir = DATASET_PATH / "visualizations" / "contact_sheets" / split / group_by
+    print(f"\nКонтактные листы {split} (группировка: {group_by})...")
+    
+    stats = build_contact_sheets(index, DATASET_PATH / split, output_dir, DATASET_PATH.parent / CACHE_DIRNAME,
+                                 CATEGORY_COLORS, group_by=group_by, tile_size=tile_size, cols=cols, rows=rows,
+                                 workers=workers)
+    print(f"  Готово: {stats.summary()}")
+    return stats
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Разбор аргументов командной строки."""
+    parser = argparse.ArgumentParser(description="Анализ и визуализация объединенного датасета Emirates ID")
+    parser.add_argument("--render", choices=RENDER_MODES, default=None,
+                        help="Пакетная отрисовка вместо случайных примеров")
+    parser.add_argument("--per-source", type=int, default=5,
+                        help="Количество изображений на источник для --render per-source")
+    parser.add_argument("--contact-sheets", choices=GROUP_BY, default=None,
+                        help="Построить контактные листы с группировкой по разбиению, источнику или категории")
+    parser.add_argument("--tile-size", type=int, default=256, help="Размер плитки контактного листа")
+    parser.add_argument("--sheet-grid", type=int, nargs=2, default=(8, 6), metavar=("COLS", "ROWS"),
+                        help="Сетка плиток на одном листе")
+    parser.add_argument("--splits", nargs="+", default=['train', 'valid', 'test'])
+    parser.add_argument("--workers", type=int, default=None, help="Размер пула процессов")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
 
-def main():
+def main(argv: Optional[List[str]] = None):
     """Основная функция."""
+    args = parse_args(argv)
+    
+    if args.contact_sheets:
+        print("=== Контактные листы объединенного датасета Emirates ID ===")
+        cols, rows = args.sheet_grid
+        for split in args.splits:
+            build_split_contact_sheets(split, args.contact_sheets, tile_size=args.tile_size,
+                                       cols=cols, rows=rows, workers=args.workers)
+        print(f"\nКонтактные листы сохранены в: {DATASET_PATH / 'visualizations' / 'contact_sheets'}")
+        return
+    
+    if args.render:
+        print("=== Пакетная отрисовка объединенного датасета Emirates ID ===")
+        for split in args.splits:
+            render_split(split, args.render, per_source=args.per_source, workers=args.workers, seed=args.seed)
+        print(f"\nВизуализации сохранены в: {DATASET_PATH / 'visualizations'}")
+        return
+    
     print("=== Анализ объединенного датасета Emirates ID ===")
     
     # Анализ каждого разбиения
@@ -192,6 +273,7 @@ def main():
     for split in ['train', 'valid', 'test']:
         visualize_random_samples(split, n_samples=3)
     
+    image_cache().close()
     print("\nАнализ завершен!")
     print(f"Визуализации сохранены в: {DATASET_PATH / 'visualizations'}")
 
@@ -2,13 +2,19 @@
 Упрощенный скрипт для анализа объединенного датасета Emirates ID.
 """
 import json
+import os
+import sys
 from pathlib import Path
-from collections import defaultdict
-from typing import Dict, List
+from functools import lru_cache
+from typing import Dict, Optional, TextIO, Tuple
 
-# Базовый путь к проекту
-BASE_PATH = Path(r"C:\Miral\OCR_PoC")
+from coco_columnar import ColumnarCoco, load_columns
+from coco_stream import load_coco
+
+# Базовый путь к проекту (переопределяется переменной окружения OCR_POC_BASE)
+BASE_PATH = Path(os.environ.get("OCR_POC_BASE", r"C:\Miral\OCR_PoC"))
 DATASET_PATH = BASE_PATH / "data" / "eid-field-boxes"
+SPLITS = ['train', 'valid', 'test']
 
 def load_dataset_info() -> Dict:
     """Загрузка информации о датасете."""
@@ -16,173 +22,193 @@ def load_dataset_info() -> Dict:
     with open(info_file, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def annotations_path(split: str) -> Path:
+    """Путь к файлу аннотаций указанного разбиения."""
+    return DATASET_PATH / split / "_annotations.coco.json"
+
 def load_annotations(split: str) -> Dict:
     """Загрузка аннотаций для указанного разбиения."""
-    ann_file = DATASET_PATH / split / "_annotations.coco.json"
-    with open(ann_file, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return load_coco(annotations_path(split))
 
-def analyze_dataset_statistics(split: str):
-    """Анализ статистики датасета."""
-    print(f"\n{'='*50}")
-    print(f"Анализ разбиения: {split.upper()}")
-    print(f"{'='*50}")
+@lru_cache(maxsize=None)
+def load_split_columns(split: str) -> ColumnarCoco:
+    """
+    Колоночные данные разбиения (кэш .npy рядом с аннотациями, загрузка через mmap);
+    загружаются один раз и переиспользуются всеми этапами анализа.
+    """
+    return load_columns(annotations_path(split))
+
+class ReportSinks:
+    """
+    Набор текстовых приемников отчета (консоль, файл и т.п.).
+
+    Каждая строка пишется во все приемники сразу, поэтому отчет формируется за один проход
+    по уже посчитанной статистике; only ограничивает вывод частью приемников.
+    """
+    
+    def __init__(self, **streams: TextIO):
+        self.streams = streams
     
-    # Загрузка аннотаций
-    data = load_annotations(split)
+    def print(self, *args, only: Optional[Tuple[str, ...]] = None, **kwargs):
+        for name, stream in self.streams.items():
+            if only is None or name in only:
+                print(*args, file=stream, **kwargs)
+
+def compute_split_statistics(split: str) -> Dict:
+    """Расчет статистики разбиения (векторизованные подсчеты по колоночным данным)."""
+    columns = load_split_columns(split)
+    category_counts = columns.category_counts()
+    categories = [
+        {**cat, "count": category_counts.get(cat['id'], 0)}
+        for cat in sorted(columns.categories, key=lambda x: x['id'])
+    ]
+    boxes_stats = columns.boxes_per_image_stats()
+    return {
+        "split": split,
+        "num_images": columns.num_images,
+        "num_annotations": columns.num_annotations,
+        "num_categories": len(columns.categories),
+        "categories": categories,
+        "category_counts": category_counts,
+        "total_boxes": sum(cat["count"] for cat in categories),
+        "sources": dict(sorted(columns.source_counts().items())),
+        "source_categories": {source: dict(sorted(counts.items()))
+                              for source, counts in sorted(columns.source_category_counts().items())},
+        "boxes_per_image": None if boxes_stats is None else dict(zip(("avg", "min", "max"), boxes_stats))
+    }
+
+def compute_category_coverage(split_stats: Dict[str, Dict], dataset_info: Dict) -> Dict:
+    """Покрытие категорий по разбиениям на основе уже посчитанной статистики."""
+    all_categories = {int(k): v['name'] for k, v in dataset_info['categories'].items()}
+    rows = []
+    for cat_id in sorted(all_categories.keys()):
+        counts = {split: stats["category_counts"].get(cat_id, 0) for split, stats in split_stats.items()}
+        rows.append({"category": all_categories[cat_id], "counts": counts, "total": sum(counts.values())})
+    totals = {split: sum(stats["category_counts"].values()) for split, stats in split_stats.items()}
+    return {"rows": rows, "totals": totals, "grand_total": sum(totals.values())}
+
+def render_split_statistics(stats: Dict, sinks: ReportSinks):
+    """Вывод статистики разбиения."""
+    sinks.print(f"\n{'='*50}")
+    sinks.print(f"Анализ разбиения: {stats['split'].upper()}")
+    sinks.print(f"{'='*50}")
     
     # Общая статистика
-    print(f"\nОбщая статистика:")
-    print(f"  • Количество изображений: {len(data['images'])}")
-    print(f"  • Количество аннотаций: {len(data['annotations'])}")
-    print(f"  • Количество категорий: {len(data['categories'])}")
-    
-    # Статистика по категориям
-    category_counts = defaultdict(int)
-    category_boxes_per_image = defaultdict(list)
-    annotations_by_source = defaultdict(lambda: defaultdict(int))
-    
-    # Создание маппинга изображений
-    image_map = {img['id']: img for img in data['images']}
-    
-    # Подсчет аннотаций
-    for ann in data['annotations']:
-        cat_id = ann['category_id']
-        img_id = ann['image_id']
-        category_counts[cat_id] += 1
-        category_boxes_per_image[img_id].append(cat_id)
-        
-        # Определение источника
-        if img_id in image_map:
-            filename = image_map[img_id]['file_name']
-            if filename.startswith('eid_back_detection_'):
-                source = 'back_detection'
-            elif filename.startswith('eid_front_detection_'):
-                source = 'front_detection'
-            elif filename.startswith('eid_front_segmentation_'):
-                source = 'front_segmentation'
-            else:
-                source = 'unknown'
-            
-            cat_name = next((cat['name'] for cat in data['categories'] if cat['id'] == cat_id), 'unknown')
-            annotations_by_source[source][cat_name] += 1
+    sinks.print(f"\nОбщая статистика:")
+    sinks.print(f"  • Количество изображений: {stats['num_images']}")
+    sinks.print(f"  • Количество аннотаций: {stats['num_annotations']}")
+    sinks.print(f"  • Количество категорий: {stats['num_categories']}")
     
     # Вывод статистики по категориям
-    print("\nСтатистика по категориям:")
-    total_boxes = 0
-    for cat in sorted(data['categories'], key=lambda x: x['id']):
-        cat_id = cat['id']
-        cat_name = cat['name']
-        cat_supercat = cat['supercategory']
-        count = category_counts[cat_id]
-        total_boxes += count
-        print(f"  • {cat_name:<20} ({cat_supercat:<20}): {count:>4} боксов")
-    print(f"  {'─'*60}")
-    print(f"  {'ИТОГО:':<43} {total_boxes:>4} боксов")
+    sinks.print("\nСтатистика по категориям:")
+    for cat in stats['categories']:
+        sinks.print(f"  • {cat['name']:<20} ({cat['supercategory']:<20}): {cat['count']:>4} боксов")
+    sinks.print(f"  {'─'*60}")
+    sinks.print(f"  {'ИТОГО:':<43} {stats['total_boxes']:>4} боксов")
     
     # Анализ источников изображений
-    source_counts = defaultdict(int)
-    for img in data['images']:
-        filename = img['file_name']
-        if filename.startswith('eid_back_detection_'):
-            source_counts['back_detection'] += 1
-        elif filename.startswith('eid_front_detection_'):
-            source_counts['front_detection'] += 1
-        elif filename.startswith('eid_front_segmentation_'):
-            source_counts['front_segmentation'] += 1
-    
-    print("\nИсточники изображений:")
-    for source, count in sorted(source_counts.items()):
-        print(f"  • {source:<20}: {count:>3} изображений")
+    sinks.print("\nИсточники изображений:")
+    for source, count in stats['sources'].items():
+        sinks.print(f"  • {source:<20}: {count:>3} изображений")
     
     # Детальная статистика по источникам
-    print("\nДетальная статистика по источникам и категориям:")
-    for source in sorted(annotations_by_source.keys()):
-        print(f"\n  {source}:")
-        for cat_name, count in sorted(annotations_by_source[source].items()):
-            print(f"    • {cat_name:<20}: {count:>3}")
+    sinks.print("\nДетальная статистика по источникам и категориям:")
+    for source, counts in stats['source_categories'].items():
+        sinks.print(f"\n  {source}:")
+        for cat_name, count in counts.items():
+            sinks.print(f"    • {cat_name:<20}: {count:>3}")
     
     # Среднее количество боксов на изображение
-    if len(category_boxes_per_image) > 0:
-        avg_boxes = sum(len(boxes) for boxes in category_boxes_per_image.values()) / len(category_boxes_per_image)
-        min_boxes = min(len(boxes) for boxes in category_boxes_per_image.values())
-        max_boxes = max(len(boxes) for boxes in category_boxes_per_image.values())
-        print(f"\nСтатистика боксов на изображение:")
-        print(f"  • Среднее: {avg_boxes:.2f}")
-        print(f"  • Минимум: {min_boxes}")
-        print(f"  • Максимум: {max_boxes}")
+    boxes = stats['boxes_per_image']
+    if boxes is not None:
+        sinks.print(f"\nСтатистика боксов на изображение:")
+        sinks.print(f"  • Среднее: {boxes['avg']:.2f}")
+        sinks.print(f"  • Минимум: {boxes['min']}")
+        sinks.print(f"  • Максимум: {boxes['max']}")
 
-def analyze_category_coverage():
-    """Анализ покрытия категорий по всем разбиениям."""
-    print(f"\n{'='*50}")
-    print("АНАЛИЗ ПОКРЫТИЯ КАТЕГОРИЙ")
-    print(f"{'='*50}")
-    
-    dataset_info = load_dataset_info()
-    all_categories = {int(k): v['name'] for k, v in dataset_info['categories'].items()}
-    
-    coverage_by_split = {}
-    
-    for split in ['train', 'valid', 'test']:
-        data = load_annotations(split)
-        category_counts = defaultdict(int)
-        
-        for ann in data['annotations']:
-            category_counts[ann['category_id']] += 1
-        
-        coverage_by_split[split] = category_counts
+def render_category_coverage(coverage: Dict, sinks: ReportSinks):
+    """Вывод таблицы покрытия категорий."""
+    sinks.print(f"\n{'='*50}")
+    sinks.print("АНАЛИЗ ПОКРЫТИЯ КАТЕГОРИЙ")
+    sinks.print(f"{'='*50}")
     
     # Вывод таблицы покрытия
-    print(f"\n{'Категория':<20} {'Train':>10} {'Valid':>10} {'Test':>10} {'Всего':>10}")
-    print("─" * 65)
+    sinks.print(f"\n{'Категория':<20} {'Train':>10} {'Valid':>10} {'Test':>10} {'Всего':>10}")
+    sinks.print("─" * 65)
     
-    for cat_id in sorted(all_categories.keys()):
-        cat_name = all_categories[cat_id]
-        train_count = coverage_by_split['train'].get(cat_id, 0)
-        valid_count = coverage_by_split['valid'].get(cat_id, 0)
-        test_count = coverage_by_split['test'].get(cat_id, 0)
-        total_count = train_count + valid_count + test_count
-        
-        print(f"{cat_name:<20} {train_count:>10} {valid_count:>10} {test_count:>10} {total_count:>10}")
+    for row in coverage['rows']:
+        counts = row['counts']
+        sinks.print(f"{row['category']:<20} {counts['train']:>10} {counts['valid']:>10} {counts['test']:>10} {row['total']:>10}")
     
     # Общие итоги
-    print("─" * 65)
-    total_train = sum(coverage_by_split['train'].values())
-    total_valid = sum(coverage_by_split['valid'].values())
-    total_test = sum(coverage_by_split['test'].values())
-    grand_total = total_train + total_valid + total_test
-    
-    print(f"{'ИТОГО:':<20} {total_train:>10} {total_valid:>10} {total_test:>10} {grand_total:>10}")
+    sinks.print("─" * 65)
+    totals = coverage['totals']
+    sinks.print(f"{'ИТОГО:':<20} {totals['train']:>10} {totals['valid']:>10} {totals['test']:>10} {coverage['grand_total']:>10}")
 
-def save_summary_report():
-    """Сохранение сводного отчета о датасете."""
+def _to_json(stats: Dict) -> Dict:
+    """Статистика разбиения в машиночитаемом виде (без служебного маппинга по id)."""
+    return {k: v for k, v in stats.items() if k != "category_counts"}
+
+def analyze_dataset_statistics(split: str):
+    """Анализ статистики датасета."""
+    render_split_statistics(compute_split_statistics(split), ReportSinks(console=sys.stdout))
+
+def analyze_category_coverage():
+    """Анализ покрытия категорий по всем разбиениям."""
+    split_stats = {split: compute_split_statistics(split) for split in SPLITS}
+    render_category_coverage(compute_category_coverage(split_stats, load_dataset_info()),
+                             ReportSinks(console=sys.stdout))
+
+def generate_report(console: Optional[TextIO] = None) -> Dict:
+    """
+    Формирование отчета за один проход: статистика каждого разбиения считается один раз
+    и одновременно выводится в консоль и в dataset_summary.txt, а также сохраняется
+    в dataset_summary.json.
+    """
     report_path = DATASET_PATH / "dataset_summary.txt"
+    json_path = DATASET_PATH / "dataset_summary.json"
+    console = console or sys.stdout
     
-    # Перенаправление вывода в файл
-    import sys
-    original_stdout = sys.stdout
+    split_stats = {split: compute_split_statistics(split) for split in SPLITS}
+    coverage = compute_category_coverage(split_stats, load_dataset_info())
     
     with open(report_path, 'w', encoding='utf-8') as f:
-        sys.stdout = f
+        sinks = ReportSinks(console=console, file=f)
         
-        print("ОБЪЕДИНЕННЫЙ ДАТАСЕТ EMIRATES ID - СВОДНЫЙ ОТЧЕТ")
-        print("=" * 70)
-        print(f"Дата создания: 2025-01-17")
-        print(f"Версия: 1.0")
-        print("=" * 70)
+        sinks.print("ОБЪЕДИНЕННЫЙ ДАТАСЕТ EMIRATES ID - СВОДНЫЙ ОТЧЕТ", only=("file",))
+        sinks.print("=" * 70, only=("file",))
+        sinks.print(f"Дата создания: 2025-01-17", only=("file",))
+        sinks.print(f"Версия: 1.0", only=("file",))
+        sinks.print("=" * 70, only=("file",))
         
         # Анализ каждого разбиения
-        for split in ['train', 'valid', 'test']:
-            analyze_dataset_statistics(split)
+        for split in SPLITS:
+            render_split_statistics(split_stats[split], sinks)
         
         # Анализ покрытия категорий
-        analyze_category_coverage()
+        render_category_coverage(coverage, sinks)
         
-        print("\n" + "=" * 70)
-        print("Отчет сохранен успешно!")
-    
-    sys.stdout = original_stdout
-    print(f"\nСводный отчет сохранен в: {report_path}")
+        sinks.print("\n" + "=" * 70, only=("file",))
+        sinks.print("Отчет сохранен успешно!", only=("file",))
+    
+    report = {
+        "date_created": "2025-01-17",
+        "version": "1.0",
+        "splits": {split: _to_json(stats) for split, stats in split_stats.items()},
+        "coverage": coverage
+    }
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    
+    print(f"\nСводный отчет сохранен в: {report_path}", file=console)
+    print(f"Машиночитаемый отчет сохранен в: {json_path}", file=console)
+    return report
+
+def save_summary_report():
+    """Сохранение сводного отчета о датасете."""
+    with open(os.devnull, 'w', encoding='utf-8') as devnull:
+        generate_report(console=devnull)
+    print(f"\nСводный отчет сохранен в: {DATASET_PATH / 'dataset_summary.txt'}")
 
 def main():
     """Основная функция."""
@@ -190,19 +216,12 @@ def main():
     print("АНАЛИЗ ОБЪЕДИНЕННОГО ДАТАСЕТА EMIRATES ID")
     print("="*70)
     
-    # Анализ каждого разбиения
-    for split in ['train', 'valid', 'test']:
-        analyze_dataset_statistics(split)
-    
-    # Анализ покрытия категорий
-    analyze_category_coverage()
-    
-    # Сохранение сводного отчета
-    save_summary_report()
+    # Статистика считается один раз и выводится одновременно в консоль, текстовый и JSON отчеты
+    generate_report()
     
     print("\n" + "="*70)
     print("Анализ завершен успешно!")
     print("="*70)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()